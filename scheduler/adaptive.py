@@ -0,0 +1,78 @@
+import os
+import math
+
+POLL_INTERVAL_MIN = float(os.getenv("POLL_INTERVAL_MIN", "10"))
+POLL_INTERVAL_MAX = float(os.getenv("POLL_INTERVAL_MAX", "300"))
+POLL_BACKOFF = float(os.getenv("POLL_BACKOFF", "2"))
+# No device override can poll more often than this.
+POLL_INTERVAL_FLOOR = float(os.getenv("POLL_INTERVAL_FLOOR", "1"))
+
+
+class AdaptiveIntervals:
+    """Per-device polling intervals driven by how often the device changes.
+
+    The worker stamps ``poll_changed_at`` on the device document whenever a
+    poll differs from the previous one. A device that changed since its last
+    dispatch drops back to its minimum interval; a stable one backs off by
+    ``backoff`` each poll up to its maximum. A device document can override
+    the bounds with ``poll_interval_min``/``poll_interval_max``, or pin a fixed
+    interval with ``poll_interval``. Overrides that are not positive numbers
+    are ignored (and logged once); valid ones are clamped to
+    ``POLL_INTERVAL_FLOOR``.
+    """
+
+    def __init__(
+        self,
+        minimum=POLL_INTERVAL_MIN,
+        maximum=POLL_INTERVAL_MAX,
+        backoff=POLL_BACKOFF,
+    ):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self._intervals = {}
+        self._changed_at = {}
+        self._invalid = set()
+
+    def forget(self, key):
+        self._intervals.pop(key, None)
+        self._changed_at.pop(key, None)
+        self._invalid = {entry for entry in self._invalid if entry[0] != key}
+
+    def _override(self, key, device, field):
+        """Return the device's ``field`` override in seconds, or ``None``."""
+        value = device.get(field)
+        if value is None or value == "":
+            return None
+        try:
+            seconds = float(value)
+        except (TypeError, ValueError):
+            seconds = math.nan
+        if isinstance(value, bool) or not math.isfinite(seconds) or seconds <= 0:
+            if (key, field, repr(value)) not in self._invalid:
+                self._invalid.add((key, field, repr(value)))
+                print(f"Ignoring {field}={value!r} of {key}: not a positive number")
+            return None
+        return max(seconds, POLL_INTERVAL_FLOOR)
+
+    def next_interval(self, key, device):
+        if device is None:
+            self.forget(key)
+            return self.minimum
+        fixed = self._override(key, device, "poll_interval")
+        if fixed is not None:
+            return fixed
+
+        minimum = self._override(key, device, "poll_interval_min") or self.minimum
+        maximum = self._override(key, device, "poll_interval_max") or self.maximum
+        maximum = max(minimum, maximum)
+        changed_at = device.get("poll_changed_at")
+        current = self._intervals.get(key)
+        if current is None or changed_at != self._changed_at.get(key):
+            interval = minimum
+        else:
+            interval = current * self.backoff
+        interval = min(max(interval, minimum), maximum)
+        self._intervals[key] = interval
+        self._changed_at[key] = changed_at
+        return interval
@@ -0,0 +1,93 @@
+import heapq
+import itertools
+import math
+import time
+import zlib
+
+
+def phase_offset(key, interval):
+    """Stable offset in ``[0, interval)`` derived from a device key."""
+    digest = zlib.crc32(repr(key).encode("utf-8"))
+    return digest / 2**32 * interval
+
+
+class DispatchQueue:
+    """Min-heap of per-device due times.
+
+    Each device is polled once per ``interval`` at its own phase offset, so a
+    fleet's jobs are spread across the interval instead of being sent in one
+    burst. With ``spread=False`` every device shares phase 0, which is the
+    old all-at-once behaviour.
+    """
+
+    def __init__(self, interval, spread=True, clock=time.monotonic):
+        self.interval = interval
+        self.spread = spread
+        self.clock = clock
+        self._epoch = clock()
+        self._heap = []
+        self._due = {}
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._due)
+
+    def _push(self, key, due):
+        self._due[key] = due
+        heapq.heappush(self._heap, (due, next(self._counter), key))
+
+    def _first_due(self, key, now):
+        phase = phase_offset(key, self.interval) if self.spread else 0.0
+        cycles = math.ceil((now - self._epoch - phase) / self.interval)
+        return self._epoch + phase + max(cycles, 0) * self.interval
+
+    def sync(self, keys):
+        """Schedule new devices and forget ones that have been removed.
+
+        Returns the removed keys.
+        """
+        now = self.clock()
+        for key in keys - self._due.keys():
+            self._push(key, self._first_due(key, now))
+        removed = self._due.keys() - keys
+        for key in removed:
+            # Heap entries for removed keys are dropped lazily when popped.
+            del self._due[key]
+        return removed
+
+    def _discard_stale(self):
+        while self._heap:
+            due, _, key = self._heap[0]
+            if self._due.get(key) == due:
+                return
+            heapq.heappop(self._heap)
+
+    def next_due(self):
+        self._discard_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now, interval_for=None):
+        """Return ``(key, lag, missed, interval)`` for devices due at ``now``.
+
+        ``lag`` is how late the dispatch is in seconds and ``missed`` how many
+        whole intervals were skipped because the loop fell behind. If given,
+        ``interval_for(key)`` picks the ``interval`` until the device's next
+        poll.
+        """
+        ready = []
+        while True:
+            self._discard_stale()
+            if not self._heap or self._heap[0][0] > now:
+                return ready
+            due, _, key = heapq.heappop(self._heap)
+            interval = interval_for(key) if interval_for else self.interval
+            if not interval > 0:
+                # next_due would never pass now and this loop would spin.
+                interval = self.interval
+            next_due = due + interval
+            missed = 0
+            if next_due <= now:
+                missed = int((now - next_due) // interval) + 1
+                next_due += missed * interval
+            self._push(key, next_due)
+            ready.append((key, now - due, missed, interval))
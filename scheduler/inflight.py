@@ -0,0 +1,50 @@
+import os
+
+INFLIGHT_GRACE = float(os.getenv("INFLIGHT_GRACE", "30"))
+
+
+class InFlight:
+    """Tracks the outstanding poll job for each device.
+
+    A job counts as in flight until its worker reports back or until its
+    message TTL plus ``grace`` seconds have passed, which covers jobs that
+    expired in the queue or whose reply was lost.
+    """
+
+    def __init__(self, grace=INFLIGHT_GRACE):
+        self.grace = grace
+        self._jobs = {}
+        self._keys = {}
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def busy(self, key, now):
+        job = self._jobs.get(key)
+        if job is None:
+            return False
+        job_id, deadline = job
+        if deadline > now:
+            return True
+        self._forget(key, job_id)
+        return False
+
+    def start(self, key, job_id, ttl, now):
+        self._jobs[key] = (job_id, now + ttl + self.grace)
+        self._keys[job_id] = key
+
+    def finish(self, job_id):
+        key = self._keys.get(job_id)
+        if key is not None:
+            self._forget(key, job_id)
+
+    def forget(self, key):
+        """Drop a removed device; a late reply for its job is ignored."""
+        job = self._jobs.get(key)
+        if job is not None:
+            self._forget(key, job[0])
+
+    def _forget(self, key, job_id):
+        self._keys.pop(job_id, None)
+        if self._jobs.get(key, (None,))[0] == job_id:
+            del self._jobs[key]
@@ -0,0 +1,176 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta, UTC
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from database import db, get_router_info, get_switch_info
+
+INVENTORY_RESYNC_INTERVAL = float(os.getenv("INVENTORY_RESYNC_INTERVAL", "300"))
+# Without change streams, added, removed and changed devices are picked up
+# this often; the full reload still runs every INVENTORY_RESYNC_INTERVAL.
+INVENTORY_POLL_INTERVAL = float(os.getenv("INVENTORY_POLL_INTERVAL", "10"))
+# Overlap between refreshes, for clock skew between the services writing.
+CLOCK_SKEW = timedelta(seconds=5)
+
+ROUTER_COLLECTION = "mycollection"
+SWITCH_COLLECTION = "switch"
+
+
+class Inventory:
+    """In-memory index of routers and switches for the scheduler loop.
+
+    The index is loaded once and then kept current from a change stream on
+    the device collections, so reading it never touches MongoDB. When change
+    streams are unavailable (standalone mongod) or the stream breaks, every
+    ``poll_interval`` seconds the device ids are listed and only new devices
+    and those with a newer ``updated_at`` or ``poll_changed_at`` are read;
+    the whole index is reloaded every ``resync_interval`` seconds.
+    """
+
+    def __init__(
+        self,
+        resync_interval=INVENTORY_RESYNC_INTERVAL,
+        poll_interval=INVENTORY_POLL_INTERVAL,
+    ):
+        self.resync_interval = resync_interval
+        self.poll_interval = poll_interval
+        self._devices = {ROUTER_COLLECTION: {}, SWITCH_COLLECTION: {}}
+        self._lock = threading.Lock()
+        self.version = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.resync()
+        self._thread = threading.Thread(
+            target=self._watch, name="inventory-watch", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def resync(self):
+        routers = {doc["_id"]: doc for doc in get_router_info()}
+        switches = {doc["_id"]: doc for doc in get_switch_info()}
+        with self._lock:
+            self._devices[ROUTER_COLLECTION] = routers
+            self._devices[SWITCH_COLLECTION] = switches
+            self.version += 1
+        print(f"Inventory loaded: {len(routers)} routers, {len(switches)} switches")
+
+    def refresh(self, since):
+        """Apply devices added, removed or changed since ``since``.
+
+        Returns the ``since`` to pass next time.
+        """
+        started = datetime.now(UTC)
+        changed = {
+            "$or": [
+                {"updated_at": {"$gte": since}},
+                {"poll_changed_at": {"$gte": since}},
+            ]
+        }
+        found = {}
+        for collection in self._devices:
+            ids = {doc["_id"] for doc in db[collection].find({}, {"_id": 1})}
+            with self._lock:
+                new = list(ids - self._devices[collection].keys())
+            query = {"$or": [changed, {"_id": {"$in": new}}]} if new else changed
+            found[collection] = (
+                ids,
+                {doc["_id"]: doc for doc in db[collection].find(query)},
+            )
+        with self._lock:
+            modified = False
+            for collection, (ids, docs) in found.items():
+                devices = self._devices[collection]
+                for key in devices.keys() - ids:
+                    del devices[key]
+                    modified = True
+                for key, doc in docs.items():
+                    if key in ids and devices.get(key) != doc:
+                        devices[key] = doc
+                        modified = True
+            if modified:
+                self.version += 1
+        return started - CLOCK_SKEW
+
+    def routers(self):
+        with self._lock:
+            return list(self._devices[ROUTER_COLLECTION].values())
+
+    def switches(self):
+        with self._lock:
+            return list(self._devices[SWITCH_COLLECTION].values())
+
+    def keys(self):
+        """Return ``(collection, _id)`` keys for every known device."""
+        with self._lock:
+            return {
+                (collection, key)
+                for collection, devices in self._devices.items()
+                for key in devices
+            }
+
+    def get(self, key):
+        collection, _id = key
+        with self._lock:
+            return self._devices[collection].get(_id)
+
+    def _apply(self, change):
+        collection = change["ns"]["coll"]
+        operation = change["operationType"]
+        if operation in ("drop", "rename", "invalidate"):
+            self.resync()
+            return
+        key = change["documentKey"]["_id"]
+        document = change.get("fullDocument")
+        with self._lock:
+            devices = self._devices[collection]
+            if operation == "delete" or document is None:
+                devices.pop(key, None)
+            else:
+                devices[key] = document
+            self.version += 1
+
+    def _stream(self):
+        pipeline = [
+            {"$match": {"ns.coll": {"$in": [ROUTER_COLLECTION, SWITCH_COLLECTION]}}}
+        ]
+        with db.watch(
+            pipeline, full_document="updateLookup", max_await_time_ms=1000
+        ) as stream:
+            # Reload after the stream is open so no change falls in between.
+            self.resync()
+            while not self._stop.is_set() and stream.alive:
+                change = stream.try_next()
+                if change is not None:
+                    self._apply(change)
+
+    def _watch(self):
+        use_stream = True
+        since = datetime.now(UTC) - CLOCK_SKEW
+        next_resync = time.monotonic() + self.resync_interval
+        while not self._stop.is_set():
+            if use_stream:
+                try:
+                    self._stream()
+                    continue
+                except OperationFailure as e:
+                    print(f"Change streams unavailable ({e}), polling for changes")
+                    use_stream = False
+                except PyMongoError as e:
+                    print(f"Inventory change stream failed: {e}")
+            self._stop.wait(self.poll_interval)
+            try:
+                if time.monotonic() >= next_resync:
+                    self.resync()
+                    next_resync = time.monotonic() + self.resync_interval
+                else:
+                    since = self.refresh(since)
+            except PyMongoError as e:
+                print(f"Inventory resync failed: {e}")
+                time.sleep(3)
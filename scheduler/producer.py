@@ -1,44 +1,148 @@
 import os
+import time
+
 import pika
+from pika.exceptions import (
+    AMQPConnectionError,
+    AMQPChannelError,
+    AMQPError,
+    NackError,
+    UnroutableError,
+)
+
+EXCHANGE = "jobs"
+ROUTER_QUEUE = "router_jobs"
+ROUTER_KEY = "check_interfaces"
+SWITCH_QUEUE = "switch_jobs"
+SWITCH_KEY = "check_switch"
+BINDINGS = (
+    (ROUTER_QUEUE, ROUTER_KEY),
+    (SWITCH_QUEUE, SWITCH_KEY),
+)
+
 
+class Producer:
+    """Long-lived RabbitMQ publisher for the scheduler.
 
-def produce_router(host, body):
-    rabbitmq_user = os.getenv("RABBITMQ_DEFAULT_USER")
-    rabbitmq_pass = os.getenv("RABBITMQ_DEFAULT_PASS")
+    The connection and channel stay open between ticks, the exchange and
+    queues are declared once per connection, and the channel runs in
+    publisher-confirm mode so every message in a batch is known to have
+    reached the broker. A dropped connection is re-opened and the unsent
+    part of the batch is retried.
+    """
 
-    credentials = pika.PlainCredentials(rabbitmq_user, rabbitmq_pass)
-    parameters = pika.ConnectionParameters(host, credentials=credentials)
-    connection = pika.BlockingConnection(parameters)
-    channel = connection.channel()
+    def __init__(self, host, retries=5, retry_delay=3.0, on_reply=None):
+        self.host = host
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.on_reply = on_reply
+        self.connection = None
+        self.channel = None
+        self.reply_queue = None
 
-    channel.exchange_declare(exchange="jobs", exchange_type="direct")
-    channel.queue_declare(queue="router_jobs")
-    channel.queue_bind(
-        queue="router_jobs", exchange="jobs", routing_key="check_interfaces"
-    )
+    def connect(self):
+        rabbitmq_user = os.getenv("RABBITMQ_DEFAULT_USER")
+        rabbitmq_pass = os.getenv("RABBITMQ_DEFAULT_PASS")
 
-    channel.basic_publish(exchange="jobs", routing_key="check_interfaces", body=body)
+        credentials = pika.PlainCredentials(rabbitmq_user, rabbitmq_pass)
+        parameters = pika.ConnectionParameters(self.host, credentials=credentials)
+        self.connection = pika.BlockingConnection(parameters)
+        self.channel = self.connection.channel()
 
-    connection.close()
+        self.channel.exchange_declare(exchange=EXCHANGE, exchange_type="direct")
+        for queue, routing_key in BINDINGS:
+            self.channel.queue_declare(queue=queue)
+            self.channel.queue_bind(
+                queue=queue, exchange=EXCHANGE, routing_key=routing_key
+            )
+        if self.on_reply is not None:
+            # Workers report finished jobs here; the queue lives as long as
+            # this connection.
+            result = self.channel.queue_declare(queue="", exclusive=True)
+            self.reply_queue = result.method.queue
+            self.channel.basic_consume(
+                queue=self.reply_queue,
+                on_message_callback=self._handle_reply,
+                auto_ack=True,
+            )
+        self.channel.confirm_delivery()
 
+    def _handle_reply(self, ch, method, props, body):
+        self.on_reply(props.correlation_id, body)
 
-def produce_switch(host, body):
-    rabbitmq_user = os.getenv("RABBITMQ_DEFAULT_USER")
-    rabbitmq_pass = os.getenv("RABBITMQ_DEFAULT_PASS")
+    def _ensure_connected(self):
+        if self.connection is not None and self.connection.is_open:
+            return
+        for attempt in range(self.retries):
+            try:
+                self.connect()
+                return
+            except AMQPConnectionError as e:
+                print(f"Connecting to RabbitMQ failed (try {attempt}): {e}")
+                time.sleep(self.retry_delay)
+        raise AMQPConnectionError(f"Could not connect to RabbitMQ at {self.host}")
 
-    credentials = pika.PlainCredentials(rabbitmq_user, rabbitmq_pass)
-    parameters = pika.ConnectionParameters(host, credentials=credentials)
-    connection = pika.BlockingConnection(parameters)
-    channel = connection.channel()
+    def publish_batch(self, messages):
+        """Publish ``(routing_key, body, properties)`` tuples with confirms.
 
-    channel.exchange_declare(exchange="jobs", exchange_type="direct")
-    channel.queue_declare(queue="switch_jobs")
-    channel.queue_bind(queue="switch_jobs", exchange="jobs", routing_key="check_switch")
+        ``properties`` may be None. When replies are enabled each message's
+        ``reply_to`` is pointed at this connection's reply queue. Returns the
+        number of messages the broker confirmed; rejected ones are logged
+        and skipped.
+        """
+        confirmed = 0
+        pending = list(messages)
+        attempts = 0
+        while pending:
+            self._ensure_connected()
+            try:
+                while pending:
+                    routing_key, body, properties = pending[0]
+                    if self.reply_queue is not None:
+                        properties = properties or pika.BasicProperties()
+                        properties.reply_to = self.reply_queue
+                    try:
+                        self.channel.basic_publish(
+                            exchange=EXCHANGE,
+                            routing_key=routing_key,
+                            body=body,
+                            properties=properties,
+                            mandatory=True,
+                        )
+                        confirmed += 1
+                    except (NackError, UnroutableError) as e:
+                        print(f"Broker rejected message for {routing_key}: {e}")
+                    pending.pop(0)
+            except (AMQPConnectionError, AMQPChannelError) as e:
+                attempts += 1
+                print(f"Publishing failed ({e}), reconnecting")
+                self.close()
+                if attempts >= self.retries:
+                    raise
+        return confirmed
 
-    channel.basic_publish(exchange="jobs", routing_key="check_switch", body=body)
+    def sleep(self, seconds):
+        """Sleep while still servicing heartbeats on the open connection."""
+        if self.connection is not None and self.connection.is_open:
+            try:
+                self.connection.sleep(seconds)
+                return
+            except AMQPError as e:
+                print(f"RabbitMQ connection lost while idle: {e}")
+                self.close()
+        time.sleep(seconds)
 
-    connection.close()
+    def close(self):
+        connection, self.connection, self.channel = self.connection, None, None
+        self.reply_queue = None
+        if connection is not None and connection.is_open:
+            try:
+                connection.close()
+            except Exception:
+                pass
 
 
 if __name__ == "__main__":
-    produce_router("localhost", "192.168.1.44")
+    producer = Producer("localhost")
+    producer.publish_batch([(ROUTER_KEY, b"192.168.1.44", None)])
+    producer.close()
@@ -1,36 +1,107 @@
 import time
 import os
+import itertools
+import pika
 from bson import json_util
-from producer import produce_router, produce_switch
-from database import get_router_info, get_switch_info
+from producer import Producer, ROUTER_KEY, SWITCH_KEY
+from inventory import Inventory, ROUTER_COLLECTION
+from dispatch import DispatchQueue
+from adaptive import AdaptiveIntervals, POLL_INTERVAL_MIN
+from inflight import InFlight
+from database import db
+from schema import ensure_indexes
+
+SCHEDULER_SPREAD = os.getenv("SCHEDULER_SPREAD", "1") != "0"
+MAX_SLEEP = 1.0
 
 
 def scheduler():
 
-    INTERVAL = 10.0
-    next_run = time.monotonic()
+    INTERVAL = POLL_INTERVAL_MIN
     count = 0
-    host = os.getenv("RABBITMQ_HOST")
+    try:
+        ensure_indexes(db)
+    except Exception as e:
+        print(f"Could not create indexes: {e}")
+    in_flight = InFlight()
+    producer = Producer(
+        os.getenv("RABBITMQ_HOST"),
+        on_reply=lambda job_id, body: in_flight.finish(job_id),
+    )
+    job_ids = itertools.count()
+    inventory = Inventory()
+    inventory.start()
+    queue = DispatchQueue(INTERVAL, spread=SCHEDULER_SPREAD)
+    intervals = AdaptiveIntervals()
+    inventory_version = None
+    cycle_end = time.monotonic() + INTERVAL
+    sent = missed = coalesced = 0
+    max_lag = 0.0
     while True:
-        now = time.time()
-        now_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now))
-        ms = int((now % 1) * 1000)
-        now_str_with_ms = f"{now_str}.{ms:03d}"
-        print(f"[{now_str_with_ms}] run #{count}")
-
-        try:
-            for data in get_router_info():
-                body_bytes = json_util.dumps(data).encode("utf-8")
-                produce_router(host, body_bytes)
-            for datas in get_switch_info():
-                body_bytes = json_util.dumps(datas).encode("utf-8")
-                produce_switch(host, body_bytes)
-        except Exception as e:
-            print(e)
-            time.sleep(3)
-        count += 1
-        next_run += INTERVAL
-        time.sleep(max(0.0, next_run - time.monotonic()))
+        if inventory.version != inventory_version:
+            inventory_version = inventory.version
+            for key in queue.sync(inventory.keys()):
+                intervals.forget(key)
+                in_flight.forget(key)
+
+        now = time.monotonic()
+        jobs = []
+        due = queue.pop_due(
+            now, lambda key: intervals.next_interval(key, inventory.get(key))
+        )
+        for key, lag, skipped, interval in due:
+            max_lag = max(max_lag, lag)
+            missed += skipped
+            data = inventory.get(key)
+            if data is None:
+                continue
+            if in_flight.busy(key, now):
+                # The previous poll is still queued or running; skip this one.
+                coalesced += 1
+                continue
+            job_id = f"{os.getpid()}-{next(job_ids)}"
+            # A poll still queued when the next one is due is stale.
+            properties = pika.BasicProperties(
+                correlation_id=job_id, expiration=str(int(interval * 1000))
+            )
+            routing_key = ROUTER_KEY if key[0] == ROUTER_COLLECTION else SWITCH_KEY
+            # The worker keeps its SSH session about this long for the next poll.
+            body_bytes = json_util.dumps(dict(data, interval=interval)).encode("utf-8")
+            jobs.append((routing_key, body_bytes, properties))
+            in_flight.start(key, job_id, interval, now)
+
+        if jobs:
+            try:
+                sent += producer.publish_batch(jobs)
+            except Exception as e:
+                print(e)
+                for _, _, properties in jobs:
+                    in_flight.finish(properties.correlation_id)
+                time.sleep(3)
+
+        if now >= cycle_end:
+            wall = time.time()
+            now_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(wall))
+            ms = int((wall % 1) * 1000)
+            now_str_with_ms = f"{now_str}.{ms:03d}"
+            print(
+                f"[{now_str_with_ms}] run #{count}: {sent} jobs for "
+                f"{len(queue)} devices, max lag {max_lag:.2f}s"
+            )
+            if missed:
+                print(f"  cycle overran: {missed} device polls missed")
+            if coalesced:
+                print(f"  skipped {coalesced} polls for devices still in flight")
+            count += 1
+            sent = missed = coalesced = 0
+            max_lag = 0.0
+            cycle_end += INTERVAL * (int((now - cycle_end) // INTERVAL) + 1)
+
+        wake = min(cycle_end, time.monotonic() + MAX_SLEEP)
+        next_due = queue.next_due()
+        if next_due is not None:
+            wake = min(wake, next_due)
+        producer.sleep(max(0.0, wake - time.monotonic()))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,915 @@
+"""Fake Cisco IOS devices for the SSH simulator.
+
+A ``FakeDevice`` holds the state of one device (interfaces, static routes,
+VLANs, generated OSPF routes) and a ``CliSession`` answers CLI lines against
+it the way IOS would: prompts, enable, the show commands the collector and
+``check.py`` run, and the config commands the worker sends. Configuration
+changes are shared by every session to the device, so a change pushed by a
+config job shows up in the next poll.
+"""
+
+import re
+import time
+import random
+import threading
+import ipaddress
+from string import Template
+
+ROUTER_VERSION = """\
+Cisco IOS XE Software, Version $version
+Cisco IOS Software [Fuji], Virtual XE Software (X86_64_LINUX_IOSD-UNIVERSALK9-M), \
+Version $version, RELEASE SOFTWARE (fc2)
+Technical Support: http://www.cisco.com/techsupport
+Copyright (c) 1986-2020 by Cisco Systems, Inc.
+Compiled Thu 30-Jan-20 18:48 by mcpre
+
+ROM: IOS-XE ROMMON
+
+$hostname uptime is $uptime
+Uptime for this control processor is $uptime
+System returned to ROM by reload
+System image file is "$image"
+Last reload reason: reload
+
+cisco $model (VXE) processor (revision VXE) with 2071829K/3075K bytes of memory.
+Processor board ID $serial
+$port_count Gigabit Ethernet interfaces
+32768K bytes of non-volatile configuration memory.
+3978436K bytes of physical memory.
+
+Configuration register is 0x2102
+"""
+
+SWITCH_VERSION = """\
+Cisco IOS Software, $software Software ($feature_set), Version $version, \
+RELEASE SOFTWARE (fc3)
+Technical Support: http://www.cisco.com/techsupport
+Copyright (c) 1986-2017 by Cisco Systems, Inc.
+Compiled Sat 19-Aug-17 09:34 by prod_rel_team
+
+ROM: Bootstrap program is $software boot loader
+
+$hostname uptime is $uptime
+System returned to ROM by power-on
+System image file is "$image"
+
+cisco $model (PowerPC405) processor (revision A0) with 262144K bytes of memory.
+Processor board ID $serial
+Last reset from power-on
+$port_count Gigabit Ethernet interfaces
+512K bytes of flash-simulated non-volatile configuration memory.
+Model number                    : $model
+System serial number            : $serial
+
+Configuration register is 0xF
+"""
+
+# What each kind of device reports and supports. "routing" decides whether
+# it has a routing table, "switching" whether it has switch ports and VLANs.
+PLATFORMS = {
+    "router": {
+        "version_text": ROUTER_VERSION,
+        "model": "CSR1000V",
+        "version": "16.09.05",
+        "image": "bootflash:packages.conf",
+        "ports": 4,
+        "routing": True,
+        "switching": False,
+    },
+    "switch": {
+        "version_text": SWITCH_VERSION,
+        "model": "WS-C3750X-24P",
+        "software": "C3750E",
+        "feature_set": "C3750E-UNIVERSALK9-M",
+        "version": "15.0(2)SE11",
+        "image": "flash:/c3750e-universalk9-mz.150-2.SE11.bin",
+        "ports": 24,
+        "routing": True,
+        "switching": True,
+    },
+    "l2switch": {
+        "version_text": SWITCH_VERSION,
+        "model": "WS-C2960X-24PD-L",
+        "software": "C2960X",
+        "feature_set": "C2960X-UNIVERSALK9-M",
+        "version": "15.2(7)E3",
+        "image": "flash:/c2960x-universalk9-mz.152-7.E3.bin",
+        "ports": 24,
+        "routing": False,
+        "switching": True,
+    },
+}
+
+INTERFACE_TYPES = (
+    "GigabitEthernet",
+    "FastEthernet",
+    "TenGigabitEthernet",
+    "Loopback",
+    "Vlan",
+)
+SHORT_NAMES = {
+    "GigabitEthernet": "Gi",
+    "FastEthernet": "Fa",
+    "TenGigabitEthernet": "Te",
+}
+OSPF_NETWORK = ipaddress.IPv4Network("100.64.0.0/10")
+MAX_OSPF_ROUTES = 2 ** (24 - OSPF_NETWORK.prefixlen)
+
+ROUTE_CODES = """\
+Codes: L - local, C - connected, S - static, R - RIP, M - mobile, B - BGP
+       D - EIGRP, EX - EIGRP external, O - OSPF, IA - OSPF inter area
+       N1 - OSPF NSSA external type 1, N2 - OSPF NSSA external type 2
+       E1 - OSPF external type 1, E2 - OSPF external type 2
+       i - IS-IS, su - IS-IS summary, L1 - IS-IS level-1, L2 - IS-IS level-2
+       ia - IS-IS inter area, * - candidate default, U - per-user static route
+       o - ODR, P - periodic downloaded static route, H - NHRP, l - LISP
+       a - application route
+       + - replicated route, % - next hop override, p - overrides from PfR
+"""
+
+INVALID_INPUT = "% Invalid input detected at '^' marker."
+INCOMPLETE = "% Incomplete command."
+
+
+class CommandError(ValueError):
+    """A config line IOS would reject; the message is printed as is."""
+
+
+def interface_name(text):
+    """Expand an abbreviated interface name, e.g. ``gi1/0/2`` or ``lo0``."""
+    match = re.fullmatch(r"([A-Za-z-]+)\s*(\d+(?:[/.]\d+)*)", text.strip())
+    if not match:
+        return None
+    prefix = match.group(1).lower()
+    for kind in INTERFACE_TYPES:
+        if kind.lower().startswith(prefix):
+            return kind + match.group(2)
+    return None
+
+
+def short_name(name):
+    for kind, short in SHORT_NAMES.items():
+        if name.startswith(kind):
+            return short + name.removeprefix(kind)
+    return name
+
+
+def parse_address(address, mask=None):
+    """Return an ``IPv4Interface`` from ``a.b.c.d/len`` or an address and mask."""
+    if mask is not None:
+        address = f"{address}/{mask}"
+    try:
+        return ipaddress.IPv4Interface(address)
+    except ValueError:
+        raise CommandError(INVALID_INPUT) from None
+
+
+def format_uptime(seconds, long=False):
+    """IOS uptime: ``1d02h``/``00:12:34`` in tables, words in ``show version``."""
+    seconds = int(seconds)
+    weeks, rest = divmod(seconds, 7 * 86400)
+    days, rest = divmod(rest, 86400)
+    hours, rest = divmod(rest, 3600)
+    minutes, secs = divmod(rest, 60)
+    if long:
+        parts = [(weeks, "week"), (days, "day"), (hours, "hour"), (minutes, "minute")]
+        words = [f"{n} {unit}{'s' if n != 1 else ''}" for n, unit in parts if n]
+        return ", ".join(words) or "0 minutes"
+    if weeks:
+        return f"{weeks}w{days}d"
+    if days:
+        return f"{days}d{hours:02d}h"
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}"
+
+
+def _classful_length(network):
+    first = network.network_address.packed[0]
+    if first < 128:
+        return 8
+    return 16 if first < 192 else 24
+
+
+def _route_line(route, indent, with_prefix=True):
+    network = route["network"]
+    text = str(network) if with_prefix else str(network.network_address)
+    return f"{route['code']:<{indent}}{text} {route['detail']}"
+
+
+def render_route_table(routes, gateway):
+    """Lay ``routes`` out like ``show ip route``, grouped by classful network."""
+    lines = [ROUTE_CODES]
+    if gateway:
+        lines.append(f"Gateway of last resort is {gateway} to network 0.0.0.0\n")
+    else:
+        lines.append("Gateway of last resort is not set\n")
+
+    groups = {}
+    for route in routes:
+        network = route["network"]
+        length = _classful_length(network)
+        if network.prefixlen < length:
+            groups.setdefault(network, []).append(route)
+        else:
+            groups.setdefault(network.supernet(new_prefix=length), []).append(route)
+
+    for major in sorted(groups, key=lambda n: (int(n.network_address), n.prefixlen)):
+        members = sorted(
+            groups[major],
+            key=lambda r: (int(r["network"].network_address), r["network"].prefixlen),
+        )
+        masks = {route["network"].prefixlen for route in members}
+        if len(members) == 1 and masks == {major.prefixlen}:
+            lines.append(_route_line(members[0], 6))
+            continue
+        if len(masks) == 1:
+            mask = masks.pop()
+            lines.append(
+                f"      {major.network_address}/{mask} is subnetted, "
+                f"{len(members)} subnets"
+            )
+            lines.extend(_route_line(route, 9, with_prefix=False) for route in members)
+        else:
+            lines.append(
+                f"      {major} is variably subnetted, {len(members)} subnets, "
+                f"{len(masks)} masks"
+            )
+            lines.extend(_route_line(route, 9) for route in members)
+    return "\n".join(lines) + "\n"
+
+
+def _matches(words, pattern):
+    return len(words) == len(pattern) and all(
+        keyword.startswith(word.lower()) for word, keyword in zip(words, pattern)
+    )
+
+
+def lookup(line, table):
+    """Find the entry of ``table`` whose keywords ``line`` abbreviates.
+
+    Returns ``(value, None)``, or ``(None, error text)`` with the caret under
+    the first word that does not fit, as IOS prints it.
+    """
+    words = line.split()
+    for pattern, value in table:
+        if _matches(words, pattern):
+            return value, None
+    spans = [match.start() for match in re.finditer(r"\S+", line)]
+    candidates = [pattern for pattern, _ in table]
+    for i, word in enumerate(words):
+        candidates = [
+            p for p in candidates if len(p) > i and p[i].startswith(word.lower())
+        ]
+        if not candidates:
+            return None, " " * spans[i] + "^\n" + INVALID_INPUT
+    return None, INCOMPLETE
+
+
+class FakeDevice:
+    """State of one simulated device, shared by all of its SSH sessions."""
+
+    def __init__(self, config, index=1):
+        self.config = config
+        self.kind = config.get("kind", "router")
+        if self.kind not in PLATFORMS:
+            raise ValueError(f"unknown device kind {self.kind!r}")
+        self.platform = dict(PLATFORMS[self.kind])
+        for key in ("model", "version", "image"):
+            if config.get(key):
+                self.platform[key] = config[key]
+        self.hostname = config.get("hostname") or f"{self.kind.upper()}{index}"
+        self.host = config["host"]
+        self.port = int(config.get("port", 22))
+        self.username = config.get("username", "admin")
+        self.password = config.get("password", "cisco")
+        self.secret = config.get("secret", self.password)
+        self.start_privileged = bool(config.get("start_privileged", False))
+        self.banner = config.get("banner", "")
+        self.outputs = config.get("outputs", {})
+        self.vty_lines = int(config.get("vty_lines", 5))
+
+        # Failure injection.
+        self.latency = float(config.get("latency", 0))
+        self.jitter = float(config.get("jitter", 0))
+        self.login_delay = float(config.get("login_delay", 0))
+        self.drop_rate = float(config.get("drop_rate", 0))
+        self.refuse_rate = float(config.get("refuse_rate", 0))
+        self.reject_auth = bool(config.get("reject_auth", False))
+
+        self.rng = random.Random(self.hostname)
+        self.serial = "".join(
+            self.rng.choices("ABCDEFGHJKLMNPQRSTUVWXYZ0123456789", k=11)
+        )
+        uptime = config.get("uptime", self.rng.randrange(3600, 30 * 86400))
+        self.booted_at = time.time() - float(uptime)
+        self.lock = threading.RLock()
+        self.sessions = 0
+
+        self.interfaces = {}
+        self.static_routes = []
+        self.vlans = {}
+        subnet = ipaddress.IPv4Network(
+            f"10.{(index >> 8) & 255}.{index & 255}.0/24", strict=False
+        )
+        self._default_interfaces(subnet)
+        for spec in config.get("interfaces", []):
+            iface = self._interface(spec["name"], create=True)
+            if spec.get("address"):
+                iface["address"] = parse_address(spec["address"], spec.get("mask"))
+                iface["method"] = "NVRAM"
+            iface["shutdown"] = bool(spec.get("shutdown", iface["shutdown"]))
+            iface["description"] = spec.get("description", iface["description"])
+            if "vlan" in spec:
+                iface["vlan"] = str(spec["vlan"])
+        for vlan, name in config.get("vlans", {}).items():
+            self.vlans[int(vlan)] = name
+        for route in config.get("static_routes", []):
+            self.add_static_route(*route.split())
+        self.ospf_routes = self._ospf_routes(int(config.get("routes", 20)))
+
+    # -- state ------------------------------------------------------------
+
+    def _new_interface(self, name, physical):
+        iface = {
+            "name": name,
+            "physical": physical,
+            "address": None,
+            "method": "unset",
+            "shutdown": False,
+            "description": "",
+            "link": True,
+            "vlan": "1",
+        }
+        self.interfaces[name] = iface
+        return iface
+
+    def _default_interfaces(self, subnet):
+        ports = int(self.config.get("ports", self.platform["ports"]))
+        hosts = list(subnet.hosts())
+        if self.platform["switching"]:
+            self.vlans[1] = "default"
+            for n in range(1, ports + 1):
+                iface = self._new_interface(f"GigabitEthernet1/0/{n}", True)
+                # Some ports have nothing plugged in.
+                iface["link"] = n % 3 != 0
+            self.interfaces["GigabitEthernet1/0/1"]["vlan"] = "trunk"
+            uplink = self._new_interface("Vlan1", False)
+        else:
+            for n in range(1, ports + 1):
+                iface = self._new_interface(f"GigabitEthernet{n}", True)
+                iface["shutdown"] = n > 1
+            uplink = self.interfaces["GigabitEthernet1"]
+            self.add_static_route("0.0.0.0", "0.0.0.0", str(hosts[-1]))
+        uplink["address"] = ipaddress.IPv4Interface(f"{hosts[0]}/{subnet.prefixlen}")
+        uplink["method"] = "NVRAM"
+        self.neighbor = str(hosts[1])
+        self.uplink = uplink["name"]
+
+    def _ospf_routes(self, count):
+        if not self.platform["routing"]:
+            return []
+        routes = []
+        for n in range(min(count, MAX_OSPF_ROUTES)):
+            network = ipaddress.IPv4Network(
+                (int(OSPF_NETWORK.network_address) + (n << 8), 24)
+            )
+            code = self.rng.choice(("O", "O", "O IA", "O E2"))
+            metric = 20 if code == "O E2" else self.rng.randrange(2, 200)
+            # Learned some time after boot; shown relative to the uptime.
+            age = self.rng.uniform(0.05, 1.0)
+            routes.append(
+                {"code": code, "network": network, "metric": metric, "age": age}
+            )
+        return routes
+
+    def _interface(self, name, create=False):
+        full = interface_name(name)
+        if full is None:
+            raise CommandError(INVALID_INPUT)
+        iface = self.interfaces.get(full)
+        if iface is None:
+            logical = full.startswith("Loopback") or (
+                full.startswith("Vlan") and self.platform["switching"]
+            )
+            if not create or not logical:
+                raise CommandError(INVALID_INPUT)
+            iface = self._new_interface(full, False)
+        return iface
+
+    def add_static_route(self, network, mask, next_hop, distance="1"):
+        try:
+            route = ipaddress.IPv4Network(f"{network}/{mask}")
+            ipaddress.IPv4Address(next_hop)
+        except ValueError:
+            raise CommandError(INVALID_INPUT) from None
+        entry = (route, next_hop, int(distance))
+        self.static_routes = [r for r in self.static_routes if r[:2] != entry[:2]]
+        self.static_routes.append(entry)
+
+    def remove_static_route(self, network, mask, next_hop=None):
+        try:
+            route = ipaddress.IPv4Network(f"{network}/{mask}")
+        except ValueError:
+            raise CommandError(INVALID_INPUT) from None
+        self.static_routes = [
+            r
+            for r in self.static_routes
+            if r[0] != route or (next_hop is not None and r[1] != next_hop)
+        ]
+
+    def uptime(self):
+        return time.time() - self.booted_at
+
+    def delay(self):
+        return self.latency + self.rng.uniform(0, self.jitter)
+
+    def facts(self):
+        """Values available to ``$name`` placeholders in canned outputs."""
+        return {
+            **self.platform,
+            "hostname": self.hostname,
+            "host": self.host,
+            "uptime": format_uptime(self.uptime(), long=True),
+            "serial": self.serial,
+            "port_count": sum(1 for i in self.interfaces.values() if i["physical"]),
+        }
+
+    def session(self):
+        return CliSession(self)
+
+    # -- show commands ----------------------------------------------------
+
+    def _status(self, iface):
+        if iface["shutdown"]:
+            return "administratively down", "down"
+        if iface["physical"]:
+            return ("up", "up") if iface["link"] else ("down", "down")
+        if iface["name"].startswith("Vlan"):
+            vlan = int(iface["name"][4:])
+            return ("up", "up") if vlan in self.vlans else ("down", "down")
+        return "up", "up"
+
+    def show_version(self):
+        return Template(self.platform["version_text"]).safe_substitute(self.facts())
+
+    def show_ip_interface_brief(self):
+        lines = [
+            "Interface              IP-Address      OK? Method Status"
+            "                Protocol"
+        ]
+        for iface in self.interfaces.values():
+            address = str(iface["address"].ip) if iface["address"] else "unassigned"
+            status, protocol = self._status(iface)
+            lines.append(
+                f"{iface['name']:<23}{address:<16}YES {iface['method']:<7}"
+                f"{status:<22}{protocol}"
+            )
+        return "\n".join(lines) + "\n"
+
+    def routes(self):
+        """Every route in the table, as rows for ``render_route_table``."""
+        routes = []
+        uplink_up = False
+        for iface in self.interfaces.values():
+            if iface["address"] is None or self._status(iface)[1] != "up":
+                continue
+            address = iface["address"]
+            detail = f"is directly connected, {iface['name']}"
+            routes.append({"code": "C", "network": address.network, "detail": detail})
+            if address.network.prefixlen < 32:
+                host = ipaddress.IPv4Network(f"{address.ip}/32")
+                routes.append({"code": "L", "network": host, "detail": detail})
+            uplink_up = uplink_up or iface["name"] == self.uplink
+        for network, next_hop, distance in self.static_routes:
+            code = "S*" if network.prefixlen == 0 else "S"
+            detail = f"[{distance}/0] via {next_hop}"
+            routes.append({"code": code, "network": network, "detail": detail})
+        if uplink_up:
+            uptime = self.uptime()
+            for route in self.ospf_routes:
+                age = format_uptime(route["age"] * uptime)
+                detail = (
+                    f"[110/{route['metric']}] via {self.neighbor}, {age}, {self.uplink}"
+                )
+                routes.append(
+                    {
+                        "code": route["code"],
+                        "network": route["network"],
+                        "detail": detail,
+                    }
+                )
+        return routes
+
+    def show_ip_route(self):
+        if not self.platform["routing"]:
+            return (
+                "Default gateway is not set\n\n"
+                "Host               Gateway           Last Use    Total Uses  Interface\n"
+                "ICMP redirect cache is empty\n"
+            )
+        gateway = next(
+            (hop for net, hop, _ in self.static_routes if net.prefixlen == 0), None
+        )
+        return render_route_table(self.routes(), gateway)
+
+    def show_ip_route_summary(self):
+        if not self.platform["routing"]:
+            return "% IP routing is not enabled\n"
+        counts = {}
+        for route in self.routes():
+            source = {"C": "connected", "L": "connected", "S": "static"}.get(
+                route["code"][0], "ospf 1"
+            )
+            column = (
+                0
+                if route["network"].prefixlen <= _classful_length(route["network"])
+                else 1
+            )
+            counts.setdefault(source, [0, 0])[column] += 1
+        lines = [
+            "IP routing table name is default (0x0)",
+            "IP routing table maximum-paths is 32",
+            "Route Source    Networks    Subnets     Replicates  Overhead    Memory (bytes)",
+        ]
+        total = [0, 0]
+        for source in ("connected", "static", "ospf 1", "Total"):
+            networks, subnets = counts.get(source, total)
+            if source != "Total":
+                total = [total[0] + networks, total[1] + subnets]
+            routes = networks + subnets
+            lines.append(
+                f"{source:<16}{networks:<12}{subnets:<12}0           "
+                f"{routes * 96:<12}{routes * 304}"
+            )
+        return "\n".join(lines) + "\n"
+
+    def show_interfaces_status(self):
+        lines = [
+            "",
+            "Port      Name               Status       Vlan       Duplex  Speed Type",
+        ]
+        for iface in self.interfaces.values():
+            if not iface["physical"]:
+                continue
+            if iface["shutdown"]:
+                status, duplex, speed = "disabled", "auto", "auto"
+            elif iface["link"]:
+                status, duplex, speed = "connected", "a-full", "a-1000"
+            else:
+                status, duplex, speed = "notconnect", "auto", "auto"
+            lines.append(
+                f"{short_name(iface['name']):<10}{iface['description'][:18]:<19}"
+                f"{status:<13}{iface['vlan']:<11}{duplex:>6} {speed:>6} "
+                "10/100/1000BaseTX"
+            )
+        return "\n".join(lines) + "\n"
+
+    def show_vlan_brief(self):
+        lines = [
+            "",
+            "VLAN Name                             Status    Ports",
+            "---- -------------------------------- --------- "
+            "-------------------------------",
+        ]
+        for vlan in sorted(self.vlans):
+            ports = [
+                short_name(i["name"])
+                for i in self.interfaces.values()
+                if i["physical"] and i["vlan"] == str(vlan)
+            ]
+            # Four ports to a line, as IOS wraps them.
+            rows = [", ".join(ports[:4])]
+            for start in range(4, len(ports), 4):
+                end = start + 4
+                rows.append(", ".join(ports[start:end]))
+            lines.append(f"{vlan:<5}{self.vlans[vlan]:<33}active    {rows[0]}".rstrip())
+            lines.extend(" " * 48 + row for row in rows[1:])
+        return "\n".join(lines) + "\n"
+
+    def show_mac_address_table_count(self):
+        learned = sum(
+            1 for i in self.interfaces.values() if i["physical"] and i["link"]
+        )
+        return (
+            "\nMac Entries for all vlans:\n"
+            "---------------------------\n"
+            f"Dynamic Address Count  : {learned}\n"
+            "Static  Address Count  : 0\n"
+            f"Total Mac Addresses    : {learned}\n\n"
+            "Total Mac Address Space Available: 7998\n"
+        )
+
+    def show_running_config(self):
+        lines = ["!", f"hostname {self.hostname}", "!"]
+        for vlan in sorted(self.vlans):
+            if vlan != 1:
+                lines.extend([f"vlan {vlan}", f" name {self.vlans[vlan]}", "!"])
+        for iface in self.interfaces.values():
+            lines.append(f"interface {iface['name']}")
+            if iface["description"]:
+                lines.append(f" description {iface['description']}")
+            if iface["physical"] and self.platform["switching"]:
+                if iface["vlan"] == "trunk":
+                    lines.append(" switchport mode trunk")
+                elif iface["vlan"] != "1":
+                    lines.append(f" switchport access vlan {iface['vlan']}")
+            if iface["address"] is not None:
+                lines.append(
+                    f" ip address {iface['address'].ip} {iface['address'].netmask}"
+                )
+            elif not (iface["physical"] and self.platform["switching"]):
+                lines.append(" no ip address")
+            if iface["shutdown"]:
+                lines.append(" shutdown")
+            lines.append("!")
+        for network, next_hop, distance in self.static_routes:
+            suffix = f" {distance}" if distance != 1 else ""
+            lines.append(
+                f"ip route {network.network_address} {network.netmask} {next_hop}{suffix}"
+            )
+        lines.extend(["!", "end"])
+        body = "\n".join(lines) + "\n"
+        return (
+            "Building configuration...\n\n"
+            f"Current configuration : {len(body)} bytes\n" + body
+        )
+
+
+# (keywords, privileged only, FakeDevice method, needs "routing"/"switching")
+SHOW_COMMANDS = [
+    (("show", "version"), False, "show_version", None),
+    (("show", "ip", "interface", "brief"), False, "show_ip_interface_brief", None),
+    (("show", "ip", "route"), False, "show_ip_route", None),
+    (("show", "ip", "route", "summary"), False, "show_ip_route_summary", None),
+    (("show", "interfaces", "status"), False, "show_interfaces_status", "switching"),
+    (("show", "vlan", "brief"), False, "show_vlan_brief", "switching"),
+    (
+        ("show", "mac", "address-table", "count"),
+        False,
+        "show_mac_address_table_count",
+        "switching",
+    ),
+    (("show", "running-config"), True, "show_running_config", None),
+]
+
+PROMPTS = {
+    "user": "{}>",
+    "enable": "{}#",
+    "config": "{}(config)#",
+    "config-if": "{}(config-if)#",
+    "config-vlan": "{}(config-vlan)#",
+}
+
+
+def _filter(output, pipe):
+    """Apply ``| include``, ``| exclude`` or ``| begin`` to ``output``."""
+    words = pipe.split(None, 1)
+    if len(words) != 2:
+        return None
+    action, pattern = words
+    try:
+        regex = re.compile(pattern)
+    except re.error:
+        return None
+    lines = output.splitlines()
+    if "include".startswith(action):
+        lines = [line for line in lines if regex.search(line)]
+    elif "exclude".startswith(action):
+        lines = [line for line in lines if not regex.search(line)]
+    elif "begin".startswith(action):
+        start = next((i for i, line in enumerate(lines) if regex.search(line)), None)
+        lines = [] if start is None else lines[start:]
+    else:
+        return None
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+class CliSession:
+    """One logged-in CLI: its mode and what it is configuring."""
+
+    def __init__(self, device):
+        self.device = device
+        self.mode = "enable" if device.start_privileged else "user"
+        self.context = None
+        # Number of wrong enable passwords while "Password:" is showing.
+        self.password_attempts = None
+        self.closed = False
+
+    @property
+    def echo(self):
+        return self.password_attempts is None
+
+    def prompt(self):
+        if self.password_attempts is not None:
+            return "Password: "
+        return PROMPTS[self.mode].format(self.device.hostname)
+
+    def handle(self, line):
+        """Run one input line and return what IOS would print before the prompt."""
+        if self.password_attempts is not None:
+            return self._enable_password(line)
+        line = line.strip()
+        if not line or line.startswith("!"):
+            return ""
+        if self.mode.startswith("config"):
+            with self.device.lock:
+                try:
+                    return self._config(line)
+                except CommandError as exc:
+                    return _caret(line, self.prompt(), str(exc))
+        return self._exec(line)
+
+    # -- exec mode --------------------------------------------------------
+
+    def _exec(self, line):
+        command, _, pipe = line.partition("|")
+        words = command.split()
+        if not words:
+            return _caret(line, self.prompt(), None)
+        keyword = words[0].lower()
+        privileged = self.mode == "enable"
+
+        if keyword == "show" or "show".startswith(keyword) and len(keyword) > 1:
+            output = self._show(command.strip(), privileged)
+            if pipe and not output.startswith(("%", " ")):
+                filtered = _filter(output, pipe.strip())
+                return INVALID_INPUT + "\n" if filtered is None else filtered
+            return output
+        for pattern, text in self.device.outputs.items():
+            if _matches(words, tuple(pattern.lower().split())):
+                return Template(text).safe_substitute(self.device.facts())
+
+        if "terminal".startswith(keyword) and len(keyword) > 1 and len(words) > 1:
+            return ""
+        if keyword in ("exit", "logout", "quit"):
+            self.closed = True
+            return ""
+        if "enable".startswith(keyword) and len(keyword) > 1 and len(words) == 1:
+            if privileged:
+                return ""
+            if not self.device.secret:
+                return "% No password set\n"
+            self.password_attempts = 0
+            return ""
+        if "disable".startswith(keyword) and len(keyword) > 3:
+            self.mode = "user"
+            return ""
+        if privileged and _matches(words, ("configure", "terminal")):
+            self.mode = "config"
+            return "Enter configuration commands, one per line.  End with CNTL/Z.\n"
+        if privileged and _matches(words, ("write", "memory")):
+            return "Building configuration...\n[OK]\n"
+        return _caret(line, self.prompt(), None)
+
+    def _show(self, command, privileged):
+        for pattern, text in self.device.outputs.items():
+            if _matches(command.split(), tuple(pattern.lower().split())):
+                return Template(text).safe_substitute(self.device.facts())
+        table = [
+            (pattern, (needs_enable, method, needs))
+            for pattern, needs_enable, method, needs in SHOW_COMMANDS
+            if (privileged or not needs_enable)
+            and (needs is None or self.device.platform[needs])
+        ]
+        entry, error = lookup(command, table)
+        if entry is None:
+            return _caret(command, self.prompt(), error)
+        with self.device.lock:
+            return getattr(self.device, entry[1])()
+
+    def _enable_password(self, line):
+        if line == self.device.secret:
+            self.password_attempts = None
+            self.mode = "enable"
+            return ""
+        self.password_attempts += 1
+        if self.password_attempts >= 3:
+            self.password_attempts = None
+            return "% Bad secrets\n"
+        return ""
+
+    # -- config mode ------------------------------------------------------
+
+    def _config(self, line):
+        words = line.split()
+        keyword = words[0].lower()
+        if keyword == "end":
+            self.mode, self.context = "enable", None
+            return ""
+        if keyword == "exit":
+            if self.mode == "config":
+                self.mode = "enable"
+            else:
+                self.mode = "config"
+            self.context = None
+            return ""
+        if keyword == "do" and len(words) > 1:
+            return self._exec(line.split(None, 1)[1])
+        if self.mode == "config-if" and self._interface_command(words):
+            return ""
+        if self.mode == "config-vlan" and self._vlan_command(words):
+            return ""
+        # IOS tries anything else as a global command, leaving the submode.
+        self._global_command(line, words)
+        return ""
+
+    def _global_command(self, line, words):
+        device = self.device
+        negate = words[0].lower() == "no"
+        args = words[1:] if negate else words
+        keyword = args[0].lower() if args else ""
+        if not keyword:
+            raise CommandError(INCOMPLETE)
+
+        if "hostname".startswith(keyword) and len(args) == 2 and not negate:
+            device.hostname = args[1]
+        elif "interface".startswith(keyword) and len(keyword) > 2 and len(args) >= 2:
+            name = " ".join(args[1:])
+            if negate:
+                full = interface_name(name)
+                if full is None:
+                    raise CommandError(INVALID_INPUT)
+                iface = device.interfaces.pop(full, None)
+                if iface is not None and iface["physical"]:
+                    device.interfaces[full] = iface
+                    raise CommandError("% Physical interfaces cannot be deleted")
+                self.mode, self.context = "config", None
+            else:
+                self.mode = "config-if"
+                self.context = device._interface(name, create=True)
+        elif _matches(args[:2], ("ip", "route")):
+            if negate and len(args) in (4, 5):
+                device.remove_static_route(*args[2:5])
+            elif not negate and len(args) in (5, 6):
+                device.add_static_route(*args[2:6])
+            else:
+                raise CommandError(INCOMPLETE)
+            self.mode, self.context = "config", None
+        elif "vlan".startswith(keyword) and device.platform["switching"]:
+            if len(args) != 2 or not args[1].isdigit() or not 1 <= int(args[1]) <= 4094:
+                raise CommandError(INVALID_INPUT)
+            vlan = int(args[1])
+            if negate:
+                if vlan == 1:
+                    raise CommandError("%Default VLAN 1 may not be deleted.")
+                device.vlans.pop(vlan, None)
+                self.mode, self.context = "config", None
+            else:
+                device.vlans.setdefault(vlan, f"VLAN{vlan:04d}")
+                self.mode, self.context = "config-vlan", vlan
+        else:
+            raise CommandError(INVALID_INPUT)
+
+    def _interface_command(self, words):
+        """Apply an interface subcommand; False if it is not one."""
+        iface = self.context
+        negate = words[0].lower() == "no"
+        args = [w.lower() for w in (words[1:] if negate else words)]
+        if not args:
+            return False
+        if "shutdown".startswith(args[0]) and len(args[0]) > 3 and len(args) == 1:
+            iface["shutdown"] = not negate
+        elif "description".startswith(args[0]) and len(args[0]) > 2:
+            iface["description"] = "" if negate else " ".join(words[1:])
+        elif _matches(args[:2], ("ip", "address")):
+            if negate:
+                iface["address"], iface["method"] = None, "unset"
+            elif len(args) == 4:
+                iface["address"] = parse_address(words[2], words[3])
+                iface["method"] = "manual"
+            else:
+                raise CommandError(INCOMPLETE)
+        elif "switchport".startswith(args[0]) and len(args[0]) > 3:
+            if not (iface["physical"] and self.device.platform["switching"]):
+                raise CommandError(INVALID_INPUT)
+            if _matches(args[1:3], ("access", "vlan")) and len(args) == 4:
+                iface["vlan"] = "1" if negate else args[3]
+            elif _matches(args[1:3], ("mode", "trunk")):
+                iface["vlan"] = "1" if negate else "trunk"
+            elif _matches(args[1:3], ("mode", "access")) and iface["vlan"] == "trunk":
+                iface["vlan"] = "1"
+        else:
+            return False
+        return True
+
+    def _vlan_command(self, words):
+        """Apply a VLAN subcommand; False if it is not one."""
+        negate = words[0].lower() == "no"
+        args = words[1:] if negate else words
+        if args and "name".startswith(args[0].lower()):
+            if negate:
+                self.device.vlans[self.context] = f"VLAN{self.context:04d}"
+            elif len(args) == 2:
+                self.device.vlans[self.context] = args[1][:32]
+            else:
+                raise CommandError(INVALID_INPUT)
+            return True
+        return False
+
+
+def _caret(line, prompt, error):
+    """IOS error text for ``line``; ``error`` None marks the first word."""
+    if error is None:
+        error = "^\n" + INVALID_INPUT
+    if error.startswith((" ", "^")):
+        return " " * len(prompt) + error + "\n"
+    return error + "\n"
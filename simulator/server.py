@@ -0,0 +1,320 @@
+"""Serve fake Cisco IOS devices over SSH for load and regression tests.
+
+    python server.py --routers 50 --switches 50
+    python server.py --config fleet.example.json
+    python server.py --routers 200 --inventory devices.csv --latency 0.2
+
+Each device listens on its own loopback address (127.1.0.1, 127.1.0.2, ...
+on Linux the whole of 127.0.0.0/8 answers without any setup), so the fleet
+keeps the one-device-per-IP model of the inventory. ``--inventory`` writes
+the CSV the web "Discover" form takes, with the port of every device, so the
+whole scheduler -> RabbitMQ -> worker -> MongoDB path can run against it.
+See ``fleet.example.json`` for per-device prompts, outputs and failures.
+"""
+
+import os
+import csv
+import sys
+import json
+import time
+import socket
+import argparse
+import ipaddress
+import selectors
+import threading
+
+import paramiko
+
+from device import FakeDevice, PLATFORMS
+
+SIM_PORT = int(os.getenv("SIM_PORT", "2222"))
+SIM_NETWORK = os.getenv("SIM_NETWORK", "127.1.0.0/16")
+# How long a client may take between connecting and opening its shell.
+SIM_LOGIN_TIMEOUT = float(os.getenv("SIM_LOGIN_TIMEOUT", "30"))
+
+
+class DeviceServer(paramiko.ServerInterface):
+    """SSH side of one connection: password login and an interactive shell."""
+
+    def __init__(self, device):
+        self.device = device
+        self.shell_ready = threading.Event()
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        if self.device.login_delay:
+            time.sleep(self.device.login_delay)
+        if self.device.reject_auth:
+            return paramiko.AUTH_FAILED
+        if username == self.device.username and password == self.device.password:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, *args):
+        return True
+
+    def check_channel_window_change_request(self, *args):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        self.shell_ready.set()
+        return True
+
+
+def _crlf(text):
+    return text.replace("\r\n", "\n").replace("\n", "\r\n").encode("utf-8")
+
+
+def run_shell(channel, device):
+    """Echo input and answer it line by line until ``exit`` or a drop."""
+    session = device.session()
+    if device.banner:
+        channel.sendall(_crlf(device.banner + "\n"))
+    channel.sendall(_crlf(session.prompt()))
+    pending = ""
+    skip_lf = False
+    while not session.closed:
+        data = channel.recv(4096)
+        if not data:
+            return
+        # netmiko's is_alive() writes a NUL byte; IOS ignores it.
+        pending += data.decode("utf-8", "replace").replace("\x00", "")
+        while not session.closed:
+            if skip_lf and pending.startswith("\n"):
+                pending = pending[1:]
+            skip_lf = False
+            end = min(
+                (i for i in (pending.find("\r"), pending.find("\n")) if i >= 0),
+                default=-1,
+            )
+            if end < 0:
+                break
+            line = pending[:end]
+            skip_lf = pending[end] == "\r"
+            start = end + 1
+            pending = pending[start:]
+
+            channel.sendall(_crlf((line if session.echo else "") + "\n"))
+            output = session.handle(line)
+            if line.strip():
+                delay = device.delay()
+                if delay:
+                    time.sleep(delay)
+                if device.drop_rate and device.rng.random() < device.drop_rate:
+                    # Cut the session off halfway through the reply.
+                    half = len(output) // 2
+                    channel.sendall(_crlf(output[:half]))
+                    channel.get_transport().close()
+                    return
+            if output:
+                channel.sendall(_crlf(output))
+            if not session.closed:
+                channel.sendall(_crlf(session.prompt()))
+
+
+class Simulator:
+    """Listens for every device and runs one thread per SSH connection."""
+
+    def __init__(self, devices, host_key):
+        self.devices = devices
+        self.host_key = host_key
+        self.selector = selectors.DefaultSelector()
+        self.listeners = []
+        self._stop = threading.Event()
+
+    def start(self):
+        for device in self.devices:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((device.host, device.port))
+            sock.listen(64)
+            sock.setblocking(False)
+            self.selector.register(sock, selectors.EVENT_READ, device)
+            self.listeners.append(sock)
+
+    def serve_forever(self):
+        while not self._stop.is_set():
+            for key, _ in self.selector.select(timeout=0.5):
+                try:
+                    conn, _ = key.fileobj.accept()
+                except (BlockingIOError, InterruptedError):
+                    continue
+                conn.setblocking(True)
+                threading.Thread(
+                    target=self._connection,
+                    args=(conn, key.data),
+                    name=f"ssh-{key.data.hostname}",
+                    daemon=True,
+                ).start()
+
+    def stop(self):
+        self._stop.set()
+        for sock in self.listeners:
+            self.selector.unregister(sock)
+            sock.close()
+
+    def _connection(self, conn, device):
+        with device.lock:
+            # Every vty line busy, or an injected refusal: hang up at once.
+            refused = device.sessions >= device.vty_lines or (
+                device.refuse_rate and device.rng.random() < device.refuse_rate
+            )
+            if not refused:
+                device.sessions += 1
+        if refused:
+            conn.close()
+            return
+        transport = paramiko.Transport(conn)
+        try:
+            transport.add_server_key(self.host_key)
+            server = DeviceServer(device)
+            transport.start_server(server=server)
+            channel = transport.accept(SIM_LOGIN_TIMEOUT)
+            if channel is None or not server.shell_ready.wait(SIM_LOGIN_TIMEOUT):
+                return
+            run_shell(channel, device)
+        except paramiko.SSHException as exc:
+            print(f"{device.hostname}: SSH error: {exc}")
+        except (EOFError, OSError):
+            # The client hung up without "exit", as netmiko often does.
+            pass
+        finally:
+            transport.close()
+            with device.lock:
+                device.sessions -= 1
+
+
+def build_fleet(config, counts, defaults, network):
+    """Create the devices listed in ``config`` plus ``counts`` generated ones."""
+    fleet = []
+    base = {"port": SIM_PORT, **config.get("defaults", {}), **defaults}
+    for spec in config.get("devices", []):
+        fleet.append(FakeDevice({**base, **spec}, index=len(fleet) + 1))
+    taken = {device.host for device in fleet}
+    hosts = (str(h) for h in ipaddress.IPv4Network(network).hosts())
+    for kind, count in counts.items():
+        for _ in range(count):
+            host = next((h for h in hosts if h not in taken), None)
+            if host is None:
+                raise ValueError(f"{network} has too few addresses for the fleet")
+            prefix = {"router": "R", "switch": "SW", "l2switch": "L2SW"}[kind]
+            # Numbered by position, so they never clash with configured names.
+            hostname = f"{prefix}{len(fleet) + 1}"
+            spec = {**base, "kind": kind, "host": host, "hostname": hostname}
+            fleet.append(FakeDevice(spec, index=len(fleet) + 1))
+    return fleet
+
+
+def write_inventory(path, fleet):
+    """Write a CSV for the web "Discover" form."""
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["ip", "username", "password", "secret", "port"])
+        for device in fleet:
+            writer.writerow(
+                [
+                    device.host,
+                    device.username,
+                    device.password,
+                    device.secret or "",
+                    device.port,
+                ]
+            )
+
+
+def load_host_key(path):
+    if path and os.path.exists(path):
+        return paramiko.RSAKey(filename=path)
+    print("Generating an RSA host key...")
+    key = paramiko.RSAKey.generate(2048)
+    if path:
+        key.write_private_key_file(path)
+    return key
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--config", help="JSON fleet file")
+    for kind in PLATFORMS:
+        parser.add_argument(
+            f"--{kind}es" if kind.endswith("switch") else f"--{kind}s",
+            dest=kind,
+            type=int,
+            default=0,
+            help=f"number of generated {kind} devices",
+        )
+    parser.add_argument("--network", default=SIM_NETWORK, help="addresses to use")
+    parser.add_argument("--port", type=int, help=f"SSH port (default {SIM_PORT})")
+    parser.add_argument("--username", help="login of every device (default admin)")
+    parser.add_argument("--password", help="password and secret (default cisco)")
+    parser.add_argument("--routes", type=int, help="OSPF routes per routing device")
+    parser.add_argument("--latency", type=float, help="seconds before each reply")
+    parser.add_argument("--jitter", type=float, help="extra random delay, seconds")
+    parser.add_argument("--drop-rate", type=float, help="chance a reply is cut off")
+    parser.add_argument("--host-key", help="RSA key file, created if missing")
+    parser.add_argument("--inventory", help="write a Discover CSV of the fleet here")
+    parser.add_argument("--seed", type=int, help="seed for failure injection")
+    args = parser.parse_args()
+
+    config = {}
+    if args.config:
+        with open(args.config, encoding="utf-8") as f:
+            config = json.load(f)
+    defaults = {}
+    for name in (
+        "port",
+        "username",
+        "password",
+        "routes",
+        "latency",
+        "jitter",
+        "drop_rate",
+    ):
+        if getattr(args, name) is not None:
+            defaults[name] = getattr(args, name)
+    counts = {kind: getattr(args, kind) for kind in PLATFORMS}
+    counts.update(
+        {kind: n for kind, n in config.get("generate", {}).items() if not counts[kind]}
+    )
+    try:
+        fleet = build_fleet(config, counts, defaults, args.network)
+    except ValueError as exc:
+        parser.error(str(exc))
+    if not fleet:
+        parser.error("no devices: use --config, --routers or --switches")
+    if args.seed is not None:
+        for n, device in enumerate(fleet):
+            device.rng.seed(args.seed + n)
+
+    simulator = Simulator(fleet, load_host_key(args.host_key))
+    try:
+        simulator.start()
+    except OSError as exc:
+        print(f"Cannot listen: {exc}")
+        return 1
+    if args.inventory:
+        write_inventory(args.inventory, fleet)
+        print(f"Wrote {args.inventory}")
+    for device in fleet[:10]:
+        print(f"  {device.hostname:<12} {device.kind:<9} {device.host}:{device.port}")
+    if len(fleet) > 10:
+        print(f"  ... and {len(fleet) - 10} more")
+    print(f"Serving {len(fleet)} devices, Ctrl-C to stop")
+    try:
+        simulator.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
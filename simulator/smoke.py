@@ -0,0 +1,227 @@
+"""Run the collector and config actions against simulated devices.
+
+    python smoke.py [--port 2222]
+
+Starts a small fleet in a subprocess and drives it with the real code from
+``worker/`` and ``web/check.py``: classification, the polled show commands
+through both parsers, every loopback, static route and VLAN action, the
+login and enable failures, pooled session reuse, and that re-adding or discovering a known device
+never saves credentials that do not log in. Exits non-zero if anything differs from what a
+real device would give.
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import threading
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(HERE, "..", "worker"), os.path.join(HERE, "..", "web")]
+# check.py opens a (lazy) MongoDB client on import; nothing here queries it.
+os.environ.setdefault("DB_NAME", "simulator")
+
+from netmiko import ConnectHandler  # noqa: E402
+
+from parsing import templates  # noqa: E402
+from router_client import fetch, SHOW_INTERFACES, SHOW_ROUTES  # noqa: E402
+from router_client import SHOW_SWITCH_PORTS, SessionPool, _build_device  # noqa: E402
+import router_actions  # noqa: E402
+import switch_actions  # noqa: E402
+from check import check_device, probe_capabilities  # noqa: E402
+
+FLEET = {
+    "defaults": {"username": "admin", "password": "cisco", "routes": 300},
+    "devices": [
+        {"hostname": "R1", "host": "127.1.0.1", "kind": "router"},
+        {"hostname": "SW1", "host": "127.1.0.2", "kind": "switch"},
+        {"hostname": "L2SW1", "host": "127.1.0.3", "kind": "l2switch"},
+        {"hostname": "LOCKED", "host": "127.1.0.4", "reject_auth": True},
+        {"hostname": "NOENABLE", "host": "127.1.0.5", "secret": "other"},
+    ],
+}
+EXPECTED_TYPES = {
+    "127.1.0.1": "Router",
+    "127.1.0.2": "Layer 3 Switch",
+    "127.1.0.3": "Layer 2 Switch",
+}
+
+failures = []
+
+
+def check(label, ok, detail=""):
+    print(f"{'ok  ' if ok else 'FAIL'} {label}" + (f": {detail}" if not ok else ""))
+    if not ok:
+        failures.append(label)
+
+
+def creds(ip, port):
+    return {"ip": ip, "username": "admin", "password": "cisco", "port": port}
+
+
+def poll(ip, port, commands):
+    """Fetch and parse like the worker, checking both parsers agree."""
+    outputs = fetch(ip, "admin", "cisco", commands, port)
+    results = {}
+    for command, output in outputs.items():
+        slow = templates.parse(command, output, fast=False)
+        fast = templates.parse(command, output, fast=True)
+        check(f"{ip} {command}: parsers agree", slow == fast)
+        check(f"{ip} {command}: parsed", isinstance(slow, list) and slow, output)
+        results[command] = slow if isinstance(slow, list) else []
+    return results
+
+
+def interfaces(ip, port):
+    rows = poll(ip, port, [SHOW_INTERFACES])[SHOW_INTERFACES]
+    return {row["interface"]: row for row in rows}
+
+
+def routes(ip, port):
+    rows = poll(ip, port, [SHOW_ROUTES])[SHOW_ROUTES]
+    return {(row["network"], row["prefix_length"], row["nexthop_ip"]) for row in rows}
+
+
+def run(port):
+    for ip, expected in EXPECTED_TYPES.items():
+        device = {
+            "device_type": "cisco_ios",
+            "host": ip,
+            "port": port,
+            "username": "admin",
+            "password": "cisco",
+        }
+        with ConnectHandler(**device) as conn:
+            profile = probe_capabilities(conn)
+        check(f"{ip} classified", profile["device_type"] == expected, profile)
+
+    router = creds("127.1.0.1", port)
+    poll(router["ip"], port, [SHOW_INTERFACES, SHOW_ROUTES])
+    ok, _ = router_actions.create_loopback(router, "7", "7.7.7.7", "255.255.255.255")
+    check("create loopback", ok and "Loopback7" in interfaces(router["ip"], port))
+    ok, _ = router_actions.set_loopback_state(router, "7", enabled=False)
+    state = interfaces(router["ip"], port).get("Loopback7", {}).get("status")
+    check("shut loopback", ok and state == "administratively down", state)
+    ok, _ = router_actions.delete_loopback(router, "7")
+    check("delete loopback", ok and "Loopback7" not in interfaces(router["ip"], port))
+
+    route = ("192.168.77.0", "24", "10.0.1.9")
+    ok, _ = router_actions.create_static_route(
+        router, "192.168.77.0", "255.255.255.0", "10.0.1.9"
+    )
+    check("create static route", ok and route in routes(router["ip"], port))
+    ok, _ = router_actions.delete_static_route(
+        router, "192.168.77.0", "255.255.255.0", "10.0.1.9"
+    )
+    check("delete static route", ok and route not in routes(router["ip"], port))
+
+    switch = creds("127.1.0.2", port)
+    poll(switch["ip"], port, [SHOW_SWITCH_PORTS])
+    ok, _ = switch_actions.create_vlan_interface(
+        switch, "30", "10.30.0.1", "255.255.255.0", name="servers"
+    )
+    check("create VLAN interface", ok and "Vlan30" in interfaces(switch["ip"], port))
+    ok, _ = switch_actions.set_vlan_state(switch, "30", enabled=False)
+    state = interfaces(switch["ip"], port).get("Vlan30", {}).get("status")
+    check("shut VLAN interface", ok and state == "administratively down", state)
+    ok, _ = switch_actions.delete_vlan(switch, "30")
+    check("delete VLAN", ok and "Vlan30" not in interfaces(switch["ip"], port))
+
+    ok, message = router_actions.create_loopback(
+        creds("127.1.0.4", port), "1", "1.1.1.1", "255.255.255.255"
+    )
+    check("rejected login reported", not ok and "เข้าสู่ระบบ" in message, message)
+    ok, message = router_actions.create_loopback(
+        creds("127.1.0.5", port), "1", "1.1.1.1", "255.255.255.255"
+    )
+    check("wrong enable secret reported", not ok and "privileged" in message, message)
+    session_reuse(port)
+    known_device_credentials(port)
+
+
+def session_reuse(port):
+    """Polls at the scheduler's intervals keep reusing one login."""
+    now = [0.0]
+    pool = SessionPool(clock=lambda: now[0])
+    device = _build_device("127.1.0.1", "admin", "cisco", port)
+    # POLL_INTERVAL_MIN, then the adaptive backoff of a stable device.
+    intervals = (10, 10, 20, 40)
+    conn = pool.run(device, lambda c: c, interval=intervals[0])
+    for previous, interval in zip(intervals, intervals[1:]):
+        now[0] += previous
+        again = pool.run(device, lambda c: c, interval=interval)
+        check(f"session reused {previous:g}s later", again is conn)
+    now[0] += 1.5 * intervals[-1] + 1
+    again = pool.run(device, lambda c: c)
+    check("idle session closed after 1.5 intervals", again is not conn)
+    pool.close_all()
+
+
+def known_device_credentials(port):
+    """Re-adding or discovering a stored device, as check.py decides it."""
+    profile = {"device_type": "Router"}
+
+    def stored(ip, password):
+        return {
+            "ip": ip,
+            "username": "admin",
+            "password": password,
+            "port": port,
+            "capabilities": profile,
+        }
+
+    def target(ip, password):
+        device = {"device_type": "cisco_ios", "host": ip, "port": port}
+        return dict(device, username="admin", password=password)
+
+    # LOCKED rejects every login, so a cached result proves none was tried.
+    result = check_device(target("127.1.0.4", "cisco"), stored("127.1.0.4", "cisco"))
+    check("same credentials: no login", result == (profile, None), result)
+    result = check_device(target("127.1.0.1", "wrong"), stored("127.1.0.1", "cisco"))
+    check("bad credentials not saved", result[0] is None, result)
+    result = check_device(target("127.1.0.1", "cisco"), stored("127.1.0.1", "old"))
+    check("new working credentials saved", result == (profile, None), result)
+
+
+def start_simulator(port):
+    """Run server.py in its own process: the worker patches paramiko's KEX list."""
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump(FLEET, f)
+    server = subprocess.Popen(
+        [sys.executable, "-u", os.path.join(HERE, "server.py")]
+        + ["--config", f.name, "--port", str(port)],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        for line in server.stdout:
+            if line.startswith("Serving"):
+                break
+        else:
+            raise SystemExit("simulator did not start")
+    finally:
+        os.unlink(f.name)
+    # Keep reading so the server never blocks on a full pipe.
+    threading.Thread(target=server.stdout.read, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=int(os.getenv("SIM_PORT", "2222")))
+    args = parser.parse_args()
+
+    server = start_simulator(args.port)
+    try:
+        run(args.port)
+    finally:
+        server.terminate()
+        server.wait()
+    print(f"{len(failures)} failures")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
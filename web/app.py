@@ -1,5 +1,10 @@
 import os
+import json
+import queue
+import time
+import hashlib
 import ipaddress
+from datetime import datetime, timedelta, UTC
 from flask import Flask
 from flask import request
 from flask import render_template
@@ -7,22 +12,31 @@ from flask import redirect
 from flask import url_for
 from flask import flash
 from flask import session
+from flask import jsonify
+from flask import Response
 from pymongo import MongoClient
 from bson import ObjectId
+from bson.errors import InvalidId
+from pika.exceptions import AMQPError
 from check import get_device_info
-from router_actions import (
-    create_loopback,
-    set_loopback_state,
-    delete_loopback,
-    create_static_route,
-    delete_static_route,
-)
-from switch_actions import (
-    create_vlan_interface,
-    set_vlan_state,
-    delete_vlan,
+from discovery import Discovery, expand_targets
+from schema import ensure_indexes, index_status
+from cache import ViewCache, watch_invalidations
+from live import StateFeed, ROW_KEYS, diff_rows
+from jobs import JobQueue, ACTION_COLLECTIONS, PENDING_STATES
+from validation import (
+    normalize_address,
+    normalize_loopback,
+    normalize_network,
+    normalize_params,
+    normalize_port,
+    normalize_vlan,
 )
 
+JOB_NOTICE_SECONDS = int(os.getenv("JOB_NOTICE_SECONDS", "60"))
+BULK_DEFAULT_PARALLELISM = int(os.getenv("BULK_DEFAULT_PARALLELISM", "10"))
+BULK_EVENTS_INTERVAL = float(os.getenv("BULK_EVENTS_INTERVAL", "1"))
+
 mongo_uri = os.environ.get("MONGO_URI")
 db_name = os.environ.get("DB_NAME")
 client = MongoClient(mongo_uri)
@@ -32,6 +46,34 @@ mysw = mydb["switch"]
 loopbacks = mydb["loopbacks"]
 switch_vlans = mydb["switch_vlans"]
 router_routes = mydb["router_routes"]
+device_state = mydb["device_state"]
+config_jobs = mydb["config_jobs"]
+bulk_jobs = mydb["bulk_jobs"]
+changesets = mydb["changesets"]
+
+try:
+    index_errors = ensure_indexes(mydb)
+except Exception as e:
+    print(f"Could not create indexes: {e}")
+    index_errors = {"*": str(e)}
+
+
+view_cache = ViewCache()
+watch_invalidations(
+    mydb,
+    view_cache,
+    {
+        "device_state": "ip",
+        "loopbacks": "router_ip",
+        "router_routes": "router_ip",
+        "switch_vlans": "switch_ip",
+    },
+)
+
+# New polls seen by the live feed drop the device's cached view.
+state_feed = StateFeed(device_state, on_change=view_cache.invalidate)
+job_queue = JobQueue(mydb, os.environ.get("RABBITMQ_HOST"))
+discovery = Discovery(mydb)
 
 
 app = Flask(__name__)
@@ -46,6 +88,25 @@ def toggle_theme():
     return redirect(next_url)
 
 
+@app.route("/healthz")
+def healthz():
+    try:
+        client.admin.command("ping")
+        indexes = index_status(mydb)
+    except Exception as e:
+        return jsonify({"status": "error", "mongo": str(e)}), 503
+    missing = {
+        name: info["missing"] for name, info in indexes.items() if info["missing"]
+    }
+    body = {
+        "status": "ok" if not missing else "degraded",
+        "indexes": indexes,
+        "missing_indexes": missing,
+        "index_errors": index_errors,
+    }
+    return jsonify(body)
+
+
 @app.route("/")
 def main():
     routers = list(mycol.find())
@@ -62,6 +123,12 @@ def add_comment():
     username = request.form.get("username")
     password = request.form.get("password")
     secret = request.form.get("secret", "").strip()
+    refresh = bool(request.form.get("refresh"))
+    try:
+        port = normalize_port(request.form.get("port"))
+    except ValueError as exc:
+        flash(str(exc), category="error")
+        return redirect(url_for("main"))
     if username and password and ip:
         device = {
             "device_type": "cisco_ios",
@@ -71,7 +138,9 @@ def add_comment():
         }
         if secret:
             device["secret"] = secret
-        success, message = get_device_info(device)
+        if port:
+            device["port"] = port
+        success, message = get_device_info(device, refresh=refresh)
         category = "success" if success else "error"
         flash(message, category=category)
     else:
@@ -80,6 +149,56 @@ def add_comment():
     return redirect(url_for("main"))
 
 
+@app.route("/discover", methods=["POST"])
+def start_discovery():
+    ranges = request.form.get("ranges", "").strip()
+    username = request.form.get("username", "").strip()
+    password = request.form.get("password", "")
+    secret = request.form.get("secret", "").strip()
+    upload = request.files.get("csv")
+    csv_text = upload.read().decode("utf-8-sig") if upload else ""
+
+    try:
+        targets = expand_targets(ranges, csv_text, username, password, secret)
+    except (ValueError, UnicodeDecodeError) as exc:
+        flash(f"ข้อมูลสำหรับค้นหาอุปกรณ์ไม่ถูกต้อง: {exc}", category="error")
+        return redirect(url_for("main"))
+    if not targets:
+        flash("กรุณาระบุช่วง IP หรือไฟล์ CSV", category="error")
+        return redirect(url_for("main"))
+
+    source = ranges or (upload.filename if upload else "")
+    discovery_id = discovery.start(targets, source)
+    return redirect(url_for("discovery_detail", discovery_id=str(discovery_id)))
+
+
+def _find_discovery(discovery_id):
+    try:
+        return mydb["discoveries"].find_one({"_id": ObjectId(discovery_id)})
+    except InvalidId:
+        return None
+
+
+@app.route("/discoveries/<discovery_id>")
+def discovery_detail(discovery_id):
+    run = _find_discovery(discovery_id)
+    if run is None:
+        flash("ไม่พบงานค้นหาอุปกรณ์", category="error")
+        return redirect(url_for("main"))
+    theme = session.get("theme", "light")
+    return render_template("discovery.html", theme=theme, run=run)
+
+
+@app.route("/api/v1/discoveries/<discovery_id>")
+def api_discovery(discovery_id):
+    run = _find_discovery(discovery_id)
+    if run is None:
+        return jsonify({"error": "discovery not found"}), 404
+    response = jsonify(_jsonable(run))
+    response.cache_control.no_store = True
+    return response
+
+
 @app.route("/routers/<id>/delete", methods=["POST"])
 def delete_router(id):
     result = mycol.delete_one({"_id": ObjectId(id)})
@@ -100,50 +219,466 @@ def delete_switch(id):
     return redirect(url_for("main"))
 
 
-@app.route("/router/<string:ip>")
-def router_detail(ip):
-    docs = list(mydb.route_table.find({"router_ip": ip}).sort("timestamp", -1).limit(1))
-    docsi = list(
-        mydb.interface_status.find({"router_ip": ip}).sort("timestamp", -1).limit(1)
-    )
+def _latest(state, kind, **extra):
+    """Shape one kind of a device_state document like a history snapshot."""
+    if state.get(kind) is None and not any(extra.values()):
+        return []
+    snapshot = {"timestamp": state.get(f"{kind}_polled_at"), kind: state.get(kind)}
+    snapshot.update(extra)
+    return [snapshot]
+
+
+def _router_view(ip):
+    state = device_state.find_one({"ip": ip}) or {}
+    docs = _latest(state, "route", raw_output=state.get("route_raw_output"))
+    docsi = _latest(state, "interfaces", raw_output=state.get("interfaces_raw_output"))
     loopback_records = list(loopbacks.find({"router_ip": ip}))
     static_routes = list(router_routes.find({"router_ip": ip}))
 
     status_map = {}
     if docsi:
-        for intf in docsi[0].get("interfaces", []):
+        for intf in docsi[0].get("interfaces") or []:
             name = intf.get("interface")
             if name and name.lower().startswith("loopback"):
                 status_map[name] = intf
 
+    return {
+        "router_ip": ip,
+        "routing": docs,
+        "interface_data": docsi,
+        "loopbacks": loopback_records,
+        "loopback_status": status_map,
+        "static_routes": static_routes,
+    }
+
+
+def _detail_view(ip, jobs, loader):
+    if any(job["status"] not in PENDING_STATES for job in jobs):
+        # A config job finished moments ago; the cached view may predate it.
+        view_cache.invalidate(ip)
+    return view_cache.get_or_load(ip, loader)
+
+
+@app.route("/router/<string:ip>")
+def router_detail(ip):
+    jobs = _recent_jobs(ip)
+    view = _detail_view(ip, jobs, lambda: _router_view(ip))
     theme = session.get("theme", "light")
     return render_template(
         "router.html",
-        router_ip=ip,
-        routing=docs,
-        interface_data=docsi,
-        loopbacks=loopback_records,
-        loopback_status=status_map,
-        static_routes=static_routes,
         theme=theme,
+        jobs=jobs,
+        staging=session.get("staging", False),
+        staged_changes=_changeset(ip),
+        **view,
     )
 
 
-@app.route("/switch/<string:ip>")
-def switch_detail(ip):
-    status = list(
-        mydb.switch_status.find({"switch_ip": ip}).sort("timestamp", -1).limit(1)
-    )
+def _switch_view(ip):
+    state = device_state.find_one({"ip": ip}) or {}
+    status = _latest(state, "ports", raw_output=state.get("ports_raw_output"))
     vlans = list(switch_vlans.find({"switch_ip": ip}))
     vlan_status_map = {entry["interface"]: entry for entry in vlans}
+    return {
+        "switch_ip": ip,
+        "switch_status": status,
+        "vlans": vlans,
+        "vlan_status": vlan_status_map,
+    }
+
+
+@app.route("/switch/<string:ip>")
+def switch_detail(ip):
+    jobs = _recent_jobs(ip)
+    view = _detail_view(ip, jobs, lambda: _switch_view(ip))
     theme = session.get("theme", "light")
     return render_template(
         "switch.html",
-        switch_ip=ip,
-        switch_status=status,
-        vlans=vlans,
-        vlan_status=vlan_status_map,
         theme=theme,
+        jobs=jobs,
+        staging=session.get("staging", False),
+        staged_changes=_changeset(ip),
+        **view,
+    )
+
+
+def _jsonable(value):
+    if isinstance(value, dict):
+        return {key: _jsonable(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_jsonable(item) for item in value]
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _conditional_json(payload, timestamps):
+    """Return ``payload`` as JSON with ETag/Last-Modified validators.
+
+    The ETag hashes the payload, so it changes exactly when the data does;
+    Last-Modified is the newest of ``timestamps``. A request whose
+    If-None-Match or If-Modified-Since still matches gets a bare 304.
+    """
+    body = _jsonable(payload)
+    encoded = json.dumps(body, sort_keys=True).encode("utf-8")
+    response = jsonify(body)
+    response.set_etag(hashlib.sha1(encoded).hexdigest())
+    timestamps = [ts for ts in timestamps if isinstance(ts, datetime)]
+    if timestamps:
+        response.last_modified = max(timestamps)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+@app.route("/api/v1/devices")
+def api_devices():
+    # Never hand out device credentials over the API.
+    projection = {"username": 0, "password": 0, "secret": 0}
+    routers = list(mycol.find({}, projection))
+    switches = list(mysw.find({}, projection))
+    return _conditional_json({"routers": routers, "switches": switches}, [])
+
+
+@app.route("/api/v1/routers/<string:ip>")
+def api_router(ip):
+    view = view_cache.get_or_load(ip, lambda: _router_view(ip))
+    routing = view["routing"][0] if view["routing"] else {}
+    interfaces = view["interface_data"][0] if view["interface_data"] else {}
+    payload = {
+        "ip": ip,
+        "route": routing.get("route"),
+        "route_polled_at": routing.get("timestamp"),
+        "route_raw_output": routing.get("raw_output"),
+        "interfaces": interfaces.get("interfaces"),
+        "interfaces_polled_at": interfaces.get("timestamp"),
+        "interfaces_raw_output": interfaces.get("raw_output"),
+        "loopbacks": view["loopbacks"],
+        "static_routes": view["static_routes"],
+    }
+    timestamps = [routing.get("timestamp"), interfaces.get("timestamp")]
+    timestamps += [item.get("updated_at") for item in view["loopbacks"]]
+    timestamps += [item.get("updated_at") for item in view["static_routes"]]
+    return _conditional_json(payload, timestamps)
+
+
+@app.route("/api/v1/switches/<string:ip>")
+def api_switch(ip):
+    view = view_cache.get_or_load(ip, lambda: _switch_view(ip))
+    status = view["switch_status"][0] if view["switch_status"] else {}
+    payload = {
+        "ip": ip,
+        "ports": status.get("ports"),
+        "ports_polled_at": status.get("timestamp"),
+        "raw_output": status.get("raw_output"),
+        "vlans": view["vlans"],
+    }
+    timestamps = [status.get("timestamp")]
+    timestamps += [item.get("updated_at") for item in view["vlans"]]
+    return _conditional_json(payload, timestamps)
+
+
+@app.route("/devices/<string:ip>/events")
+def device_events(ip):
+    """Server-Sent Events stream of changed rows for one device."""
+
+    def stream():
+        subscription = state_feed.subscribe(ip)
+        try:
+            previous = device_state.find_one({"ip": ip}) or {}
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    state = subscription.get(timeout=15)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                for kind in ROW_KEYS:
+                    if kind not in state:
+                        continue
+                    upsert, remove = diff_rows(kind, previous.get(kind), state[kind])
+                    if not upsert and not remove:
+                        continue
+                    data = _jsonable(
+                        {
+                            "upsert": upsert,
+                            "remove": remove,
+                            "polled_at": state.get(f"{kind}_polled_at"),
+                        }
+                    )
+                    yield f"event: {kind}\ndata: {json.dumps(data)}\n\n"
+                previous = state
+        finally:
+            state_feed.unsubscribe(ip, subscription)
+
+    return Response(
+        stream(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _recent_jobs(ip):
+    """Jobs still pending for ``ip`` plus those that finished a moment ago."""
+    since = datetime.now(UTC) - timedelta(seconds=JOB_NOTICE_SECONDS)
+    return list(
+        config_jobs.find(
+            {
+                "ip": ip,
+                "$or": [
+                    {"status": {"$in": list(PENDING_STATES)}},
+                    {"finished_at": {"$gte": since}},
+                ],
+            },
+            {"params": 0},
+        ).sort("created_at", 1)
+    )
+
+
+def _enqueue(action, ip, params, endpoint):
+    try:
+        job_queue.submit(action, ip, params)
+    except AMQPError as e:
+        print(f"Could not queue {action} for {ip}: {e}")
+        flash("ส่งคำสั่งเข้าคิวไม่สำเร็จ กรุณาลองอีกครั้ง", category="error")
+    else:
+        flash("ส่งคำสั่งเข้าคิวแล้ว ระบบจะแจ้งผลเมื่อทำงานเสร็จ", category="info")
+    return redirect(url_for(endpoint, ip=ip))
+
+
+def _stage(action, ip, params, endpoint):
+    """Add one change to the device's open changeset instead of running it."""
+    now = datetime.now(UTC)
+    params = dict(params)
+    secret = params.pop("secret", None)
+    update = {
+        "$push": {"changes": {"action": action, "params": params, "staged_at": now}},
+        "$setOnInsert": {"created_at": now},
+    }
+    if secret:
+        update["$set"] = {"secret": secret}
+    changesets.update_one({"ip": ip}, update, upsert=True)
+    flash("เพิ่มลงชุดคำสั่งแล้ว กด Commit เพื่อส่งทั้งหมดในครั้งเดียว", category="info")
+    return redirect(url_for(endpoint, ip=ip))
+
+
+def _submit(action, ip, params, endpoint):
+    if session.get("staging"):
+        return _stage(action, ip, params, endpoint)
+    return _enqueue(action, ip, params, endpoint)
+
+
+def _describe_change(change):
+    values = [
+        str(value)
+        for key, value in change["params"].items()
+        if value not in (None, "") and key != "prefix_length"
+    ]
+    return f"{change['action']} {' '.join(values)}".strip()
+
+
+def _changeset(ip):
+    changeset = changesets.find_one({"ip": ip}, {"secret": 0}) or {}
+    return [_describe_change(change) for change in changeset.get("changes", [])]
+
+
+def _detail_endpoint(ip):
+    if mycol.count_documents({"ip": ip}, limit=1):
+        return "router_detail"
+    return "switch_detail"
+
+
+@app.route("/staging", methods=["POST"])
+def toggle_staging():
+    session["staging"] = not session.get("staging", False)
+    next_url = request.referrer or url_for("main")
+    return redirect(next_url)
+
+
+@app.route("/devices/<string:ip>/changeset/commit", methods=["POST"])
+def commit_changeset(ip):
+    endpoint = _detail_endpoint(ip)
+    changeset = changesets.find_one_and_delete({"ip": ip})
+    if not changeset or not changeset.get("changes"):
+        flash("ไม่มีคำสั่งในชุดคำสั่ง", category="error")
+        return redirect(url_for(endpoint, ip=ip))
+    action = (
+        "apply_router_changeset"
+        if endpoint == "router_detail"
+        else "apply_switch_changeset"
+    )
+    override_secret = request.form.get("changeset_secret", "").strip()
+    params = {
+        "changes": changeset["changes"],
+        "secret": override_secret or changeset.get("secret"),
+    }
+    try:
+        job_queue.submit(action, ip, params)
+    except AMQPError as e:
+        print(f"Could not queue changeset for {ip}: {e}")
+        # Put the changes back so nothing staged is lost.
+        changesets.replace_one({"ip": ip}, changeset, upsert=True)
+        flash("ส่งคำสั่งเข้าคิวไม่สำเร็จ กรุณาลองอีกครั้ง", category="error")
+    else:
+        flash("ส่งชุดคำสั่งเข้าคิวแล้ว ระบบจะแจ้งผลเมื่อทำงานเสร็จ", category="info")
+    return redirect(url_for(endpoint, ip=ip))
+
+
+@app.route("/devices/<string:ip>/changeset/discard", methods=["POST"])
+def discard_changeset(ip):
+    changesets.delete_one({"ip": ip})
+    flash("ยกเลิกชุดคำสั่งแล้ว", category="success")
+    return redirect(url_for(_detail_endpoint(ip), ip=ip))
+
+
+@app.route("/devices/<string:ip>/changeset/<int:index>/remove", methods=["POST"])
+def remove_staged_change(ip, index):
+    # Positional removal: blank the entry, then pull the blank out.
+    changesets.update_one({"ip": ip}, {"$unset": {f"changes.{index}": ""}})
+    changesets.update_one({"ip": ip}, {"$pull": {"changes": None}})
+    return redirect(url_for(_detail_endpoint(ip), ip=ip))
+
+
+@app.route("/api/v1/jobs/<job_id>")
+def api_job(job_id):
+    try:
+        job = config_jobs.find_one({"_id": ObjectId(job_id)}, {"params.secret": 0})
+    except InvalidId:
+        job = None
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    if job["status"] not in PENDING_STATES:
+        # The worker changed this device; don't serve the old page from cache.
+        view_cache.invalidate(job["ip"])
+    response = jsonify(_jsonable(job))
+    response.cache_control.no_store = True
+    return response
+
+
+def _select_devices(collection, selector):
+    """Resolve a bulk selector to the IPs of matching devices.
+
+    ``{"ips": [...]}`` picks devices by address, ``{"subnet": "10.0.0.0/24"}``
+    every device inside a network and ``{"all": true}`` every device the
+    action applies to.
+    """
+    if selector.get("ips"):
+        query = {"ip": {"$in": [str(ip) for ip in selector["ips"]]}}
+    elif selector.get("subnet") or selector.get("all"):
+        query = {}
+    else:
+        raise ValueError("selector ต้องมี ips, subnet หรือ all")
+    ips = [doc["ip"] for doc in mydb[collection].find(query, {"ip": 1})]
+    if selector.get("subnet"):
+        network = ipaddress.IPv4Network(selector["subnet"], strict=False)
+        selected = []
+        for ip in ips:
+            try:
+                if ipaddress.IPv4Address(ip) in network:
+                    selected.append(ip)
+            except ValueError:
+                continue
+        ips = selected
+    return sorted(set(ips))
+
+
+@app.route("/api/v1/bulk", methods=["POST"])
+def api_bulk_create():
+    data = request.get_json(silent=True) or {}
+    action = data.get("action")
+    if action not in ACTION_COLLECTIONS:
+        return jsonify({"error": f"unknown action {action!r}"}), 400
+    try:
+        params = normalize_params(action, data.get("params") or {})
+        ips = _select_devices(ACTION_COLLECTIONS[action], data.get("selector") or {})
+        parallelism = int(data.get("parallelism") or BULK_DEFAULT_PARALLELISM)
+    except (TypeError, ValueError) as exc:
+        return jsonify({"error": str(exc)}), 400
+    if not ips:
+        return jsonify({"error": "no devices match the selector"}), 400
+    if parallelism < 1:
+        return jsonify({"error": "parallelism must be at least 1"}), 400
+
+    try:
+        bulk_id = job_queue.submit_bulk(action, ips, params, parallelism)
+    except AMQPError as e:
+        return jsonify({"error": f"could not queue the job: {e}"}), 503
+    status_url = url_for("api_bulk", bulk_id=str(bulk_id))
+    body = {
+        "bulk_id": str(bulk_id),
+        "devices": ips,
+        "status_url": status_url,
+        "events_url": url_for("api_bulk_events", bulk_id=str(bulk_id)),
+    }
+    return jsonify(body), 202, {"Location": status_url}
+
+
+def _find_bulk(bulk_id, projection=None):
+    try:
+        return bulk_jobs.find_one({"_id": ObjectId(bulk_id)}, projection)
+    except InvalidId:
+        return None
+
+
+@app.route("/api/v1/bulk/<bulk_id>")
+def api_bulk(bulk_id):
+    """Aggregated report of a bulk job, including every per-device result."""
+    bulk = _find_bulk(bulk_id, {"params.secret": 0})
+    if bulk is None:
+        return jsonify({"error": "bulk job not found"}), 404
+    bulk["pending"] = bulk["total"] - bulk["succeeded"] - bulk["failed"]
+    response = jsonify(_jsonable(bulk))
+    response.cache_control.no_store = True
+    return response
+
+
+@app.route("/api/v1/bulk/<bulk_id>/events")
+def api_bulk_events(bulk_id):
+    """Server-Sent Events stream of per-device results, then a summary."""
+    if _find_bulk(bulk_id, {"_id": 1}) is None:
+        return jsonify({"error": "bulk job not found"}), 404
+    oid = ObjectId(bulk_id)
+    try:
+        # Resume after the last result a reconnecting client already saw.
+        start = int(request.headers.get("Last-Event-ID", 0))
+    except ValueError:
+        start = 0
+
+    def stream():
+        sent = start
+        yield "retry: 3000\n\n"
+        while True:
+            bulk = bulk_jobs.find_one(
+                {"_id": oid},
+                {
+                    "status": 1,
+                    "total": 1,
+                    "succeeded": 1,
+                    "failed": 1,
+                    "results": {"$slice": [sent, 1000]},
+                },
+            )
+            for result in bulk.get("results", []):
+                sent += 1
+                if result.get("ip"):
+                    # That device's job is done; don't serve its old view.
+                    view_cache.invalidate(result["ip"])
+                data = json.dumps(_jsonable(result))
+                yield f"id: {sent}\nevent: result\ndata: {data}\n\n"
+            if bulk["status"] not in PENDING_STATES:
+                summary = {
+                    key: bulk.get(key)
+                    for key in ("status", "total", "succeeded", "failed")
+                }
+                yield f"event: summary\ndata: {json.dumps(summary)}\n\n"
+                return
+            time.sleep(BULK_EVENTS_INTERVAL)
+
+    return Response(
+        stream(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
 
@@ -160,61 +695,36 @@ def create_switch_vlan(ip):
         return redirect(url_for("switch_detail", ip=ip))
 
     try:
-        if "/" in ip_address:
-            iface = ipaddress.IPv4Interface(ip_address)
-            ip_address = str(iface.ip)
-            if not netmask or netmask.startswith("/"):
-                netmask = str(iface.netmask)
-        if netmask.startswith("/"):
-            prefix = int(netmask.lstrip("/"))
-            netmask = str(ipaddress.IPv4Network(f"0.0.0.0/{prefix}").netmask)
-        ipaddress.IPv4Address(ip_address)
-        ipaddress.IPv4Address(netmask)
+        ip_address, netmask = normalize_address(ip_address, netmask)
     except ValueError:
         flash("รูปแบบ IP หรือ Netmask ไม่ถูกต้อง", category="error")
         return redirect(url_for("switch_detail", ip=ip))
 
-    creds = mysw.find_one({"ip": ip})
-    if not creds:
-        flash("ไม่พบข้อมูล Switch ในระบบ", category="error")
-        return redirect(url_for("switch_detail", ip=ip))
-
     try:
-        success, payload = create_vlan_interface(
-            creds,
-            vlan_id,
-            ip_address,
-            netmask,
-            name=name or None,
-            secret=override_secret or None,
-        )
+        vlan = normalize_vlan(vlan_id)
     except ValueError as exc:
         flash(str(exc), category="error")
         return redirect(url_for("switch_detail", ip=ip))
 
-    if success:
-        switch_vlans.update_one(
-            {"switch_ip": payload["switch_ip"], "vlan": payload["vlan"]},
-            {"$set": payload, "$setOnInsert": {"created_at": payload["updated_at"]}},
-            upsert=True,
-        )
-        flash(f"สร้าง {payload['interface']} สำเร็จ", category="success")
-    else:
-        flash(payload, category="error")
-        if "privileged mode" in payload.lower() and not creds.get("secret"):
-            flash(
-                "กรุณาเพิ่ม Enable Secret ให้ Switch ในหน้าหลัก แล้วลองอีกครั้ง",
-                category="error",
-            )
-    return redirect(url_for("switch_detail", ip=ip))
+    if not mysw.count_documents({"ip": ip}, limit=1):
+        flash("ไม่พบข้อมูล Switch ในระบบ", category="error")
+        return redirect(url_for("switch_detail", ip=ip))
+
+    params = {
+        "vlan_id": str(vlan),
+        "ip_address": ip_address,
+        "netmask": netmask,
+        "name": name or None,
+        "secret": override_secret or None,
+    }
+    return _submit("create_vlan", ip, params, "switch_detail")
 
 
 @app.route("/switch/<string:ip>/vlans/<vlan_id>/state", methods=["POST"])
 def update_switch_vlan_state(ip, vlan_id):
     action = request.form.get("action")
     override_secret = request.form.get("vlan_secret", "").strip()
-    creds = mysw.find_one({"ip": ip})
-    if not creds:
+    if not mysw.count_documents({"ip": ip}, limit=1):
         flash("ไม่พบข้อมูล Switch ในระบบ", category="error")
         return redirect(url_for("switch_detail", ip=ip))
 
@@ -222,68 +732,35 @@ def update_switch_vlan_state(ip, vlan_id):
         flash("ไม่ทราบคำสั่งสำหรับ VLAN", category="error")
         return redirect(url_for("switch_detail", ip=ip))
 
-    enabled = action == "enable"
     try:
-        success, payload = set_vlan_state(
-            creds, vlan_id, enabled=enabled, secret=override_secret or None
-        )
+        vlan = normalize_vlan(vlan_id)
     except ValueError as exc:
         flash(str(exc), category="error")
         return redirect(url_for("switch_detail", ip=ip))
 
-    if success:
-        switch_vlans.update_one(
-            {"switch_ip": ip, "vlan": payload["vlan"]},
-            {
-                "$set": {
-                    "admin_state": payload["admin_state"],
-                    "updated_at": payload["updated_at"],
-                },
-                "$setOnInsert": {
-                    "switch_ip": ip,
-                    "vlan": payload["vlan"],
-                    "interface": payload["interface"],
-                },
-            },
-            upsert=True,
-        )
-        state_text = "เปิด" if enabled else "ปิด"
-        flash(f"{state_text} {payload['interface']} สำเร็จ", category="success")
-    else:
-        flash(payload, category="error")
-        if "privileged mode" in payload.lower() and not creds.get("secret"):
-            flash(
-                "กรุณาเพิ่ม Enable Secret ให้ Switch ในหน้าหลัก แล้วลองอีกครั้ง",
-                category="error",
-            )
-    return redirect(url_for("switch_detail", ip=ip))
+    params = {
+        "vlan_id": str(vlan),
+        "enabled": action == "enable",
+        "secret": override_secret or None,
+    }
+    return _submit("set_vlan_state", ip, params, "switch_detail")
 
 
 @app.route("/switch/<string:ip>/vlans/<vlan_id>/delete", methods=["POST"])
 def delete_switch_vlan(ip, vlan_id):
     override_secret = request.form.get("vlan_secret", "").strip()
-    creds = mysw.find_one({"ip": ip})
-    if not creds:
+    if not mysw.count_documents({"ip": ip}, limit=1):
         flash("ไม่พบข้อมูล Switch ในระบบ", category="error")
         return redirect(url_for("switch_detail", ip=ip))
 
     try:
-        success, payload = delete_vlan(creds, vlan_id, secret=override_secret or None)
+        vlan = normalize_vlan(vlan_id)
     except ValueError as exc:
         flash(str(exc), category="error")
         return redirect(url_for("switch_detail", ip=ip))
 
-    if success:
-        switch_vlans.delete_one({"switch_ip": ip, "vlan": payload["vlan"]})
-        flash(f"ลบ {payload['interface']} สำเร็จ", category="success")
-    else:
-        flash(payload, category="error")
-        if "privileged mode" in payload.lower() and not creds.get("secret"):
-            flash(
-                "กรุณาเพิ่ม Enable Secret ให้ Switch ในหน้าหลัก แล้วลองอีกครั้ง",
-                category="error",
-            )
-    return redirect(url_for("switch_detail", ip=ip))
+    params = {"vlan_id": str(vlan), "secret": override_secret or None}
+    return _submit("delete_vlan", ip, params, "switch_detail")
 
 
 @app.route("/router/<string:ip>/loopbacks", methods=["POST"])
@@ -298,59 +775,34 @@ def create_loopback_route(ip):
         return redirect(url_for("router_detail", ip=ip))
 
     try:
-        if "/" in ip_address:
-            iface = ipaddress.IPv4Interface(ip_address)
-            ip_address = str(iface.ip)
-            if not netmask or netmask.startswith("/"):
-                netmask = str(iface.netmask)
-        if netmask.startswith("/"):
-            prefix = int(netmask.lstrip("/"))
-            netmask = str(ipaddress.IPv4Network(f"0.0.0.0/{prefix}").netmask)
-        # Validate addresses
-        ipaddress.IPv4Address(ip_address)
-        ipaddress.IPv4Address(netmask)
+        ip_address, netmask = normalize_address(ip_address, netmask)
     except ValueError:
         flash("รูปแบบ IP หรือ Netmask ไม่ถูกต้อง", category="error")
         return redirect(url_for("router_detail", ip=ip))
 
-    creds = mycol.find_one({"ip": ip})
-    if not creds:
-        flash("ไม่พบข้อมูล Router ในระบบ", category="error")
-        return redirect(url_for("router_detail", ip=ip))
-
     try:
-        success, payload = create_loopback(
-            creds, loopback_id, ip_address, netmask, secret=override_secret or None
-        )
+        interface = normalize_loopback(loopback_id)
     except ValueError as exc:
         flash(str(exc), category="error")
         return redirect(url_for("router_detail", ip=ip))
 
-    if success:
-        loopbacks.update_one(
-            {
-                "router_ip": payload["router_ip"],
-                "interface": payload["interface"],
-            },
-            {"$set": payload, "$setOnInsert": {"created_at": payload["updated_at"]}},
-            upsert=True,
-        )
-        flash(f"สร้าง {payload['interface']} สำเร็จ", category="success")
-    else:
-        flash(payload, category="error")
-        if "privileged mode" in payload.lower() and not creds.get("secret"):
-            flash(
-                "กรุณาเพิ่ม Enable Secret ให้ Router ในหน้าหลัก แล้วลองอีกครั้ง",
-                category="error",
-            )
-    return redirect(url_for("router_detail", ip=ip))
+    if not mycol.count_documents({"ip": ip}, limit=1):
+        flash("ไม่พบข้อมูล Router ในระบบ", category="error")
+        return redirect(url_for("router_detail", ip=ip))
+
+    params = {
+        "loopback_id": interface,
+        "ip_address": ip_address,
+        "netmask": netmask,
+        "secret": override_secret or None,
+    }
+    return _submit("create_loopback", ip, params, "router_detail")
 
 
 @app.route("/router/<string:ip>/loopbacks/<loop_id>/state", methods=["POST"])
 def update_loopback_state(ip, loop_id):
     action = request.form.get("action")
-    creds = mycol.find_one({"ip": ip})
-    if not creds:
+    if not mycol.count_documents({"ip": ip}, limit=1):
         flash("ไม่พบข้อมูล Router ในระบบ", category="error")
         return redirect(url_for("router_detail", ip=ip))
 
@@ -358,66 +810,31 @@ def update_loopback_state(ip, loop_id):
         flash("ไม่ทราบคำสั่งสำหรับ Loopback", category="error")
         return redirect(url_for("router_detail", ip=ip))
 
-    enabled = action == "enable"
     try:
-        success, payload = set_loopback_state(creds, loop_id, enabled=enabled)
+        interface = normalize_loopback(loop_id)
     except ValueError as exc:
         flash(str(exc), category="error")
         return redirect(url_for("router_detail", ip=ip))
-    if success:
-        loopbacks.update_one(
-            {"router_ip": ip, "interface": payload["interface"]},
-            {
-                "$set": {
-                    "admin_state": payload["admin_state"],
-                    "updated_at": payload["updated_at"],
-                },
-                "$setOnInsert": {
-                    "router_ip": ip,
-                    "interface": payload["interface"],
-                },
-            },
-            upsert=True,
-        )
-        state_text = "เปิด" if enabled else "ปิด"
-        flash(f"{state_text} {payload['interface']} สำเร็จ", category="success")
-    else:
-        flash(payload, category="error")
-        if "privileged mode" in payload.lower() and not creds.get("secret"):
-            flash(
-                "กรุณาเพิ่ม Enable Secret ให้ Router ในหน้าหลัก แล้วลองอีกครั้ง",
-                category="error",
-            )
-    return redirect(url_for("router_detail", ip=ip))
+
+    params = {"loopback_id": interface, "enabled": action == "enable"}
+    return _submit("set_loopback_state", ip, params, "router_detail")
 
 
 @app.route("/router/<string:ip>/loopbacks/<loop_id>/delete", methods=["POST"])
 def delete_loopback_route(ip, loop_id):
-    creds = mycol.find_one({"ip": ip})
-    if not creds:
+    if not mycol.count_documents({"ip": ip}, limit=1):
         flash("ไม่พบข้อมูล Router ในระบบ", category="error")
         return redirect(url_for("router_detail", ip=ip))
 
     override_secret = request.form.get("loopback_secret", "").strip()
     try:
-        success, payload = delete_loopback(
-            creds, loop_id, secret=override_secret or None
-        )
+        interface = normalize_loopback(loop_id)
     except ValueError as exc:
         flash(str(exc), category="error")
         return redirect(url_for("router_detail", ip=ip))
 
-    if success:
-        loopbacks.delete_one({"router_ip": ip, "interface": payload["interface"]})
-        flash(f"ลบ {payload['interface']} สำเร็จ", category="success")
-    else:
-        flash(payload, category="error")
-        if "privileged mode" in payload.lower() and not creds.get("secret"):
-            flash(
-                "กรุณาเพิ่ม Enable Secret ให้ Router ในหน้าหลัก แล้วลองอีกครั้ง",
-                category="error",
-            )
-    return redirect(url_for("router_detail", ip=ip))
+    params = {"loopback_id": interface, "secret": override_secret or None}
+    return _submit("delete_loopback", ip, params, "router_detail")
 
 
 @app.route("/router/<string:ip>/routes", methods=["POST"])
@@ -431,55 +848,29 @@ def create_static_route_route(ip):
         flash("กรุณากรอกปลายทางและ Next Hop ให้ครบ", category="error")
         return redirect(url_for("router_detail", ip=ip))
 
-    creds = mycol.find_one({"ip": ip})
-    if not creds:
+    if not mycol.count_documents({"ip": ip}, limit=1):
         flash("ไม่พบข้อมูล Router ในระบบ", category="error")
         return redirect(url_for("router_detail", ip=ip))
 
     try:
-        success, payload = create_static_route(
-            creds,
-            destination,
-            netmask or None,
-            next_hop,
-            secret=override_secret or None,
-        )
+        network, mask, _ = normalize_network(destination, netmask or None)
+        ipaddress.IPv4Address(next_hop)
     except ValueError as exc:
         flash(str(exc), category="error")
         return redirect(url_for("router_detail", ip=ip))
 
-    if success:
-        router_routes.update_one(
-            {
-                "router_ip": payload["router_ip"],
-                "network": payload["network"],
-                "netmask": payload["netmask"],
-                "next_hop": payload["next_hop"],
-            },
-            {"$set": payload, "$setOnInsert": {"created_at": payload["updated_at"]}},
-            upsert=True,
-        )
-        flash(
-            (
-                f"เพิ่ม static route {payload['network']}/{payload['prefix_length']} "
-                f"→ {payload['next_hop']} สำเร็จ"
-            ),
-            category="success",
-        )
-    else:
-        flash(payload, category="error")
-        if "privileged mode" in payload.lower() and not creds.get("secret"):
-            flash(
-                "กรุณาเพิ่ม Enable Secret ให้ Router ในหน้าหลัก แล้วลองอีกครั้ง",
-                category="error",
-            )
-    return redirect(url_for("router_detail", ip=ip))
+    params = {
+        "destination": network,
+        "netmask": mask,
+        "next_hop": next_hop,
+        "secret": override_secret or None,
+    }
+    return _submit("create_static_route", ip, params, "router_detail")
 
 
 @app.route("/router/<string:ip>/routes/<route_id>/delete", methods=["POST"])
 def delete_static_route_route(ip, route_id):
-    creds = mycol.find_one({"ip": ip})
-    if not creds:
+    if not mycol.count_documents({"ip": ip}, limit=1):
         flash("ไม่พบข้อมูล Router ในระบบ", category="error")
         return redirect(url_for("router_detail", ip=ip))
 
@@ -488,27 +879,13 @@ def delete_static_route_route(ip, route_id):
         flash("ไม่พบ static route ที่ต้องการลบ", category="error")
         return redirect(url_for("router_detail", ip=ip))
 
-    success, payload = delete_static_route(
-        creds,
-        record["network"],
-        record["netmask"],
-        record["next_hop"],
-        secret=None,
-    )
-    if success:
-        router_routes.delete_one({"_id": record["_id"]})
-        flash(
-            f"ลบ static route {record['network']}/{record.get('prefix_length')} สำเร็จ",
-            category="success",
-        )
-    else:
-        flash(payload, category="error")
-        if "privileged mode" in payload.lower() and not creds.get("secret"):
-            flash(
-                "กรุณาเพิ่ม Enable Secret ให้ Router ในหน้าหลัก แล้วลองอีกครั้ง",
-                category="error",
-            )
-    return redirect(url_for("router_detail", ip=ip))
+    params = {
+        "network": record["network"],
+        "netmask": record["netmask"],
+        "next_hop": record["next_hop"],
+        "prefix_length": record.get("prefix_length"),
+    }
+    return _submit("delete_static_route", ip, params, "router_detail")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,97 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+VIEW_CACHE_SIZE = int(os.getenv("VIEW_CACHE_SIZE", "512"))
+VIEW_CACHE_TTL = float(os.getenv("VIEW_CACHE_TTL", "30"))
+
+
+class ViewCache:
+    """Thread-safe LRU cache with a per-entry TTL for assembled page data.
+
+    ``invalidate`` and ``clear`` bump a generation counter, and a value
+    whose key was invalidated while ``loader`` ran is returned but not
+    stored, so a stale load never outlives the invalidation.
+    """
+
+    def __init__(self, max_size=VIEW_CACHE_SIZE, ttl=VIEW_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def _generation(self, key):
+        return self._epoch, self._generations.get(key, 0)
+
+    def get_or_load(self, key, loader):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                return entry[1]
+            generation = self._generation(key)
+        value = loader()
+        with self._lock:
+            if self._generation(key) != generation:
+                return value
+            self._entries[key] = (now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            # Every load in flight predates the clear.
+            self._generations.clear()
+            self._epoch += 1
+
+
+def watch_invalidations(db, cache, sources):
+    """Invalidate cache entries from a change stream in a background thread.
+
+    Entries are keyed by device IP. ``sources`` maps a collection name to
+    the field holding the device IP; a change to a document there drops
+    that device's entry.
+    This picks up new polls from the worker and writes made by other web
+    replicas. Without change streams (standalone mongod) the thread logs
+    once and exits; entries are then dropped by the app when it sees a job
+    finish or a new poll, and otherwise expire with their TTL.
+    """
+
+    def run():
+        pipeline = [{"$match": {"ns.coll": {"$in": list(sources)}}}]
+        while True:
+            try:
+                with db.watch(pipeline, full_document="updateLookup") as stream:
+                    for change in stream:
+                        ip_field = sources[change["ns"]["coll"]]
+                        document = change.get("fullDocument")
+                        if document and document.get(ip_field):
+                            cache.invalidate(document[ip_field])
+                        else:
+                            # Deletes carry no fields to find the device by.
+                            cache.clear()
+            except OperationFailure as e:
+                print(f"Change streams unavailable ({e}); view cache relies on TTL")
+                return
+            except PyMongoError as e:
+                print(f"Cache invalidation stream stopped ({e}); relying on TTL")
+                cache.clear()
+                time.sleep(cache.ttl)
+
+    thread = threading.Thread(target=run, name="view-cache-watch", daemon=True)
+    thread.start()
+    return thread
@@ -1,11 +1,12 @@
 import os
+import re
+from datetime import datetime, UTC
 
 from netmiko import ConnectHandler
 from netmiko.exceptions import NetmikoAuthenticationException, NetmikoTimeoutException
 from paramiko.transport import Transport
 from pymongo import MongoClient
 
-
 mongo_uri = os.environ.get("MONGO_URI")
 db_name = os.environ.get("DB_NAME")
 client = MongoClient(mongo_uri)
@@ -29,142 +30,277 @@ for attr in ("_preferred_keys", "_preferred_pubkeys"):
         )
 
 
-def get_device_info(device):
+UNKNOWN_DEVICE = "Unknown or unsupported device"
+# Substrings of the model or image name that identify a platform.
+# Switch hints are checked first: "IOSvL2" would also match "iosv".
+SWITCH_HINTS = (
+    "vios_l2",
+    "iosvl2",
+    "catalyst",
+    "ws-c",
+    "c2960",
+    "c3560",
+    "c3750",
+    "c3850",
+    "c9200",
+    "c9300",
+    "c9400",
+    "c9500",
+    "ie-",
+)
+ROUTER_HINTS = (
+    "iosv",
+    "csr1000v",
+    "c8000",
+    "isr",
+    "asr",
+    "7200",
+    "c1100",
+    "c1900",
+    "c2900",
+    "c3900",
+)
+ERROR_MARKERS = ("Invalid input detected", "ambiguous command", "Incomplete command")
+
+
+def _command_ok(net_connect, command):
+    """Run a short command; returns its output, or None if it is unsupported."""
+    try:
+        output = net_connect.send_command(command, expect_string=r"[>#]")
+    except Exception:
+        return None
+    if not output or any(marker in output for marker in ERROR_MARKERS):
+        return None
+    return output
+
+
+def parse_version(output):
+    """Pull model, OS, version, image and hostname out of `show version`."""
+    profile = {
+        "os": None,
+        "version": None,
+        "model": None,
+        "image": None,
+        "hostname": None,
+    }
+    if "NX-OS" in output:
+        profile["os"] = "NX-OS"
+    elif "IOS XE" in output or "IOS-XE" in output:
+        profile["os"] = "IOS-XE"
+    elif "IOS" in output:
+        profile["os"] = "IOS"
+    match = re.search(r"Version ([^\s,]+)", output)
+    if match:
+        profile["version"] = match.group(1)
+    match = re.search(r"^[Cc]isco (\S+) \(.*\) processor", output, re.MULTILINE)
+    if not match:
+        match = re.search(r"^Model [Nn]umber\s*:\s*(\S+)", output, re.MULTILINE)
+    if match:
+        profile["model"] = match.group(1)
+    match = re.search(r'System image file is "([^"]+)"', output)
+    if match:
+        profile["image"] = match.group(1)
+    match = re.search(r"^(\S+) uptime is", output, re.MULTILINE)
+    if match:
+        profile["hostname"] = match.group(1)
+    return profile
+
+
+def device_type_for(routing, switching):
+    if routing and not switching:
+        return "Router"
+    if switching and not routing:
+        return "Layer 2 Switch"
+    if routing and switching:
+        return "Layer 3 Switch"
+    return UNKNOWN_DEVICE
+
+
+def probe_capabilities(net_connect):
     """
-    Connects to a device using Netmiko and determines its type based on its
-    functional tables (Routing Table vs. MAC Address Table).
+    Builds the capability profile of a connected device from `show version`.
+
+    Known router platforms need nothing else. Switches get one bounded
+    check, `show ip route summary`, to tell Layer 3 from Layer 2; only an
+    unrecognised platform also gets `show mac address-table count`.
+    """
+    output = _command_ok(net_connect, "show version") or ""
+    profile = parse_version(output)
+    platform = f"{profile['model'] or ''} {profile['image'] or ''}".lower()
+
+    switching = any(hint in platform for hint in SWITCH_HINTS)
+    if not switching and any(hint in platform for hint in ROUTER_HINTS):
+        routing = True
+    else:
+        summary = _command_ok(net_connect, "show ip route summary")
+        routing = bool(summary and "Route Source" in summary)
+        if not switching:
+            switching = (
+                _command_ok(net_connect, "show mac address-table count") is not None
+            )
+
+    profile.update(
+        {
+            "routing": routing,
+            "switching": switching,
+            "device_type": device_type_for(routing, switching),
+            "probed_at": datetime.now(UTC),
+        }
+    )
+    print(f"  > Capabilities: {profile}")
+    return profile
+
+
+def classify_device(device, profile=None):
+    """Log in to ``device`` and return ``(capability profile, error message)``.
+
+    With a known ``profile`` only the login is checked; the classification
+    commands are skipped.
     """
     try:
         print(f"\n--- Connecting to {device['host']} ---")
         with ConnectHandler(**device) as net_connect:
-
-            has_routing_table = False
-            has_mac_table = False
-
-            # 1. ตรวจสอบ Routing Table (ความสามารถ Layer 3)
-            try:
-                # ส่งคำสั่งและตรวจสอบว่าผลลัพธ์ไม่มี error
-                output = net_connect.send_command(
-                    "show ip route", expect_string=r"[>#]"
-                )
-                # ตรวจสอบว่าผลลัพธ์ที่ได้ไม่ใช่ข้อความ error มาตรฐาน
-                if (
-                    output
-                    and "Invalid input detected" not in output
-                    and "ambiguous command" not in output
-                ):
-                    has_routing_table = True
-            except Exception:
-                # หากคำสั่งล้มเหลว อาจเพราะอุปกรณ์ไม่รองรับ
-                has_routing_table = False
-
-            print(f"  > Routing table found: {has_routing_table}")
-
-            # 2. ตรวจสอบ MAC Address Table (ความสามารถ Layer 2)
-            try:
-                # ส่งคำสั่งและตรวจสอบว่าผลลัพธ์ไม่มี error
-                output = net_connect.send_command(
-                    "show mac address-table", expect_string=r"[>#]"
-                )
-                if (
-                    output
-                    and "Invalid input detected" not in output
-                    and "ambiguous command" not in output
-                ):
-                    has_mac_table = True
-            except Exception:
-                # หากคำสั่งล้มเหลว อาจเพราะอุปกรณ์ไม่รองรับ (เป็น Router)
-                has_mac_table = False
-
-            print(f"  > MAC address table found: {has_mac_table}")
-
-            # 3. ตัดสินใจประเภทของอุปกรณ์จากผลลัพธ์
-            if has_routing_table and not has_mac_table:
-                device_type = "Router"
-            elif not has_routing_table and has_mac_table:
-                device_type = "Layer 2 Switch"
-            elif has_routing_table and has_mac_table:
-                device_type = "Layer 3 Switch"
-            else:
-                device_type = "Unknown or unsupported device"
-
-            print(f"  ✅ Detected Device Type: {device_type}")
-            if "Switch" in device_type:
-                print("  Device is a Switch. Saving credentials to MongoDB...")
-
-                switch_data = {
-                    "ip": device["host"],
-                    "username": device["username"],
-                    "password": device["password"],
-                }
-                if device.get("secret"):
-                    switch_data["secret"] = device["secret"]
-                existing = mysw.find_one({"ip": device["host"]})
-                if existing:
-                    mysw.update_one(
-                        {"_id": existing["_id"]},
-                        {"$set": switch_data},
-                    )
-                    action = "update"
-                else:
-                    mysw.insert_one(switch_data)
-                    action = "create"
-                print(f"  Successfully saved {device['host']} to the database.")
-            elif "Router" in device_type:
-                print("  Device is a Router. Saving credentials to MongoDB...")
-
-                router_data = {
-                    "ip": device["host"],
-                    "username": device["username"],
-                    "password": device["password"],
-                }
-                if device.get("secret"):
-                    router_data["secret"] = device["secret"]
-                existing = mycol.find_one({"ip": device["host"]})
-                if existing:
-                    mycol.update_one(
-                        {"_id": existing["_id"]},
-                        {"$set": router_data},
-                    )
-                    action = "update"
-                else:
-                    mycol.insert_one(router_data)
-                    action = "create"
-                print(f"  Successfully saved {device['host']} to the database.")
-            else:
-                msg = (
-                    f"ไม่สามารถระบุประเภทอุปกรณ์ของ {device['host']} ได้ "
-                    "อาจไม่รองรับคำสั่งที่ใช้ตรวจสอบ"
-                )
-                print(msg)
-                return False, msg
-
-            verb = "อัปเดต" if action == "update" else "เพิ่ม"
-            message = f"{verb} {device_type} {device['host']} เรียบร้อย"
-            return True, message
-
+            if profile is None:
+                profile = probe_capabilities(net_connect)
     except NetmikoTimeoutException:
         error_msg = f"Error: Connection to {device['host']} timed out."
         print(error_msg)
-        return False, error_msg
+        return None, error_msg
     except NetmikoAuthenticationException:
         error_msg = f"Error: Authentication failed for {device['host']}."
         print(error_msg)
+        return None, error_msg
+    except Exception as e:
+        error_msg = f"An unexpected error occurred with {device['host']}: {e}"
+        print(error_msg)
+        return None, error_msg
+
+    print(f"  ✅ Detected Device Type: {profile['device_type']}")
+    if profile["device_type"] == UNKNOWN_DEVICE:
+        msg = (
+            f"ไม่สามารถระบุประเภทอุปกรณ์ของ {device['host']} ได้ "
+            "อาจไม่รองรับคำสั่งที่ใช้ตรวจสอบ"
+        )
+        print(msg)
+        return None, msg
+    return profile, None
+
+
+def collection_for(device_type):
+    return mysw if "Switch" in device_type else mycol
+
+
+def known_devices(ips=None):
+    """Return ``{ip: device document}`` for stored devices."""
+    query = {}
+    if ips is not None:
+        query["ip"] = {"$in": list(ips)}
+    projection = {
+        "ip": 1,
+        "username": 1,
+        "password": 1,
+        "secret": 1,
+        "port": 1,
+        "capabilities": 1,
+    }
+    devices = {}
+    for collection in (mycol, mysw):
+        for doc in collection.find(query, projection):
+            devices[doc["ip"]] = doc
+    return devices
+
+
+def credentials_match(device, stored):
+    """True if saving ``device`` would leave the login of ``stored`` as it is."""
+    return all(
+        not device.get(field) or device[field] == stored.get(field)
+        for field in ("username", "password", "secret", "port")
+    )
+
+
+def check_device(device, stored=None):
+    """Return ``(capability profile, error message)`` for a device to save.
+
+    ``stored`` is the device's current document, if any. When it has a
+    profile and the submitted credentials match it, nothing is run on the
+    device. Other credentials are checked with a login first, so a typo
+    never replaces working ones; unknown devices are classified.
+    """
+    profile = (stored or {}).get("capabilities")
+    if profile and credentials_match(device, stored):
+        print(f"Using cached capabilities for {device['host']}")
+        return profile, None
+    return classify_device(device, profile)
+
+
+def device_record(device, profile):
+    data = {
+        "ip": device["host"],
+        "username": device["username"],
+        "password": device["password"],
+        "capabilities": profile,
+        # The scheduler picks up changed devices by this without change streams.
+        "updated_at": datetime.now(UTC),
+    }
+    if device.get("secret"):
+        data["secret"] = device["secret"]
+    if device.get("port"):
+        data["port"] = device["port"]
+    return data
+
+
+def save_device(device, profile):
+    """Store the credentials and profile of a classified device.
+
+    Returns the action taken. A device that changed type is moved to the
+    other collection.
+    """
+    device_type = profile["device_type"]
+    print(f"  Device is a {device_type}. Saving credentials to MongoDB...")
+    collection = collection_for(device_type)
+    result = collection.update_one(
+        {"ip": device["host"]},
+        {"$set": device_record(device, profile)},
+        upsert=True,
+    )
+    other = mycol if collection is mysw else mysw
+    other.delete_one({"ip": device["host"]})
+    print(f"  Successfully saved {device['host']} to the database.")
+    return "create" if result.upserted_id is not None else "update"
+
+
+def get_device_info(device, refresh=False):
+    """
+    Determines the type of a device and saves its credentials to the
+    matching collection. A device that already has a capability profile is
+    not classified again unless ``refresh`` is set, but new credentials are
+    still checked with a login before they are saved.
+    """
+    stored = None if refresh else known_devices([device["host"]]).get(device["host"])
+    profile, error_msg = check_device(device, stored)
+    if profile is None:
         return False, error_msg
+    try:
+        action = save_device(device, profile)
     except Exception as e:
         error_msg = f"An unexpected error occurred with {device['host']}: {e}"
         print(error_msg)
         return False, error_msg
 
+    verb = "อัปเดต" if action == "update" else "เพิ่ม"
+    message = f"{verb} {profile['device_type']} {device['host']} เรียบร้อย"
+    return True, message
+
 
 if __name__ == "__main__":
     # --- ตัวอย่างการใช้งาน ---
-    # อุปกรณ์ที่คุณทดสอบคือ Router (IOSv) ดังนั้นผลที่คาดหวังคือ "Router"
+    # ค่าเริ่มต้นคือ Router ตัวแรกของ simulator/server.py ผลที่คาดหวังคือ "Router"
     cisco_router = {
         "device_type": "cisco_ios",
-        "host": "10.0.15.133",  # <-- IP อุปกรณ์ของคุณ
-        "username": "admin",  # <-- Username
-        "password": "cisco",  # <-- Password
+        "host": os.getenv("DEVICE_IP", "127.1.0.1"),  # <-- IP อุปกรณ์ของคุณ
+        "username": os.getenv("DEVICE_USERNAME", "admin"),  # <-- Username
+        "password": os.getenv("DEVICE_PASSWORD", "cisco"),  # <-- Password
+        "port": int(os.getenv("DEVICE_PORT", "2222")),
     }
 
     devices_to_check = [cisco_router]  # , cisco_switch]
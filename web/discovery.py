@@ -0,0 +1,242 @@
+import os
+import io
+import csv
+import socket
+import threading
+import ipaddress
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, UTC
+
+from pymongo import UpdateOne
+
+from check import check_device, collection_for, device_record, known_devices
+from validation import normalize_port
+
+DISCOVERY_PROBE_WORKERS = int(os.getenv("DISCOVERY_PROBE_WORKERS", "256"))
+DISCOVERY_PROBE_TIMEOUT = float(os.getenv("DISCOVERY_PROBE_TIMEOUT", "1.5"))
+DISCOVERY_WORKERS = int(os.getenv("DISCOVERY_WORKERS", "16"))
+DISCOVERY_MAX_HOSTS = int(os.getenv("DISCOVERY_MAX_HOSTS", "4096"))
+DISCOVERY_WRITE_BATCH = int(os.getenv("DISCOVERY_WRITE_BATCH", "50"))
+# Progress counters are written at most this often.
+DISCOVERY_PROGRESS_INTERVAL = float(os.getenv("DISCOVERY_PROGRESS_INTERVAL", "1"))
+
+SSH_PORT = 22
+
+
+def _hosts(spec):
+    """Return ``(count, hosts)`` for a single IP or a CIDR range.
+
+    ``hosts`` is a generator, so a huge range can be rejected from ``count``
+    without ever being expanded.
+    """
+    network = ipaddress.IPv4Network(spec.strip(), strict=False)
+    if network.prefixlen >= 31:
+        # /32 is the address itself; /31 has no network or broadcast address.
+        return network.num_addresses, (str(host) for host in network)
+    return network.num_addresses - 2, (str(host) for host in network.hosts())
+
+
+def expand_targets(ranges, csv_text, username, password, secret=None):
+    """Build the list of devices to try from CIDR ranges and/or a CSV.
+
+    ``ranges`` holds IPs or CIDRs separated by commas or whitespace and uses
+    the given credentials. The CSV needs an ``ip`` column (an IP or a CIDR)
+    and may override ``username``, ``password`` and ``secret`` per row, and
+    set an SSH ``port`` other than 22.
+    Raises ``ValueError`` on bad input or more than ``DISCOVERY_MAX_HOSTS``.
+    """
+    targets = {}
+
+    def add(spec, user, pwd, enable, port=None):
+        if not user or not pwd:
+            raise ValueError(f"ไม่มี Username/Password สำหรับ {spec}")
+        count, hosts = _hosts(spec)
+        if len(targets) + count > DISCOVERY_MAX_HOSTS:
+            raise ValueError(f"ค้นหาได้ครั้งละไม่เกิน {DISCOVERY_MAX_HOSTS} IP")
+        for host in hosts:
+            targets[host] = {
+                "device_type": "cisco_ios",
+                "host": host,
+                "username": user,
+                "password": pwd,
+            }
+            if enable:
+                targets[host]["secret"] = enable
+            if port:
+                targets[host]["port"] = port
+
+    for spec in (ranges or "").replace(",", " ").split():
+        add(spec, username, password, secret)
+    if csv_text:
+        for row in csv.DictReader(io.StringIO(csv_text)):
+            row = {
+                key.strip().lower(): (value or "").strip()
+                for key, value in row.items()
+                if key
+            }
+            if not row.get("ip"):
+                continue
+            add(
+                row["ip"],
+                row.get("username") or username,
+                row.get("password") or password,
+                row.get("secret") or secret,
+                normalize_port(row.get("port")),
+            )
+    return list(targets.values())
+
+
+def probe(host, port=SSH_PORT, timeout=DISCOVERY_PROBE_TIMEOUT):
+    """Return True if something accepts TCP connections on ``host:port``."""
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+class Discovery:
+    """Onboards every SSH-reachable device in a set of targets.
+
+    Hosts are first checked with a concurrent TCP connect to their SSH port
+    (22 unless the CSV gives one), then the reachable ones are classified
+    over SSH, ``classify_workers`` at a time.
+    Classified devices are upserted into their collection in batches, and
+    progress goes to the ``discoveries`` document so any web replica can
+    show it.
+    """
+
+    def __init__(
+        self,
+        db,
+        probe_workers=DISCOVERY_PROBE_WORKERS,
+        classify_workers=DISCOVERY_WORKERS,
+        batch_size=DISCOVERY_WRITE_BATCH,
+    ):
+        self.db = db
+        self.discoveries = db["discoveries"]
+        self.probe_workers = probe_workers
+        self.classify_workers = classify_workers
+        self.batch_size = batch_size
+
+    def start(self, targets, source):
+        now = datetime.now(UTC)
+        discovery_id = self.discoveries.insert_one(
+            {
+                "source": source,
+                "status": "probing",
+                "total": len(targets),
+                "probed": 0,
+                "reachable": 0,
+                "classified": 0,
+                "added": 0,
+                "failed": 0,
+                "results": [],
+                "created_at": now,
+                "updated_at": now,
+            }
+        ).inserted_id
+        thread = threading.Thread(
+            target=self._run,
+            args=(discovery_id, targets),
+            name=f"discovery-{discovery_id}",
+            daemon=True,
+        )
+        thread.start()
+        return discovery_id
+
+    def _update(self, discovery_id, update):
+        update.setdefault("$set", {})["updated_at"] = datetime.now(UTC)
+        self.discoveries.update_one({"_id": discovery_id}, update)
+
+    def _probe_all(self, discovery_id, targets):
+        reachable = []
+        pending = {"probed": 0, "reachable": 0}
+        last_flush = datetime.now(UTC)
+        workers = max(1, min(self.probe_workers, len(targets)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(
+                    probe, target["host"], target.get("port", SSH_PORT)
+                ): target
+                for target in targets
+            }
+            for future in as_completed(futures):
+                pending["probed"] += 1
+                if future.result():
+                    reachable.append(futures[future])
+                    pending["reachable"] += 1
+                now = datetime.now(UTC)
+                if (now - last_flush).total_seconds() >= DISCOVERY_PROGRESS_INTERVAL:
+                    self._update(discovery_id, {"$inc": dict(pending)})
+                    pending = {"probed": 0, "reachable": 0}
+                    last_flush = now
+        self._update(discovery_id, {"$inc": pending})
+        return reachable
+
+    def _flush_writes(self, writes):
+        for collection, operations in writes.items():
+            if operations:
+                self.db[collection].bulk_write(operations, ordered=False)
+                operations.clear()
+
+    def _classify_all(self, discovery_id, targets):
+        writes = {}
+        waiting = 0
+        # Known devices keep their profile. They are only logged in to when
+        # the discovery brings other credentials, which are saved only if
+        # that login works.
+        known = known_devices(target["host"] for target in targets)
+
+        def classify(target):
+            return target, check_device(target, known.get(target["host"]))
+
+        workers = max(1, min(self.classify_workers, len(targets)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for future in as_completed([executor.submit(classify, t) for t in targets]):
+                target, (profile, error_msg) = future.result()
+                result = {"ip": target["host"], "device_type": None}
+                if profile is None:
+                    result["error"] = error_msg
+                    counter = "failed"
+                else:
+                    result["device_type"] = profile["device_type"]
+                    collection = collection_for(profile["device_type"]).name
+                    writes.setdefault(collection, []).append(
+                        UpdateOne(
+                            {"ip": target["host"]},
+                            {"$set": device_record(target, profile)},
+                            upsert=True,
+                        )
+                    )
+                    waiting += 1
+                    counter = "added"
+                if waiting >= self.batch_size:
+                    self._flush_writes(writes)
+                    waiting = 0
+                self._update(
+                    discovery_id,
+                    {
+                        "$push": {"results": result},
+                        "$inc": {"classified": 1, counter: 1},
+                    },
+                )
+        self._flush_writes(writes)
+
+    def _run(self, discovery_id, targets):
+        try:
+            reachable = self._probe_all(discovery_id, targets)
+            print(
+                f"Discovery {discovery_id}: {len(reachable)}/{len(targets)} reachable"
+            )
+            self._update(discovery_id, {"$set": {"status": "classifying"}})
+            self._classify_all(discovery_id, reachable)
+        except Exception as e:
+            print(f"Discovery {discovery_id} failed: {e}")
+            self._update(discovery_id, {"$set": {"status": "error", "error": str(e)}})
+            return
+        self._update(
+            discovery_id,
+            {"$set": {"status": "finished", "finished_at": datetime.now(UTC)}},
+        )
+        print(f"Discovery {discovery_id} finished")
@@ -0,0 +1,123 @@
+import os
+import threading
+from datetime import datetime, UTC
+
+import pika
+from bson import json_util
+from pika.exceptions import AMQPError
+
+CONFIG_QUEUE = "config_jobs"
+# Job states, in the order a job moves through them.
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED = "finished"
+PENDING_STATES = (QUEUED, RUNNING)
+# Which device collection each action targets.
+ACTION_COLLECTIONS = {
+    "create_loopback": "mycollection",
+    "set_loopback_state": "mycollection",
+    "delete_loopback": "mycollection",
+    "create_static_route": "mycollection",
+    "delete_static_route": "mycollection",
+    "create_vlan": "switch",
+    "set_vlan_state": "switch",
+    "delete_vlan": "switch",
+}
+
+
+class JobQueue:
+    """Hands config actions to the workers through RabbitMQ.
+
+    Every job gets a document in ``config_jobs`` (or ``bulk_jobs``) before
+    it is published, so the browser can follow it by id while a worker runs
+    it. The connection is opened lazily, shared by all request threads under
+    a lock, and re-opened once if the broker dropped it while the app was
+    idle.
+    """
+
+    def __init__(self, db, host):
+        self.jobs = db["config_jobs"]
+        self.bulk_jobs = db["bulk_jobs"]
+        self.host = host
+        self.connection = None
+        self.channel = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        credentials = pika.PlainCredentials(
+            os.getenv("RABBITMQ_DEFAULT_USER"), os.getenv("RABBITMQ_DEFAULT_PASS")
+        )
+        self.connection = pika.BlockingConnection(
+            pika.ConnectionParameters(self.host, credentials=credentials)
+        )
+        self.channel = self.connection.channel()
+        self.channel.queue_declare(queue=CONFIG_QUEUE, durable=True)
+        self.channel.confirm_delivery()
+
+    def _publish(self, body):
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self.connection is None or not self.connection.is_open:
+                        self._connect()
+                    self.channel.basic_publish(
+                        exchange="",
+                        routing_key=CONFIG_QUEUE,
+                        body=body,
+                        properties=pika.BasicProperties(delivery_mode=2),
+                    )
+                    return
+                except AMQPError:
+                    self.connection = None
+                    if attempt:
+                        raise
+
+    def _submit(self, collection, key, document):
+        now = datetime.now(UTC)
+        document.update({"status": QUEUED, "created_at": now, "updated_at": now})
+        job_id = collection.insert_one(document).inserted_id
+        try:
+            self._publish(json_util.dumps({key: job_id}))
+        except AMQPError as e:
+            collection.update_one(
+                {"_id": job_id},
+                {
+                    "$set": {
+                        "status": FAILED,
+                        "message": f"ส่งงานเข้าคิวไม่สำเร็จ: {e}",
+                        "updated_at": datetime.now(UTC),
+                    },
+                    "$unset": {"params.secret": ""},
+                },
+            )
+            raise
+        return job_id
+
+    def submit(self, action, ip, params):
+        """Record and publish a job; returns its id.
+
+        Raises ``AMQPError`` when the job could not be queued, after marking
+        its document as failed.
+        """
+        return self._submit(
+            self.jobs, "job_id", {"action": action, "ip": ip, "params": params}
+        )
+
+    def submit_bulk(self, action, ips, params, parallelism):
+        """Record and publish one change for many devices; returns its id."""
+        return self._submit(
+            self.bulk_jobs,
+            "bulk_id",
+            {
+                "action": action,
+                "ips": ips,
+                "params": params,
+                "parallelism": parallelism,
+                "total": len(ips),
+                "succeeded": 0,
+                "failed": 0,
+                "results": [],
+            },
+        )
@@ -0,0 +1,136 @@
+import os
+import time
+import queue
+import threading
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+LIVE_POLL_INTERVAL = float(os.getenv("LIVE_POLL_INTERVAL", "2"))
+
+# Fields identifying one row of each kind in device_state.
+ROW_KEYS = {
+    "interfaces": ("interface",),
+    "route": ("protocol", "network", "prefix_length", "nexthop_ip"),
+    "ports": ("port",),
+}
+
+
+# Fields that change on every poll; the pages never render them. Mirrors
+# VOLATILE_FIELDS in worker/database.py.
+VOLATILE_FIELDS = {"uptime"}
+
+
+def row_key(kind, row):
+    return "|".join(str(row.get(field, "")) for field in ROW_KEYS[kind])
+
+
+def _rows(kind, rows):
+    # Raw text (output no template could parse) has no rows to diff.
+    if not isinstance(rows, list):
+        return {}
+    return {row_key(kind, row): row for row in rows if isinstance(row, dict)}
+
+
+def _stable(row):
+    return {key: value for key, value in row.items() if key not in VOLATILE_FIELDS}
+
+
+def diff_rows(kind, old, new):
+    """Return the rows of ``new`` that are new or changed, and removed keys."""
+    old_rows = _rows(kind, old)
+    new_rows = _rows(kind, new)
+    upsert = [
+        dict(row, key=key)
+        for key, row in new_rows.items()
+        if key not in old_rows or _stable(old_rows[key]) != _stable(row)
+    ]
+    remove = [key for key in old_rows if key not in new_rows]
+    return upsert, remove
+
+
+class StateFeed:
+    """Fans device_state changes out to per-device subscriber queues.
+
+    One change stream per process serves every open page. Without change
+    streams the subscribed devices are re-read every ``LIVE_POLL_INTERVAL``
+    seconds instead. ``on_change(ip)`` is called whenever a device's
+    ``last_seen`` moves, i.e. a new poll was stored.
+    """
+
+    def __init__(self, collection, poll_interval=LIVE_POLL_INTERVAL, on_change=None):
+        self.collection = collection
+        self.poll_interval = poll_interval
+        self.on_change = on_change
+        self._last_seen = {}
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self, ip):
+        subscription = queue.Queue(maxsize=16)
+        with self._lock:
+            self._subscribers.setdefault(ip, set()).add(subscription)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="state-feed", daemon=True
+                )
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, ip, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(ip, set())
+            subscribers.discard(subscription)
+            if not subscribers:
+                self._subscribers.pop(ip, None)
+                self._last_seen.pop(ip, None)
+
+    def _publish(self, state):
+        ip = state.get("ip")
+        with self._lock:
+            subscribers = list(self._subscribers.get(ip, ()))
+            moved = self._last_seen.get(ip) != state.get("last_seen")
+            if subscribers:
+                self._last_seen[ip] = state.get("last_seen")
+        if moved and self.on_change is not None:
+            self.on_change(ip)
+        for subscription in subscribers:
+            try:
+                subscription.put_nowait(state)
+            except queue.Full:
+                # A stalled client only needs the newest state.
+                try:
+                    subscription.get_nowait()
+                except queue.Empty:
+                    pass
+                subscription.put_nowait(state)
+
+    def _watch(self):
+        with self.collection.watch(full_document="updateLookup") as stream:
+            for change in stream:
+                state = change.get("fullDocument")
+                if state:
+                    self._publish(state)
+
+    def _poll(self):
+        with self._lock:
+            ips = list(self._subscribers)
+        for state in self.collection.find({"ip": {"$in": ips}}):
+            self._publish(state)
+
+    def _run(self):
+        use_stream = True
+        while True:
+            if use_stream:
+                try:
+                    self._watch()
+                except OperationFailure as e:
+                    print(f"Change streams unavailable ({e}); polling device_state")
+                    use_stream = False
+                except PyMongoError as e:
+                    print(f"device_state change stream failed: {e}")
+            try:
+                self._poll()
+            except PyMongoError as e:
+                print(f"device_state poll failed: {e}")
+            time.sleep(self.poll_interval)
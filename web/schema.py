@@ -0,0 +1,197 @@
+# Shared index definitions. The same file is shipped with the web, scheduler
+# and worker images; CI (schema_copies) fails if the copies differ.
+import os
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import PyMongoError
+
+RAW_OUTPUT_TTL_DAYS = 7
+# Hourly rollups of the poll history (worker/retention.py) expire this many
+# days after their hour; 0 keeps them forever. Set it the same for every
+# service, since each one applies it on startup.
+ROLLUP_TTL_DAYS = float(os.getenv("ROLLUP_TTL_DAYS", "365"))
+
+
+def _rollup_indexes(meta):
+    indexes = [
+        IndexModel(
+            [(meta, ASCENDING), ("hour", ASCENDING)],
+            name=f"{meta}_1_hour_1",
+            unique=True,
+        )
+    ]
+    if ROLLUP_TTL_DAYS > 0:
+        indexes.append(
+            IndexModel(
+                [("hour", ASCENDING)],
+                name="hour_ttl",
+                expireAfterSeconds=int(ROLLUP_TTL_DAYS * 86400),
+            )
+        )
+    return indexes
+
+
+INDEXES = {
+    "mycollection": [IndexModel([("ip", ASCENDING)], name="ip_unique", unique=True)],
+    "switch": [IndexModel([("ip", ASCENDING)], name="ip_unique", unique=True)],
+    "loopbacks": [
+        IndexModel(
+            [("router_ip", ASCENDING), ("interface", ASCENDING)],
+            name="router_interface_unique",
+            unique=True,
+        )
+    ],
+    "switch_vlans": [
+        IndexModel(
+            [("switch_ip", ASCENDING), ("vlan", ASCENDING)],
+            name="switch_vlan_unique",
+            unique=True,
+        )
+    ],
+    "router_routes": [
+        IndexModel(
+            [
+                ("router_ip", ASCENDING),
+                ("network", ASCENDING),
+                ("netmask", ASCENDING),
+                ("next_hop", ASCENDING),
+            ],
+            name="router_route_unique",
+            unique=True,
+        )
+    ],
+    "interface_status": [
+        IndexModel(
+            [("router_ip", ASCENDING), ("timestamp", DESCENDING)],
+            name="router_ip_timestamp",
+        )
+    ],
+    "route_table": [
+        IndexModel(
+            [("router_ip", ASCENDING), ("timestamp", DESCENDING)],
+            name="router_ip_timestamp",
+        )
+    ],
+    "switch_status": [
+        IndexModel(
+            [("switch_ip", ASCENDING), ("timestamp", DESCENDING)],
+            name="switch_ip_timestamp",
+        )
+    ],
+    "device_state": [IndexModel([("ip", ASCENDING)], name="ip_unique", unique=True)],
+    "state_changes": [
+        IndexModel(
+            [
+                ("ip", ASCENDING),
+                ("kind", ASCENDING),
+                ("baseline", ASCENDING),
+                ("timestamp", DESCENDING),
+            ],
+            name="ip_kind_baseline_timestamp",
+        ),
+        # One record per poll: replays of a poll upsert the same record.
+        IndexModel(
+            [("ip", ASCENDING), ("kind", ASCENDING), ("timestamp", ASCENDING)],
+            name="ip_kind_timestamp_unique",
+            unique=True,
+        ),
+    ],
+    "changesets": [IndexModel([("ip", ASCENDING)], name="ip_unique", unique=True)],
+    "config_jobs": [
+        IndexModel(
+            [("ip", ASCENDING), ("created_at", DESCENDING)],
+            name="ip_created_at",
+        )
+    ],
+    "raw_outputs": [
+        IndexModel(
+            [("ip", ASCENDING), ("collection", ASCENDING), ("fetched_at", DESCENDING)],
+            name="ip_collection_fetched_at",
+        ),
+        IndexModel([("status", ASCENDING)], name="status"),
+        # Raw polls are for re-parsing recent data, not for keeping.
+        IndexModel(
+            [("fetched_at", ASCENDING)],
+            name="fetched_at_ttl",
+            expireAfterSeconds=RAW_OUTPUT_TTL_DAYS * 86400,
+        ),
+    ],
+    "interface_status_hourly": _rollup_indexes("router_ip"),
+    "route_table_hourly": _rollup_indexes("router_ip"),
+    "switch_status_hourly": _rollup_indexes("switch_ip"),
+}
+
+# Indexes dropped on startup: ones replaced by a differently named index
+# over the same keys (MongoDB refuses both at once) or no longer wanted.
+SUPERSEDED_INDEXES = {"state_changes": ["ip_kind_timestamp"]}
+if ROLLUP_TTL_DAYS <= 0:
+    # Rollups kept forever: drop a TTL set by an earlier configuration.
+    for _name in (
+        "interface_status_hourly",
+        "route_table_hourly",
+        "switch_status_hourly",
+    ):
+        SUPERSEDED_INDEXES[_name] = ["hour_ttl"]
+
+# Created by the worker as time-series collections. Indexing them first would
+# create them as plain collections, so they are skipped until they exist.
+HISTORY_COLLECTIONS = {"interface_status", "route_table", "switch_status"}
+
+
+def _update_ttls(db, name, indexes, present):
+    # A changed TTL can't be re-created under the same name; modify it.
+    for index in indexes:
+        spec = index.document
+        current = present.get(spec["name"])
+        if (
+            current is not None
+            and "expireAfterSeconds" in spec
+            and current.get("expireAfterSeconds") != spec["expireAfterSeconds"]
+        ):
+            db.command(
+                "collMod",
+                name,
+                index={
+                    "name": spec["name"],
+                    "expireAfterSeconds": spec["expireAfterSeconds"],
+                },
+            )
+
+
+def ensure_indexes(db):
+    """Create every index in ``INDEXES``; safe to run on each startup.
+
+    Returns ``{collection: error message}`` for collections whose indexes
+    could not be created, e.g. a unique index over existing duplicates.
+    """
+    existing = set(db.list_collection_names())
+    errors = {}
+    for name, indexes in INDEXES.items():
+        if name in HISTORY_COLLECTIONS and name not in existing:
+            continue
+        try:
+            if name in existing:
+                present = db[name].index_information()
+                for old in SUPERSEDED_INDEXES.get(name, ()):
+                    if old in present:
+                        db[name].drop_index(old)
+                _update_ttls(db, name, indexes, present)
+            db[name].create_indexes(indexes)
+        except PyMongoError as e:
+            errors[name] = str(e)
+            print(f"Could not create indexes on {name}: {e}")
+    return errors
+
+
+def index_status(db):
+    """Report which expected indexes exist, per collection."""
+    existing = set(db.list_collection_names())
+    status = {}
+    for name, indexes in INDEXES.items():
+        expected = [index.document["name"] for index in indexes]
+        present = set(db[name].index_information()) if name in existing else set()
+        status[name] = {
+            "expected": expected,
+            "missing": [index for index in expected if index not in present],
+        }
+    return status
@@ -0,0 +1,30 @@
+// Follows queued config jobs and reloads the page once each one finishes.
+(function () {
+    var pending = document.querySelectorAll("[data-job-url]");
+    if (!pending.length || !window.fetch) {
+        return;
+    }
+
+    function poll(alert) {
+        fetch(alert.dataset.jobUrl, { cache: "no-store" })
+            .then(function (response) {
+                return response.json();
+            })
+            .then(function (job) {
+                if (job.status === "queued" || job.status === "running") {
+                    alert.textContent = "กำลังดำเนินการ " + job.action + " (" + job.status + ")";
+                    setTimeout(poll, 2000, alert);
+                    return;
+                }
+                // The reloaded page shows the result and the updated tables.
+                window.location.reload();
+            })
+            .catch(function () {
+                setTimeout(poll, 5000, alert);
+            });
+    }
+
+    pending.forEach(function (alert) {
+        setTimeout(poll, 1000, alert);
+    });
+})();
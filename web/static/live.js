@@ -0,0 +1,74 @@
+// Applies row-level updates pushed over /devices/<ip>/events.
+(function () {
+    var url = document.body.dataset.eventsUrl;
+    if (!url || !window.EventSource) {
+        return;
+    }
+
+    function text(value) {
+        return value === undefined || value === null ? "" : String(value);
+    }
+
+    var renderers = {
+        interfaces: function (row) {
+            return [row.interface, row.ip_address, row.status, row.proto];
+        },
+        route: function (row) {
+            return [
+                row.protocol,
+                text(row.network) + "/" + text(row.prefix_length),
+                row.distance,
+                row.nexthop_ip,
+            ];
+        },
+        ports: function (row) {
+            return [row.port, row.name || "-", row.status, row.vlan, row.duplex, row.speed];
+        },
+    };
+
+    function apply(kind, change) {
+        var body = document.querySelector('[data-live-rows="' + kind + '"]');
+        if (!body) {
+            // The table was empty when the page rendered; render it properly.
+            window.location.reload();
+            return;
+        }
+        change.remove.forEach(function (key) {
+            body.querySelectorAll("tr").forEach(function (tr) {
+                if (tr.dataset.key === key) {
+                    tr.remove();
+                }
+            });
+        });
+        change.upsert.forEach(function (row) {
+            var tr = null;
+            body.querySelectorAll("tr").forEach(function (candidate) {
+                if (candidate.dataset.key === row.key) {
+                    tr = candidate;
+                }
+            });
+            if (!tr) {
+                tr = document.createElement("tr");
+                tr.dataset.key = row.key;
+                body.appendChild(tr);
+            }
+            tr.replaceChildren();
+            renderers[kind](row).forEach(function (value) {
+                var td = document.createElement("td");
+                td.textContent = text(value);
+                tr.appendChild(td);
+            });
+        });
+        var stamp = document.querySelector('[data-polled-at="' + kind + '"]');
+        if (stamp && change.polled_at) {
+            stamp.textContent = change.polled_at;
+        }
+    }
+
+    var source = new EventSource(url);
+    Object.keys(renderers).forEach(function (kind) {
+        source.addEventListener(kind, function (event) {
+            apply(kind, JSON.parse(event.data));
+        });
+    });
+})();
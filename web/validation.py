@@ -0,0 +1,145 @@
+import re
+import ipaddress
+
+
+def normalize_loopback(loopback_id):
+    match = re.fullmatch(r"(?:Loopback)?(\d+)", loopback_id.strip(), re.IGNORECASE)
+    if not match:
+        raise ValueError("Loopback ID ต้องเป็นตัวเลข เช่น 0 หรือ Loopback0")
+    return f"Loopback{match.group(1)}"
+
+
+def normalize_vlan(vlan_id):
+    match = re.fullmatch(r"(?:Vlan)?(\d+)", vlan_id.strip(), re.IGNORECASE)
+    if not match:
+        raise ValueError("VLAN ID ต้องเป็นตัวเลข เช่น 10 หรือ Vlan10")
+    return int(match.group(1))
+
+
+def normalize_network(destination, netmask=None):
+    if "/" in destination:
+        network = ipaddress.IPv4Network(destination, strict=False)
+    else:
+        if not netmask:
+            raise ValueError("โปรดระบุ Netmask หรือใช้รูปแบบ CIDR เช่น 10.0.0.0/24")
+        if netmask.startswith("/"):
+            prefix = int(netmask.lstrip("/"))
+            network = ipaddress.IPv4Network(f"{destination}/{prefix}", strict=False)
+        else:
+            network = ipaddress.IPv4Network((destination, netmask), strict=False)
+    return (
+        str(network.network_address),
+        str(network.netmask),
+        network.prefixlen,
+    )
+
+
+def normalize_address(ip_address, netmask):
+    """Return ``(ip, netmask)`` from an address given as CIDR or with a mask."""
+    if "/" in ip_address:
+        iface = ipaddress.IPv4Interface(ip_address)
+        ip_address = str(iface.ip)
+        if not netmask or netmask.startswith("/"):
+            netmask = str(iface.netmask)
+    if netmask.startswith("/"):
+        prefix = int(netmask.lstrip("/"))
+        netmask = str(ipaddress.IPv4Network(f"0.0.0.0/{prefix}").netmask)
+    ipaddress.IPv4Address(ip_address)
+    ipaddress.IPv4Address(netmask)
+    return ip_address, netmask
+
+
+def normalize_port(port):
+    """Return an SSH port as an int, or None when it was left empty."""
+    port = str(port or "").strip()
+    if not port:
+        return None
+    if not port.isdigit() or not 1 <= int(port) <= 65535:
+        raise ValueError("Port ต้องเป็นตัวเลข 1-65535")
+    return int(port)
+
+
+def _required(params, *names):
+    values = []
+    for name in names:
+        value = str(params.get(name) or "").strip()
+        if not value:
+            raise ValueError(f"ต้องระบุ {name}")
+        values.append(value)
+    return values
+
+
+def _enabled(params):
+    if params.get("action") not in {"enable", "disable"}:
+        raise ValueError("action ต้องเป็น enable หรือ disable")
+    return params["action"] == "enable"
+
+
+def normalize_params(action, params):
+    """Validate the parameters of ``action`` as the worker expects them.
+
+    Raises ``ValueError`` with a user-facing message on bad input.
+    """
+    secret = str(params.get("secret") or "").strip() or None
+    if action == "create_loopback":
+        loopback_id, ip_address = _required(params, "loopback_id", "ip_address")
+        ip_address, netmask = normalize_address(
+            ip_address, str(params.get("netmask") or "").strip()
+        )
+        return {
+            "loopback_id": normalize_loopback(loopback_id),
+            "ip_address": ip_address,
+            "netmask": netmask,
+            "secret": secret,
+        }
+    if action == "set_loopback_state":
+        (loopback_id,) = _required(params, "loopback_id")
+        return {
+            "loopback_id": normalize_loopback(loopback_id),
+            "enabled": _enabled(params),
+            "secret": secret,
+        }
+    if action == "delete_loopback":
+        (loopback_id,) = _required(params, "loopback_id")
+        return {"loopback_id": normalize_loopback(loopback_id), "secret": secret}
+    if action in {"create_static_route", "delete_static_route"}:
+        destination, next_hop = _required(params, "destination", "next_hop")
+        network, mask, prefix = normalize_network(destination, params.get("netmask"))
+        ipaddress.IPv4Address(next_hop)
+        if action == "create_static_route":
+            return {
+                "destination": network,
+                "netmask": mask,
+                "next_hop": next_hop,
+                "secret": secret,
+            }
+        return {
+            "network": network,
+            "netmask": mask,
+            "next_hop": next_hop,
+            "prefix_length": prefix,
+            "secret": secret,
+        }
+    if action == "create_vlan":
+        vlan_id, ip_address = _required(params, "vlan_id", "ip_address")
+        ip_address, netmask = normalize_address(
+            ip_address, str(params.get("netmask") or "").strip()
+        )
+        return {
+            "vlan_id": str(normalize_vlan(vlan_id)),
+            "ip_address": ip_address,
+            "netmask": netmask,
+            "name": str(params.get("name") or "").strip() or None,
+            "secret": secret,
+        }
+    if action == "set_vlan_state":
+        (vlan_id,) = _required(params, "vlan_id")
+        return {
+            "vlan_id": str(normalize_vlan(vlan_id)),
+            "enabled": _enabled(params),
+            "secret": secret,
+        }
+    if action == "delete_vlan":
+        (vlan_id,) = _required(params, "vlan_id")
+        return {"vlan_id": str(normalize_vlan(vlan_id)), "secret": secret}
+    raise ValueError(f"ไม่รู้จักคำสั่ง {action}")
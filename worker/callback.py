@@ -1,45 +1,128 @@
-from bson import json_util
-from router_client import get_interfaces, get_route_table, get_switch_ports
+import os
+import json
+
+from bson import json_util, ObjectId
+from router_client import (
+    collect,
+    fetch,
+    parser,
+    SHOW_INTERFACES,
+    SHOW_ROUTES,
+    SHOW_SWITCH_PORTS,
+)
 from database import (
     save_interface_status,
     save_route_table,
     save_switch_status,
+    save_raw_output,
+    load_raw_output,
+    mark_raw_output,
+    wait_for_writes,
+    record_poll_digest,
+    ROUTER_COLLECTION,
+    SWITCH_COLLECTION,
 )
 
+# "inline" parses and stores during the poll; "staged" only stores the raw
+# output and leaves parsing to whichever worker consumes PARSE_QUEUE.
+COLLECT_MODE = os.getenv("COLLECT_MODE", "inline")
+PARSE_QUEUE = "parse_jobs"
 
-def callback_router(ch, method, props, body):
-    job = json_util.loads(body.decode())
-    ip = job["ip"]
-    username = job["username"]
-    password = job["password"]
+ROUTER_COMMANDS = [SHOW_INTERFACES, SHOW_ROUTES]
+SWITCH_COMMANDS = [SHOW_SWITCH_PORTS]
 
-    print(f"Received job for router {ip}")
 
-    try:
-        output = get_interfaces(ip, username, password)
-        save_interface_status(ip, output)
-        print(f"Stored interface status for {ip}")
-        table = get_route_table(ip, username, password)
-        save_route_table(ip, table)
+def _items(output):
+    """Split a parsed output into ``(items, raw_output)``.
+
+    The parser hands back the raw text when a template matched no rows, e.g.
+    an empty route table; that is stored as no items plus the text.
+    """
+    if isinstance(output, list):
+        return output, None
+    return [], output
+
+
+def store_router(ip, results, at=None, history=True, digest=True):
+    interfaces, interfaces_raw = _items(results[SHOW_INTERFACES])
+    routes, routes_raw = _items(results[SHOW_ROUTES])
+    writes = [
+        save_interface_status(ip, interfaces, interfaces_raw, at=at, history=history),
+        save_route_table(ip, routes, routes_raw, at=at, history=history),
+    ]
+    wait_for_writes(writes)
+    print(f"Stored interface status for {ip}")
+    if digest:
+        record_poll_digest(ROUTER_COLLECTION, ip, results)
 
-    except Exception as e:
-        print(f" Error: {e}")
 
+def store_switch(ip, results, at=None, history=True, digest=True):
+    ports, raw_output = _items(results[SHOW_SWITCH_PORTS])
+    write = save_switch_status(ip, ports, raw_output, at=at, history=history)
+    wait_for_writes([write])
+    print(f"Stored switch status for {ip}")
+    if digest:
+        record_poll_digest(SWITCH_COLLECTION, ip, results[SHOW_SWITCH_PORTS])
 
-def callback_switch(ch, method, props, body):
+
+STORES = {ROUTER_COLLECTION: store_router, SWITCH_COLLECTION: store_switch}
+
+
+def _poll(body, kind, collection, commands):
     job = json_util.loads(body.decode())
     ip = job["ip"]
     username = job["username"]
     password = job["password"]
+    port = job.get("port")
+    # Seconds until the scheduler polls this device again.
+    interval = job.get("interval")
+
+    print(f"Received job for {kind} {ip}")
+
+    if COLLECT_MODE == "staged":
+        raw_id = save_raw_output(
+            collection, ip, fetch(ip, username, password, commands, port, interval)
+        )
+        print(f"Stored raw output {raw_id} for {ip}")
+        # The consumer publishes these just before acking the poll job.
+        return [(PARSE_QUEUE, json.dumps({"raw_id": str(raw_id)}))]
+    STORES[collection](ip, collect(ip, username, password, commands, port, interval))
+
+
+def callback_router(body):
+    return _poll(body, "router", ROUTER_COLLECTION, ROUTER_COMMANDS)
+
+
+def callback_switch(body):
+    return _poll(body, "switch", SWITCH_COLLECTION, SWITCH_COMMANDS)
+
 
-    print(f"Received job for switch {ip}")
+def callback_parse(body):
+    """Parse one stored poll and write the structured documents.
 
+    The history entries carry the time of the poll, not of the parse, and
+    ``device_state`` only moves if no newer poll has been stored yet. A poll
+    parsed before (``reparse.py``) adds no second history entry and does not
+    touch the change digest. A failure is recorded on the raw document,
+    which stays available for ``reparse.py``.
+    """
+    raw_id = ObjectId(json.loads(body.decode())["raw_id"])
+    loaded = load_raw_output(raw_id)
+    if loaded is None:
+        print(f"Raw output {raw_id} is gone (expired?), skipping")
+        return
+    doc, outputs = loaded
+    status = doc.get("status")
     try:
-        ports = get_switch_ports(ip, username, password)
-        if isinstance(ports, list):
-            save_switch_status(ip, ports)
-        else:
-            save_switch_status(ip, [], raw_output=ports)
-        print(f"Stored switch status for {ip}")
+        results = parser.parse_all(outputs)
+        STORES[doc["collection"]](
+            doc["ip"],
+            results,
+            at=doc["fetched_at"],
+            history=status != "parsed",
+            digest=status == "fetched",
+        )
     except Exception as e:
-        print(f" Error: {e}")
+        mark_raw_output(raw_id, "error", str(e))
+        raise
+    mark_raw_output(raw_id, "parsed")
@@ -0,0 +1,216 @@
+import ipaddress
+from datetime import datetime, UTC
+
+from netmiko import ConnectHandler
+from netmiko.exceptions import (
+    NetmikoAuthenticationException,
+    NetmikoTimeoutException,
+)
+from pymongo import UpdateOne, DeleteOne
+
+from database import db
+from router_actions import (
+    _build_device,
+    normalize_loopback,
+    normalize_network,
+    loopback_commands,
+    loopback_state_commands,
+    delete_loopback_commands,
+    static_route_command,
+)
+from switch_actions import (
+    normalize_vlan,
+    vlan_interface_commands,
+    vlan_state_commands,
+    delete_vlan_commands,
+)
+
+# Each builder turns one staged change into
+# (config commands, collection, write operation, short description).
+
+
+def _create_loopback(creds, params, now):
+    interface = normalize_loopback(params["loopback_id"])
+    record = {
+        "router_ip": creds["ip"],
+        "interface": interface,
+        "ip": params["ip_address"],
+        "netmask": params["netmask"],
+        "admin_state": "up",
+        "updated_at": now,
+    }
+    operation = UpdateOne(
+        {"router_ip": creds["ip"], "interface": interface},
+        {"$set": record, "$setOnInsert": {"created_at": now}},
+        upsert=True,
+    )
+    commands = loopback_commands(interface, params["ip_address"], params["netmask"])
+    return commands, "loopbacks", operation, f"สร้าง {interface}"
+
+
+def _set_loopback_state(creds, params, now):
+    interface = normalize_loopback(params["loopback_id"])
+    enabled = params["enabled"]
+    operation = UpdateOne(
+        {"router_ip": creds["ip"], "interface": interface},
+        {
+            "$set": {"admin_state": "up" if enabled else "down", "updated_at": now},
+            "$setOnInsert": {"router_ip": creds["ip"], "interface": interface},
+        },
+        upsert=True,
+    )
+    label = f"{'เปิด' if enabled else 'ปิด'} {interface}"
+    return loopback_state_commands(interface, enabled), "loopbacks", operation, label
+
+
+def _delete_loopback(creds, params, now):
+    interface = normalize_loopback(params["loopback_id"])
+    operation = DeleteOne({"router_ip": creds["ip"], "interface": interface})
+    commands = delete_loopback_commands(interface)
+    return commands, "loopbacks", operation, f"ลบ {interface}"
+
+
+def _create_static_route(creds, params, now):
+    network, mask, prefix = normalize_network(
+        params["destination"], params.get("netmask")
+    )
+    next_hop = str(ipaddress.IPv4Address(params["next_hop"]))
+    key = {
+        "router_ip": creds["ip"],
+        "network": network,
+        "netmask": mask,
+        "next_hop": next_hop,
+    }
+    record = dict(key, prefix_length=prefix, admin_state="present", updated_at=now)
+    operation = UpdateOne(
+        key, {"$set": record, "$setOnInsert": {"created_at": now}}, upsert=True
+    )
+    commands = [static_route_command(network, mask, next_hop)]
+    label = f"เพิ่ม static route {network}/{prefix} → {next_hop}"
+    return commands, "router_routes", operation, label
+
+
+def _delete_static_route(creds, params, now):
+    key = {
+        "router_ip": creds["ip"],
+        "network": params["network"],
+        "netmask": params["netmask"],
+        "next_hop": params["next_hop"],
+    }
+    command = static_route_command(
+        params["network"], params["netmask"], params["next_hop"]
+    )
+    label = f"ลบ static route {params['network']}/{params.get('prefix_length')}"
+    return ["no " + command], "router_routes", DeleteOne(key), label
+
+
+def _create_vlan(creds, params, now):
+    vlan = normalize_vlan(params["vlan_id"])
+    record = {
+        "switch_ip": creds["ip"],
+        "vlan": vlan,
+        "interface": f"Vlan{vlan}",
+        "ip": params["ip_address"],
+        "netmask": params["netmask"],
+        "name": params.get("name") or "",
+        "admin_state": "up",
+        "updated_at": now,
+    }
+    operation = UpdateOne(
+        {"switch_ip": creds["ip"], "vlan": vlan},
+        {"$set": record, "$setOnInsert": {"created_at": now}},
+        upsert=True,
+    )
+    commands = vlan_interface_commands(
+        vlan, params["ip_address"], params["netmask"], params.get("name")
+    )
+    return commands, "switch_vlans", operation, f"สร้าง Vlan{vlan}"
+
+
+def _set_vlan_state(creds, params, now):
+    vlan = normalize_vlan(params["vlan_id"])
+    enabled = params["enabled"]
+    operation = UpdateOne(
+        {"switch_ip": creds["ip"], "vlan": vlan},
+        {
+            "$set": {"admin_state": "up" if enabled else "down", "updated_at": now},
+            "$setOnInsert": {
+                "switch_ip": creds["ip"],
+                "vlan": vlan,
+                "interface": f"Vlan{vlan}",
+            },
+        },
+        upsert=True,
+    )
+    label = f"{'เปิด' if enabled else 'ปิด'} Vlan{vlan}"
+    return vlan_state_commands(vlan, enabled), "switch_vlans", operation, label
+
+
+def _delete_vlan(creds, params, now):
+    vlan = normalize_vlan(params["vlan_id"])
+    operation = DeleteOne({"switch_ip": creds["ip"], "vlan": vlan})
+    return delete_vlan_commands(vlan), "switch_vlans", operation, f"ลบ Vlan{vlan}"
+
+
+BUILDERS = {
+    "create_loopback": _create_loopback,
+    "set_loopback_state": _set_loopback_state,
+    "delete_loopback": _delete_loopback,
+    "create_static_route": _create_static_route,
+    "delete_static_route": _delete_static_route,
+    "create_vlan": _create_vlan,
+    "set_vlan_state": _set_vlan_state,
+    "delete_vlan": _delete_vlan,
+}
+
+
+def build_changeset(creds, changes, now):
+    """Return the config commands, grouped writes and labels for ``changes``.
+
+    Raises ``ValueError`` for an unknown action or invalid parameters, so a
+    bad change stops the whole set before anything is sent.
+    """
+    commands, writes, labels = [], {}, []
+    for change in changes:
+        builder = BUILDERS.get(change["action"])
+        if builder is None:
+            raise ValueError(f"ไม่รู้จักคำสั่ง {change['action']}")
+        change_commands, collection, operation, label = builder(
+            creds, change["params"], now
+        )
+        commands.extend(change_commands)
+        if change_commands[0].startswith(("interface ", "vlan ")):
+            # Back to global config so the next change starts from there.
+            commands.append("exit")
+        writes.setdefault(collection, []).append(operation)
+        labels.append(label)
+    return commands, writes, labels
+
+
+def apply_changeset(creds, changes, secret=None):
+    """Push every staged change in one session, then store them.
+
+    The changes go out as a single ``send_config_set``; the collections are
+    only written, one ordered bulk write each, once the device accepted it.
+    """
+    if not changes:
+        return False, "ไม่มีคำสั่งในชุดคำสั่ง"
+    commands, writes, labels = build_changeset(creds, changes, datetime.now(UTC))
+    device = _build_device(creds, override_secret=secret)
+    try:
+        with ConnectHandler(**device) as conn:
+            try:
+                conn.enable()
+            except Exception as exc:
+                return False, f"เข้าสู่ privileged mode ไม่ได้: {exc}"
+            conn.send_config_set(commands)
+    except NetmikoTimeoutException as exc:
+        return False, f"เชื่อมต่อ {device['host']} ไม่สำเร็จ: {exc}"
+    except NetmikoAuthenticationException as exc:
+        return False, f"เข้าสู่ระบบ {device['host']} ไม่สำเร็จ: {exc}"
+    except Exception as exc:
+        return False, f"ใช้ชุดคำสั่งไม่สำเร็จ: {exc}"
+
+    for collection, operations in writes.items():
+        db[collection].bulk_write(operations, ordered=True)
+    return True, f"ใช้ชุดคำสั่ง {len(labels)} รายการสำเร็จ: " + ", ".join(labels)
@@ -0,0 +1,409 @@
+import os
+import socket
+from datetime import datetime, UTC
+
+from bson import json_util
+from pymongo import ReturnDocument
+
+from database import db, ROUTER_COLLECTION, SWITCH_COLLECTION
+from router_actions import (
+    create_loopback,
+    set_loopback_state,
+    delete_loopback,
+    create_static_route,
+    delete_static_route,
+)
+from changeset import apply_changeset
+from switch_actions import (
+    create_vlan_interface,
+    set_vlan_state,
+    delete_vlan,
+)
+
+CONFIG_QUEUE = "config_jobs"
+JOBS_COLLECTION = "config_jobs"
+BULK_COLLECTION = "bulk_jobs"
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED = "finished"
+INTERRUPTED_MESSAGE = "งานถูกขัดจังหวะระหว่างทำงาน กรุณาตรวจสอบอุปกรณ์แล้วลองอีกครั้ง"
+BULK_MAX_PARALLELISM = int(os.getenv("BULK_MAX_PARALLELISM", "32"))
+
+loopbacks = db["loopbacks"]
+router_routes = db["router_routes"]
+switch_vlans = db["switch_vlans"]
+
+
+def _state_text(enabled):
+    return "เปิด" if enabled else "ปิด"
+
+
+def _create_loopback(creds, params):
+    success, payload = create_loopback(
+        creds,
+        params["loopback_id"],
+        params["ip_address"],
+        params["netmask"],
+        secret=params.get("secret"),
+    )
+    if not success:
+        return False, payload
+    loopbacks.update_one(
+        {"router_ip": payload["router_ip"], "interface": payload["interface"]},
+        {"$set": payload, "$setOnInsert": {"created_at": payload["updated_at"]}},
+        upsert=True,
+    )
+    return True, f"สร้าง {payload['interface']} สำเร็จ"
+
+
+def _set_loopback_state(creds, params):
+    enabled = params["enabled"]
+    success, payload = set_loopback_state(
+        creds, params["loopback_id"], enabled=enabled, secret=params.get("secret")
+    )
+    if not success:
+        return False, payload
+    loopbacks.update_one(
+        {"router_ip": creds["ip"], "interface": payload["interface"]},
+        {
+            "$set": {
+                "admin_state": payload["admin_state"],
+                "updated_at": payload["updated_at"],
+            },
+            "$setOnInsert": {
+                "router_ip": creds["ip"],
+                "interface": payload["interface"],
+            },
+        },
+        upsert=True,
+    )
+    return True, f"{_state_text(enabled)} {payload['interface']} สำเร็จ"
+
+
+def _delete_loopback(creds, params):
+    success, payload = delete_loopback(
+        creds, params["loopback_id"], secret=params.get("secret")
+    )
+    if not success:
+        return False, payload
+    loopbacks.delete_one({"router_ip": creds["ip"], "interface": payload["interface"]})
+    return True, f"ลบ {payload['interface']} สำเร็จ"
+
+
+def _create_static_route(creds, params):
+    success, payload = create_static_route(
+        creds,
+        params["destination"],
+        params.get("netmask"),
+        params["next_hop"],
+        secret=params.get("secret"),
+    )
+    if not success:
+        return False, payload
+    router_routes.update_one(
+        {
+            "router_ip": payload["router_ip"],
+            "network": payload["network"],
+            "netmask": payload["netmask"],
+            "next_hop": payload["next_hop"],
+        },
+        {"$set": payload, "$setOnInsert": {"created_at": payload["updated_at"]}},
+        upsert=True,
+    )
+    return True, (
+        f"เพิ่ม static route {payload['network']}/{payload['prefix_length']} "
+        f"→ {payload['next_hop']} สำเร็จ"
+    )
+
+
+def _delete_static_route(creds, params):
+    success, payload = delete_static_route(
+        creds,
+        params["network"],
+        params["netmask"],
+        params["next_hop"],
+        secret=params.get("secret"),
+    )
+    if not success:
+        return False, payload
+    router_routes.delete_one(
+        {
+            "router_ip": creds["ip"],
+            "network": params["network"],
+            "netmask": params["netmask"],
+            "next_hop": params["next_hop"],
+        }
+    )
+    return True, (
+        f"ลบ static route {params['network']}/{params.get('prefix_length')} สำเร็จ"
+    )
+
+
+def _create_vlan(creds, params):
+    success, payload = create_vlan_interface(
+        creds,
+        params["vlan_id"],
+        params["ip_address"],
+        params["netmask"],
+        name=params.get("name"),
+        secret=params.get("secret"),
+    )
+    if not success:
+        return False, payload
+    switch_vlans.update_one(
+        {"switch_ip": payload["switch_ip"], "vlan": payload["vlan"]},
+        {"$set": payload, "$setOnInsert": {"created_at": payload["updated_at"]}},
+        upsert=True,
+    )
+    return True, f"สร้าง {payload['interface']} สำเร็จ"
+
+
+def _set_vlan_state(creds, params):
+    enabled = params["enabled"]
+    success, payload = set_vlan_state(
+        creds, params["vlan_id"], enabled=enabled, secret=params.get("secret")
+    )
+    if not success:
+        return False, payload
+    switch_vlans.update_one(
+        {"switch_ip": creds["ip"], "vlan": payload["vlan"]},
+        {
+            "$set": {
+                "admin_state": payload["admin_state"],
+                "updated_at": payload["updated_at"],
+            },
+            "$setOnInsert": {
+                "switch_ip": creds["ip"],
+                "vlan": payload["vlan"],
+                "interface": payload["interface"],
+            },
+        },
+        upsert=True,
+    )
+    return True, f"{_state_text(enabled)} {payload['interface']} สำเร็จ"
+
+
+def _delete_vlan(creds, params):
+    success, payload = delete_vlan(
+        creds, params["vlan_id"], secret=params.get("secret")
+    )
+    if not success:
+        return False, payload
+    switch_vlans.delete_one({"switch_ip": creds["ip"], "vlan": payload["vlan"]})
+    return True, f"ลบ {payload['interface']} สำเร็จ"
+
+
+def _apply_changeset(creds, params):
+    return apply_changeset(creds, params["changes"], secret=params.get("secret"))
+
+
+# action name -> (device collection, handler, device label)
+ACTIONS = {
+    "create_loopback": (ROUTER_COLLECTION, _create_loopback, "Router"),
+    "set_loopback_state": (ROUTER_COLLECTION, _set_loopback_state, "Router"),
+    "delete_loopback": (ROUTER_COLLECTION, _delete_loopback, "Router"),
+    "create_static_route": (ROUTER_COLLECTION, _create_static_route, "Router"),
+    "delete_static_route": (ROUTER_COLLECTION, _delete_static_route, "Router"),
+    "create_vlan": (SWITCH_COLLECTION, _create_vlan, "Switch"),
+    "set_vlan_state": (SWITCH_COLLECTION, _set_vlan_state, "Switch"),
+    "delete_vlan": (SWITCH_COLLECTION, _delete_vlan, "Switch"),
+    "apply_router_changeset": (ROUTER_COLLECTION, _apply_changeset, "Router"),
+    "apply_switch_changeset": (SWITCH_COLLECTION, _apply_changeset, "Switch"),
+}
+
+
+def run_action(action, ip, params):
+    """Run one config action against ``ip``.
+
+    Returns ``(success, message, hint)``; ``hint`` suggests a fix for
+    failures the user can resolve themselves.
+    """
+    if action not in ACTIONS:
+        return False, f"ไม่รู้จักคำสั่ง {action}", None
+    collection, handler, label = ACTIONS[action]
+    creds = db[collection].find_one({"ip": ip})
+    if not creds:
+        return False, f"ไม่พบข้อมูล {label} ในระบบ", None
+
+    try:
+        success, message = handler(creds, params)
+    except ValueError as exc:
+        success, message = False, str(exc)
+
+    hint = None
+    if not success and "privileged mode" in message.lower() and not creds.get("secret"):
+        hint = f"กรุณาเพิ่ม Enable Secret ให้ {label} ในหน้าหลัก แล้วลองอีกครั้ง"
+    return success, message, hint
+
+
+def _claim(collection, job_id):
+    """Move a queued job to running; returns it, or None if already taken."""
+    now = datetime.now(UTC)
+    job = db[collection].find_one_and_update(
+        {"_id": job_id, "status": QUEUED},
+        {
+            "$set": {
+                "status": RUNNING,
+                "started_at": now,
+                "updated_at": now,
+                "worker": socket.gethostname(),
+            }
+        },
+        return_document=ReturnDocument.AFTER,
+    )
+    if job is None:
+        current = db[collection].find_one({"_id": job_id}, {"status": 1})
+        if current and current["status"] == RUNNING:
+            # A worker died mid-job; the device may or may not have the change.
+            _finish(
+                collection,
+                job_id,
+                {
+                    "status": FAILED,
+                    "message": INTERRUPTED_MESSAGE,
+                },
+            )
+        print(f"Skipping {collection} job {job_id}: already handled")
+    return job
+
+
+def _finish(collection, job_id, fields):
+    now = datetime.now(UTC)
+    fields.update({"finished_at": now, "updated_at": now})
+    db[collection].update_one(
+        {"_id": job_id},
+        # The override secret is only needed while the job runs.
+        {"$set": fields, "$unset": {"params.secret": ""}},
+    )
+
+
+def _finish_job(job_id, success, message, hint=None):
+    _finish(
+        JOBS_COLLECTION,
+        job_id,
+        {
+            "status": SUCCEEDED if success else FAILED,
+            "message": message,
+            "hint": hint,
+        },
+    )
+
+
+def _run_config_job(job_id):
+    job = _claim(JOBS_COLLECTION, job_id)
+    if job is None:
+        return
+
+    print(f"Received config job {job['action']} for {job['ip']}")
+    try:
+        success, message, hint = run_action(job["action"], job["ip"], job["params"])
+    except Exception as exc:
+        _finish_job(job_id, False, str(exc))
+        raise
+    _finish_job(job_id, success, message, hint)
+    print(f"Config job {job_id} {'succeeded' if success else 'failed'}: {message}")
+
+
+def _next_device(bulk_id):
+    """Hand out the next undispatched device of a bulk job as a message."""
+    bulk = db[BULK_COLLECTION].find_one_and_update(
+        {"_id": bulk_id, "$expr": {"$lt": ["$dispatched", "$total"]}},
+        {"$inc": {"dispatched": 1}},
+        projection={"ips": 1, "dispatched": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if bulk is None:
+        return []
+    ip = bulk["ips"][bulk["dispatched"] - 1]
+    return [(CONFIG_QUEUE, json_util.dumps({"bulk_id": bulk_id, "ip": ip}))]
+
+
+def _record_result(bulk_id, ip, success, message, hint=None):
+    result = {
+        "ip": ip,
+        "success": success,
+        "message": message,
+        "hint": hint,
+        "finished_at": datetime.now(UTC),
+    }
+    bulk = db[BULK_COLLECTION].find_one_and_update(
+        {"_id": bulk_id, "results.ip": {"$ne": ip}},
+        {
+            "$push": {"results": result},
+            "$inc": {"succeeded" if success else "failed": 1},
+        },
+        projection={"total": 1, "succeeded": 1, "failed": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if bulk and bulk["succeeded"] + bulk["failed"] >= bulk["total"]:
+        _finish(BULK_COLLECTION, bulk_id, {"status": FINISHED})
+        print(f"Bulk job {bulk_id} finished")
+
+
+def _run_bulk_job(bulk_id):
+    """Start a bulk job by queueing its first ``parallelism`` devices.
+
+    Each device then runs as its own short message (``_run_bulk_device``)
+    that queues the next one when it is done, so no delivery stays unacked
+    for the whole job and a crash only repeats one device.
+    """
+    bulk = _claim(BULK_COLLECTION, bulk_id)
+    if bulk is None:
+        return []
+
+    parallelism = max(1, min(bulk.get("parallelism") or 1, BULK_MAX_PARALLELISM))
+    print(
+        f"Received bulk {bulk['action']} for {len(bulk['ips'])} devices, "
+        f"{parallelism} at once"
+    )
+    if not bulk["ips"]:
+        _finish(BULK_COLLECTION, bulk_id, {"status": FINISHED})
+        return []
+    db[BULK_COLLECTION].update_one({"_id": bulk_id}, {"$set": {"dispatched": 0}})
+    followups = []
+    for _ in range(parallelism):
+        followups += _next_device(bulk_id)
+    return followups
+
+
+def _run_bulk_device(bulk_id, ip):
+    """Apply a bulk job's change to one device, then queue the next device.
+
+    The outcome is pushed onto the job's ``results`` and counted in
+    ``succeeded``/``failed`` so the web app can stream progress; the last
+    one marks the job finished.
+    """
+    bulk = db[BULK_COLLECTION].find_one_and_update(
+        {"_id": bulk_id, "status": RUNNING, "started": {"$ne": ip}},
+        {"$addToSet": {"started": ip}},
+        projection={"action": 1, "params": 1},
+    )
+    if bulk is None:
+        # Redelivered: either the device finished and only the ack was lost,
+        # or a worker died while changing it.
+        done = db[BULK_COLLECTION].find_one(
+            {"_id": bulk_id, "results.ip": ip}, {"_id": 1}
+        )
+        if done is None:
+            _record_result(bulk_id, ip, False, INTERRUPTED_MESSAGE)
+        print(f"Skipping bulk job {bulk_id} device {ip}: already handled")
+        # Keeps the job moving; at worst one extra device runs concurrently.
+        return _next_device(bulk_id)
+
+    try:
+        success, message, hint = run_action(bulk["action"], ip, bulk["params"])
+    except Exception as exc:
+        success, message, hint = False, str(exc), None
+    _record_result(bulk_id, ip, success, message, hint)
+    return _next_device(bulk_id)
+
+
+def callback_config(body):
+    job = json_util.loads(body.decode())
+    if "ip" in job and "bulk_id" in job:
+        return _run_bulk_device(job["bulk_id"], job["ip"])
+    if "bulk_id" in job:
+        return _run_bulk_job(job["bulk_id"])
+    _run_config_job(job["job_id"])
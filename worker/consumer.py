@@ -1,14 +1,67 @@
 import os
 import time
+import signal
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import pika
 
-from callback import callback_router, callback_switch
+from callback import callback_router, callback_switch, callback_parse, PARSE_QUEUE
+from config_jobs import callback_config, CONFIG_QUEUE
+from router_client import pool, parser
+from database import buffer
 
 user = os.getenv("RABBITMQ_DEFAULT_USER")
 pwd = os.getenv("RABBITMQ_DEFAULT_PASS")
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "1"))
+# "fetch" consumes the polling and config queues, "parse" only PARSE_QUEUE,
+# "all" everything, so each stage can be scaled on its own.
+WORKER_ROLE = os.getenv("WORKER_ROLE", "all")
+
+
+def _finish(ch, delivery_tag, props, ok, followups):
+    if ok:
+        # Published before the ack: a crash in between repeats the job
+        # rather than losing its follow-up.
+        for queue, body in followups:
+            ch.basic_publish(
+                exchange="",
+                routing_key=queue,
+                body=body,
+                properties=pika.BasicProperties(delivery_mode=2),
+            )
+        ch.basic_ack(delivery_tag)
+    else:
+        # The next scheduler tick polls the device again, and failed config
+        # jobs are already recorded as such, so don't requeue.
+        ch.basic_nack(delivery_tag, requeue=False)
+    if props.reply_to:
+        # Tell the scheduler this device is no longer in flight.
+        ch.basic_publish(
+            exchange="",
+            routing_key=props.reply_to,
+            properties=pika.BasicProperties(correlation_id=props.correlation_id),
+            body=b"ok" if ok else b"error",
+        )
 
 
-def consume(host):
+def _run_job(conn, ch, delivery_tag, props, handler, body):
+    followups = []
+    try:
+        # Handlers may return (queue, body) messages to publish next.
+        followups = handler(body) or []
+        ok = True
+    except Exception as e:
+        print(f" Error: {e}")
+        ok = False
+    # Channel methods must run on the connection's own thread.
+    conn.add_callback_threadsafe(
+        functools.partial(_finish, ch, delivery_tag, props, ok, followups)
+    )
+
+
+def consume(host, concurrency=WORKER_CONCURRENCY, role=WORKER_ROLE):
     for attempt in range(10):
         try:
             print(f"Connecting to RabbitMQ (try {attempt})...")
@@ -24,19 +77,69 @@ def consume(host):
         print("Could not connect after 10 attempts")
         exit(1)
 
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    in_flight = set()
+    lock = threading.Lock()
+
+    def dispatch(handler, ch, method, props, body):
+        future = executor.submit(
+            _run_job, conn, ch, method.delivery_tag, props, handler, body
+        )
+        with lock:
+            in_flight.add(future)
+        future.add_done_callback(_forget)
+
+    def _forget(future):
+        with lock:
+            in_flight.discard(future)
+
     ch = conn.channel()
     ch.queue_declare(queue="router_jobs")
     ch.queue_declare(queue="switch_jobs")
-    ch.basic_qos(prefetch_count=1)
-    ch.basic_consume(
-        queue="router_jobs", on_message_callback=callback_router, auto_ack=True
-    )
-    ch.basic_consume(
-        queue="switch_jobs", on_message_callback=callback_switch, auto_ack=True
-    )
+    # Config actions come from the web app and must survive a broker restart.
+    ch.queue_declare(queue=CONFIG_QUEUE, durable=True)
+    # Stored polls wait here for a parse worker; the raw output is in Mongo.
+    ch.queue_declare(queue=PARSE_QUEUE, durable=True)
+    # Shared across all consumers so at most `concurrency` jobs are unacked.
+    ch.basic_qos(prefetch_count=concurrency, global_qos=True)
+    handlers = {}
+    if role in ("all", "fetch"):
+        handlers["router_jobs"] = callback_router
+        handlers["switch_jobs"] = callback_switch
+        handlers[CONFIG_QUEUE] = callback_config
+    if role in ("all", "parse"):
+        handlers[PARSE_QUEUE] = callback_parse
+    if not handlers:
+        print(f"Unknown WORKER_ROLE {role!r}")
+        exit(1)
+    for queue, handler in handlers.items():
+        ch.basic_consume(
+            queue=queue, on_message_callback=functools.partial(dispatch, handler)
+        )
+
+    def shutdown(signum, frame):
+        print(f"Received signal {signum}, finishing in-flight jobs...")
+        conn.add_callback_threadsafe(ch.stop_consuming)
 
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    print(f"Consuming {', '.join(handlers)} with concurrency {concurrency}")
     ch.start_consuming()
 
+    # Keep the connection serviced so the remaining acks can go out.
+    while True:
+        with lock:
+            if not in_flight:
+                break
+        conn.process_data_events(time_limit=1)
+    executor.shutdown(wait=True)
+    conn.process_data_events(time_limit=0)
+    buffer.close()
+    pool.close_all()
+    parser.close()
+    conn.close()
+
 
 if __name__ == "__main__":
     consume("localhost")
@@ -1,58 +1,429 @@
-from pymongo import MongoClient
-from datetime import datetime, UTC
 import os
+import json
+import zlib
+import queue
+import hashlib
+import atexit
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, UTC
 
+from pymongo import MongoClient, InsertOne, UpdateOne
+from pymongo.errors import PyMongoError
 
-def save_interface_status(router_ip, interfaces):
+MONGO_URI = os.getenv("MONGO_URI")
+DB_NAME = os.getenv("DB_NAME")
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "100"))
+WRITE_FLUSH_INTERVAL = float(os.getenv("WRITE_FLUSH_INTERVAL", "0.5"))
+WRITE_QUEUE_SIZE = int(os.getenv("WRITE_QUEUE_SIZE", "1000"))
+WRITE_TIMEOUT = float(os.getenv("WRITE_TIMEOUT", "30"))
+# "snapshot" stores every poll in full; "delta" stores only changes.
+STORAGE_MODE = os.getenv("STORAGE_MODE", "snapshot")
+DELTA_BASELINE_EVERY = int(os.getenv("DELTA_BASELINE_EVERY", "100"))
+RAW_COMPRESS_LEVEL = int(os.getenv("RAW_COMPRESS_LEVEL", "6"))
 
-    MONGO_URI = os.getenv("MONGO_URI")
-    DB_NAME = os.getenv("DB_NAME")
+client = MongoClient(MONGO_URI)
+db = client[DB_NAME]
 
-    client = MongoClient(MONGO_URI)
-    db = client[DB_NAME]
-    collection = db["interface_status"]
+ROUTER_COLLECTION = "mycollection"
+SWITCH_COLLECTION = "switch"
+RAW_COLLECTION = "raw_outputs"
+# Fields that change on every poll without the device state changing.
+VOLATILE_FIELDS = {"uptime"}
 
-    data = {
-        "router_ip": router_ip,
-        "timestamp": datetime.now(UTC),
-        "interfaces": interfaces,
-    }
-    collection.insert_one(data)
-    client.close()
 
+class WriteBuffer:
+    """Write-behind buffer that batches writes into bulk_write calls.
 
-def save_route_table(router_ip, route_table_info):
-    MONGO_URI = os.getenv("MONGO_URI")
-    DB_NAME = os.getenv("DB_NAME")
+    A batch is flushed once it holds ``batch_size`` operations or
+    ``flush_interval`` seconds after its first operation arrived. Callers get
+    a Future that resolves when their write has been applied. ``write``
+    blocks while ``max_size`` operations are waiting, so a slow database
+    pushes back on the workers instead of growing memory.
+    """
+
+    _STOP = object()
+
+    def __init__(
+        self,
+        batch_size=WRITE_BATCH_SIZE,
+        flush_interval=WRITE_FLUSH_INTERVAL,
+        max_size=WRITE_QUEUE_SIZE,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_size)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="mongo-write-buffer", daemon=True
+                )
+                self._thread.start()
+
+    def write(self, collection, operation):
+        future = Future()
+        self._ensure_started()
+        self._queue.put((collection, operation, future))
+        return future
+
+    def insert(self, collection, document):
+        return self.write(collection, InsertOne(document))
+
+    def _next_batch(self):
+        item = self._queue.get()
+        if item is self._STOP:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is self._STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _flush(self, batch):
+        by_collection = {}
+        for collection, operation, future in batch:
+            by_collection.setdefault(collection, []).append((operation, future))
+        for collection, items in by_collection.items():
+            try:
+                db[collection].bulk_write(
+                    [operation for operation, _ in items], ordered=False
+                )
+            except Exception as e:
+                print(f"Failed to write {len(items)} operations to {collection}: {e}")
+                for _, future in items:
+                    future.set_exception(e)
+            else:
+                for _, future in items:
+                    future.set_result(True)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._next_batch()
+            if batch:
+                self._flush(batch)
+
+    def close(self):
+        """Flush everything queued so far and stop the writer thread."""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            self._queue.put(self._STOP)
+            thread.join()
+
+
+buffer = WriteBuffer()
+atexit.register(buffer.close)
+
+
+def wait_for_writes(futures, timeout=WRITE_TIMEOUT):
+    """Block until the buffered writes are stored; re-raises write errors."""
+    for future in futures:
+        future.result(timeout=timeout)
+
+
+def _all_of(futures):
+    """Combine futures into one that fails if any of them fails."""
+    combined = Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def done(future):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if future.exception() is not None and not combined.done():
+            combined.set_exception(future.exception())
+        elif last and not combined.done():
+            combined.set_result(True)
+
+    for future in futures:
+        future.add_done_callback(done)
+    return combined
+
+
+def _item_key(item):
+    return json.dumps(_strip_volatile(item), sort_keys=True, default=str)
+
+
+def diff_items(old, new):
+    """Return the ``(added, removed)`` items between two parsed outputs."""
+    old_keys = {_item_key(item): item for item in old}
+    new_keys = {_item_key(item): item for item in new}
+    added = [item for key, item in new_keys.items() if key not in old_keys]
+    removed = [item for key, item in old_keys.items() if key not in new_keys]
+    return added, removed
+
+
+def _aware(moment):
+    # pymongo hands back naive UTC datetimes.
+    return moment if moment.tzinfo else moment.replace(tzinfo=UTC)
 
-    client = MongoClient(MONGO_URI)
-    db = client[DB_NAME]
-    collection = db["route_table"]
-    data = {
-        "router_ip": router_ip,
-        "timestamp": datetime.now(UTC),
-        "route": route_table_info,
-    }
-    collection.insert_one(data)
-    client.close()
 
+def _done():
+    future = Future()
+    future.set_result(True)
+    return future
 
-def save_switch_status(switch_ip, ports, raw_output=None):
-    MONGO_URI = os.getenv("MONGO_URI")
-    DB_NAME = os.getenv("DB_NAME")
 
-    client = MongoClient(MONGO_URI)
-    db = client[DB_NAME]
-    collection = db["switch_status"]
+def _state_update(ip, kind, now, fields):
+    """Set ``fields`` on the device's state unless a newer poll already did.
 
-    data = {
-        "switch_ip": switch_ip,
-        "timestamp": datetime.now(UTC),
-        "ports": ports,
+    Polls can be parsed out of order (two parse workers, ``reparse.py``), so
+    every field keeps its stored value while ``<kind>_polled_at`` is later
+    than ``now``.
+    """
+    fields = {**fields, f"{kind}_polled_at": now}
+    newer = {"$gt": [f"${kind}_polled_at", now]}
+    update = {
+        name: {"$cond": [newer, f"${name}", {"$literal": value}]}
+        for name, value in fields.items()
     }
+    update["last_seen"] = {"$max": ["$last_seen", now]}
+    return UpdateOne({"ip": ip}, [{"$set": update}], upsert=True)
+
+
+def save_state_delta(ip, kind, items, extra=None, at=None):
+    """Store ``items`` for ``ip`` as a change against its last known state.
+
+    ``device_state`` holds the current items per device. When they differ,
+    a record with the added and removed items goes to ``state_changes`` and
+    the current state is replaced; otherwise only the poll timestamps are
+    touched. Every ``DELTA_BASELINE_EVERY`` changes a full baseline record
+    is written so ``reconstruct_state`` never has to replay more than that.
+    A poll older than the stored state is dropped: a change record in the
+    middle of the chain would corrupt every state rebuilt after it.
+
+    The record is keyed by ``(ip, kind, timestamp)`` and written before the
+    state moves, so a crash in between or a redelivered poll rewrites the
+    same record instead of adding a second one.
+    """
+    now = at or datetime.now(UTC)
+    state = db["device_state"].find_one(
+        {"ip": ip}, {kind: 1, f"{kind}_changes": 1, f"{kind}_polled_at": 1}
+    )
+    polled_at = state.get(f"{kind}_polled_at") if state else None
+    if polled_at is not None and _aware(polled_at) > _aware(now):
+        print(f"Skipping {kind} of {ip} from {now}: state is from {polled_at}")
+        return _done()
+    previous = state.get(kind) if state else None
+    if not isinstance(previous, list):
+        # Nothing stored yet, or raw text from before outputs were split.
+        previous = None
+    if previous is not None:
+        added, removed = diff_items(previous, items)
+        if not added and not removed:
+            fields = dict(extra or {})
+            return buffer.write("device_state", _state_update(ip, kind, now, fields))
+    changes = state.get(f"{kind}_changes", 0) if state else 0
+    if previous is None or changes + 1 >= DELTA_BASELINE_EVERY:
+        record = {"baseline": True, "added": items, "removed": []}
+        changes = 0
+    else:
+        record = {"baseline": False, "added": added, "removed": removed}
+        changes += 1
+    record.update({"ip": ip, "kind": kind, "timestamp": now})
+    fields = {kind: items, f"{kind}_changed_at": now, f"{kind}_changes": changes}
+    fields.update(extra or {})
+    db["state_changes"].update_one(
+        {"ip": ip, "kind": kind, "timestamp": now}, {"$set": record}, upsert=True
+    )
+    return buffer.write("device_state", _state_update(ip, kind, now, fields))
+
+
+def save_state_snapshot(
+    collection,
+    ip_field,
+    ip,
+    kind,
+    items,
+    extra=None,
+    history_extra=None,
+    at=None,
+    history=True,
+):
+    """Append a full snapshot to ``collection`` and refresh ``device_state``.
+
+    With ``history=False`` only ``device_state`` is refreshed.
+    """
+    now = at or datetime.now(UTC)
+    fields = {kind: items, **(extra or {})}
+    writes = [buffer.write("device_state", _state_update(ip, kind, now, fields))]
+    if history:
+        data = {ip_field: ip, "timestamp": now, kind: items}
+        data.update(history_extra or {})
+        writes.append(buffer.insert(collection, data))
+    return _all_of(writes)
+
+
+def reconstruct_state(ip, kind, at=None):
+    """Rebuild the ``kind`` items of ``ip`` as they were at time ``at``."""
+    query = {"ip": ip, "kind": kind}
+    if at is not None:
+        query["timestamp"] = {"$lte": at}
+    baseline = db["state_changes"].find_one(
+        dict(query, baseline=True), sort=[("timestamp", -1)]
+    )
+    if baseline is None:
+        return None
+    state = {_item_key(item): item for item in baseline["added"]}
+    query.setdefault("timestamp", {})["$gt"] = baseline["timestamp"]
+    for change in db["state_changes"].find(query).sort("timestamp", 1):
+        for item in change["removed"]:
+            state.pop(_item_key(item), None)
+        for item in change["added"]:
+            state[_item_key(item)] = item
+    return list(state.values())
+
+
+# ``history=False`` skips the snapshot entry; delta mode always writes its
+# change record, since device_state must never move without one. Raw output
+# is only kept when the command's output could not be parsed.
+def save_interface_status(
+    router_ip, interfaces, raw_output=None, at=None, history=True
+):
+    extra = {"interfaces_raw_output": raw_output or None}
+    if STORAGE_MODE == "delta":
+        return save_state_delta(router_ip, "interfaces", interfaces, extra, at=at)
+    history_extra = {"raw_output": raw_output} if raw_output else None
+    return save_state_snapshot(
+        "interface_status",
+        "router_ip",
+        router_ip,
+        "interfaces",
+        interfaces,
+        extra,
+        history_extra,
+        at=at,
+        history=history,
+    )
+
+
+def save_route_table(
+    router_ip, route_table_info, raw_output=None, at=None, history=True
+):
+    extra = {"route_raw_output": raw_output or None}
+    if STORAGE_MODE == "delta":
+        return save_state_delta(router_ip, "route", route_table_info, extra, at=at)
+    history_extra = {"raw_output": raw_output} if raw_output else None
+    return save_state_snapshot(
+        "route_table",
+        "router_ip",
+        router_ip,
+        "route",
+        route_table_info,
+        extra,
+        history_extra,
+        at=at,
+        history=history,
+    )
+
+
+def save_switch_status(switch_ip, ports, raw_output=None, at=None, history=True):
+    extra = {"ports_raw_output": raw_output or None}
+    if STORAGE_MODE == "delta":
+        return save_state_delta(switch_ip, "ports", ports, extra, at=at)
+    history_extra = {"raw_output": raw_output} if raw_output else None
+    return save_state_snapshot(
+        "switch_status",
+        "switch_ip",
+        switch_ip,
+        "ports",
+        ports,
+        extra,
+        history_extra,
+        at=at,
+        history=history,
+    )
+
+
+def save_raw_output(collection, ip, outputs):
+    """Store the unparsed output of one poll, zlib-compressed.
+
+    ``outputs`` maps each command to its text. Returns the new document's id.
+    """
+    blob = zlib.compress(json.dumps(outputs).encode("utf-8"), RAW_COMPRESS_LEVEL)
+    return (
+        db[RAW_COLLECTION]
+        .insert_one(
+            {
+                "ip": ip,
+                "collection": collection,
+                "commands": list(outputs),
+                "output": blob,
+                "fetched_at": datetime.now(UTC),
+                "status": "fetched",
+            }
+        )
+        .inserted_id
+    )
+
+
+def load_raw_output(raw_id):
+    """Return ``(document, {command: text})`` for a stored poll, or ``None``."""
+    doc = db[RAW_COLLECTION].find_one({"_id": raw_id})
+    if doc is None:
+        return None
+    return doc, json.loads(zlib.decompress(doc["output"]).decode("utf-8"))
+
+
+def mark_raw_output(raw_id, status, error=None):
+    db[RAW_COLLECTION].update_one(
+        {"_id": raw_id},
+        {
+            "$set": {
+                "status": status,
+                "parse_error": error,
+                "parsed_at": datetime.now(UTC),
+            }
+        },
+    )
+
+
+def _strip_volatile(value):
+    if isinstance(value, dict):
+        return {
+            key: _strip_volatile(item)
+            for key, item in value.items()
+            if key not in VOLATILE_FIELDS
+        }
+    if isinstance(value, list):
+        return [_strip_volatile(item) for item in value]
+    return value
+
+
+def poll_digest(results):
+    canonical = json.dumps(_strip_volatile(results), sort_keys=True, default=str)
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
 
-    if raw_output:
-        data["raw_output"] = raw_output
+def record_poll_digest(collection, ip, results):
+    """Mark the device document as changed when the polled state differs.
 
-    collection.insert_one(data)
-    client.close()
+    Nothing is written when the digest matches the previous poll. The
+    scheduler sees ``poll_changed_at`` move through its inventory change
+    stream and uses it to tighten the device's polling interval.
+    """
+    digest = poll_digest(results)
+    try:
+        db[collection].update_one(
+            {"ip": ip, "poll_digest": {"$ne": digest}},
+            {"$set": {"poll_digest": digest, "poll_changed_at": datetime.now(UTC)}},
+        )
+    except PyMongoError as e:
+        print(f"Failed to record poll digest for {ip}: {e}")
@@ -0,0 +1,294 @@
+"""Hand-written parsers for the show commands polled on every cycle.
+
+Each parser returns exactly the rows its ntc-templates template would, as
+dicts with lowercase keys, or ``None`` when it meets a line it does not
+fully understand. ``None`` makes the caller parse the whole output with
+TextFSM instead, so odd output costs time, never correctness.
+"""
+
+import re
+
+IP_INT_BRIEF_TEMPLATE = "cisco_ios_show_ip_interface_brief.textfsm"
+IP_ROUTE_TEMPLATE = "cisco_ios_show_ip_route.textfsm"
+INTERFACES_STATUS_TEMPLATE = "cisco_ios_show_interfaces_status.textfsm"
+
+# Tabs, carriage returns and friends would make \s and splitlines() disagree
+# with the plain str.split() used below.
+_ODD_WHITESPACE = re.compile(r"[^\S \n]")
+_WORD = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_")
+_DIGITS = frozenset("0123456789")
+
+
+def _plain(output):
+    return output.isascii() and not _ODD_WHITESPACE.search(output)
+
+
+def _is_word(token):
+    return all(char in _WORD for char in token)
+
+
+def parse_ip_int_brief(output):
+    if not _plain(output):
+        return None
+    rows = []
+    for line in output.splitlines():
+        if not line or line[0] == " ":
+            continue
+        tokens = line.split()
+        if len(tokens) < 6 or not _is_word(tokens[2]) or not _is_word(tokens[3]):
+            continue
+        status = tokens[4]
+        proto = 5
+        if status == "administratively" and tokens[5] == "down":
+            # The template spells this status with exactly one space.
+            if not line.split(None, 4)[4].startswith("administratively down"):
+                continue
+            status = "administratively down"
+            proto = 6
+        elif status not in ("up", "down", "deleted"):
+            continue
+        if proto >= len(tokens):
+            continue
+        # The template does not anchor PROTO, so "upx" still reads as "up".
+        if tokens[proto].startswith("up"):
+            protocol = "up"
+        elif tokens[proto].startswith("down"):
+            protocol = "down"
+        else:
+            continue
+        rows.append(
+            {
+                "interface": tokens[0],
+                "ip_address": tokens[1],
+                "status": status,
+                "proto": protocol,
+            }
+        )
+    return rows
+
+
+_PORT_STATUSES = frozenset(
+    (
+        "err-disabled",
+        "disabled",
+        "connected",
+        "notconnect",
+        "inactive",
+        "up",
+        "down",
+        "monitoring",
+        "suspended",
+    )
+)
+_NAMED_VLANS = frozenset(("trunk", "routed", "unassigned"))
+_STATUS_HEADER = re.compile(r"Port\s+Name\s+Status\s+Vlan\s+Duplex\s+Speed\s+Type")
+_STATUS_PREAMBLE = re.compile(r"Load\s+for\s+|Time\s+source\s+is|-+\s*$|\s*$")
+
+
+def _is_vlan(token):
+    if token in _NAMED_VLANS:
+        return True
+    return all(part and part.isdigit() for part in token.split(","))
+
+
+def _is_port_status(token):
+    return token in _PORT_STATUSES or (
+        token[-1:] == ":" and token[:-1] in _PORT_STATUSES
+    )
+
+
+def _port_row(port, name, status, vlan, duplex, speed, kind):
+    return {
+        "port": port,
+        "name": name,
+        "status": status,
+        "vlan_id": vlan,
+        "duplex": duplex,
+        "speed": speed,
+        "type": kind,
+        "fc_mode": "",
+    }
+
+
+def parse_interfaces_status(output):
+    if not _plain(output):
+        return None
+    rows = []
+    in_table = False
+    for line in output.splitlines():
+        if not in_table:
+            if _STATUS_HEADER.match(line):
+                in_table = True
+            elif not _STATUS_PREAMBLE.match(line):
+                # TextFSM raises on this; let it.
+                return None
+            continue
+        tokens = line.split()
+        if len(tokens) < 5:
+            if not tokens or line[0] == "-":
+                continue
+            return None
+        if tokens[1] == "is" or "pvlan" in tokens:
+            return None
+        if tokens[1] in _PORT_STATUSES:
+            # No description: port, status, vlan, duplex, speed, type.
+            if not _is_vlan(tokens[2]):
+                return None
+            fields = line.split(None, 5)
+            kind = fields[5] if len(fields) == 6 else ""
+            rows.append(_port_row(tokens[0], "", *tokens[1:5], kind))
+            continue
+        # The description is free text; it ends at the first status word.
+        status = next(
+            (i for i in range(2, len(tokens)) if _is_port_status(tokens[i])), None
+        )
+        if (
+            status is None
+            or tokens[status][-1] == ":"
+            or status + 3 >= len(tokens)
+            or not _is_vlan(tokens[status + 1])
+            # The template would take the next token as the VLAN instead.
+            or _is_vlan(tokens[status + 2])
+            or _is_port_status(tokens[1])
+        ):
+            return None
+        after_port = line.split(None, 1)[1]
+        from_status = line.split(None, status)[status]
+        name = after_port[: -len(from_status)].rstrip()
+        fields = from_status.split(None, 4)
+        kind = fields[4] if len(fields) == 5 else ""
+        rows.append(_port_row(tokens[0], name, *fields[:4], kind))
+    return rows
+
+
+# Pieces of the route template, each matched at a known position. Only
+# plain dotted quads are accepted: the template's "\d{1,3}." wildcards read
+# anything else in ways not worth copying.
+_QUAD = r"\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}(?!\d)"
+_TAIL = r"(?:, (\d[\w:.]+))?(?:, ([A-Za-z][\w\-.:/]+))?"
+_ROUTE_HEAD = re.compile(r"(\w)([ *%p])(\w{0,2}) +(?=\d)", re.ASCII)
+_NETWORK = re.compile(_QUAD, re.ASCII)
+_PREFIX = re.compile(r"/(\d{1,2})(?!\d)", re.ASCII)
+_SUBNETTED = re.compile(r" +" + _QUAD + r"/(\d{1,2}) is", re.ASCII)
+_CONNECTED = re.compile(r" is directly connected" + _TAIL, re.ASCII)
+_CONNECTED_CLASSFUL = re.compile(
+    r" is directly connected, ([A-Za-z][\w\-.:/]+)", re.ASCII
+)
+_VIA = re.compile(r" \[(\d+)/(\d+)\] via (" + _QUAD + ")" + _TAIL, re.ASCII)
+
+
+def parse_ip_route(output):
+    if not _plain(output):
+        return None
+    rows = []
+    append = rows.append
+    # Filldown values carry over from a route line to its continuations.
+    protocol = route_type = network = prefix_length = flag = None
+    in_routes = False
+
+    def record(distance, metric, nexthop, uptime, interface):
+        if network:
+            append(
+                {
+                    "vrf": "",
+                    "protocol": protocol,
+                    "type": route_type,
+                    "network": network,
+                    "prefix_length": prefix_length or "",
+                    "distance": distance or "",
+                    "metric": metric or "",
+                    "nexthop_ip": nexthop or "",
+                    "nexthop_vrf": "",
+                    "nexthop_if": interface or "",
+                    "uptime": uptime or "",
+                    "flag": flag or "",
+                }
+            )
+
+    for line in output.splitlines():
+        if line.startswith("Routing"):
+            # Per-VRF tables; leave the VRF bookkeeping to TextFSM.
+            return None
+        if not in_routes:
+            in_routes = line.startswith("Gateway")
+            continue
+        if not line:
+            continue
+
+        if line[0] == " ":
+            rest = line.lstrip(" ")
+            if not rest:
+                continue
+            if rest[0] == "[":
+                # Next hop of the route above, or another equal-cost path.
+                match = _VIA.match(line, len(line) - len(rest) - 1)
+                if match is None:
+                    return None
+                record(*match.groups())
+                flag = None
+            elif rest[0] in _DIGITS:
+                # "10.0.0.0/8 is variably subnetted": mask for the routes below.
+                match = _SUBNETTED.match(line)
+                if match is None:
+                    return None
+                prefix_length = match.group(1)
+                flag = None
+            continue
+
+        head = _ROUTE_HEAD.match(line)
+        if head is None:
+            continue
+        match = _NETWORK.match(line, head.end())
+        if match is None:
+            return None
+        end = match.end()
+        route = match.group()
+        prefix = _PREFIX.match(line, end)
+        if prefix is not None:
+            end = prefix.end()
+        if end < len(line) and line[end] != " ":
+            return None
+
+        via = None
+        if prefix is not None:
+            connected = _CONNECTED.match(line, end)
+        else:
+            connected = _CONNECTED_CLASSFUL.match(line, end)
+            if connected is None and line.startswith(" is directly", end):
+                return None
+        if connected is None and line.startswith(" [", end):
+            # Null routes ("[1/0], 00:00:10, Null0") and next hops in another
+            # VRF are rare enough to leave to TextFSM.
+            via = _VIA.match(line, end)
+            if via is None or " (" in line:
+                return None
+        elif connected is None and (
+            line.startswith(" is a summary", end)
+            or (prefix is None and line[end:].strip())
+        ):
+            return None
+
+        protocol, flag, route_type = head.groups()
+        flag = None if flag == " " else flag
+        network = route
+        if prefix is not None:
+            prefix_length = prefix.group(1)
+        if connected is not None:
+            if prefix is not None:
+                uptime, interface = connected.groups()
+            else:
+                uptime, interface = None, connected.group(1)
+            record(None, None, None, uptime, interface)
+            flag = None
+        elif via is not None:
+            record(*via.groups())
+            flag = None
+        # Otherwise the network stands alone and the next line records it.
+    return rows
+
+
+PARSERS = {
+    IP_INT_BRIEF_TEMPLATE: parse_ip_int_brief,
+    IP_ROUTE_TEMPLATE: parse_ip_route,
+    INTERFACES_STATUS_TEMPLATE: parse_interfaces_status,
+}
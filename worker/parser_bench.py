@@ -0,0 +1,172 @@
+"""Check the hand-written parsers against TextFSM and time them.
+
+    python parser_bench.py check [--variants 300]
+    python parser_bench.py bench [--routes 20000] [--repeat 5]
+
+``check`` parses every file in ``parser_corpus/`` (named after the command,
+e.g. ``show_ip_route__ospf.txt``) plus randomly mangled copies of each, with
+and without the fast parsers, and fails on any difference. ``bench`` times
+both on a synthetic routing table.
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+from textfsm import TextFSMError
+
+from fast_parsers import PARSERS
+from parsing import templates
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parser_corpus")
+
+
+def _parse(command, output, fast):
+    try:
+        return templates.parse(command, output, fast=fast)
+    except TextFSMError as exc:
+        return f"TextFSMError: {exc}"
+
+
+def _handled(command, output):
+    """True if the fast parser took the output rather than falling back."""
+    names = templates._lookup("cisco_ios", command)
+    return PARSERS[names[0]](output) is not None
+
+
+def _mangle(text, rng):
+    lines = text.splitlines()
+    if not lines:
+        return text
+    i = rng.randrange(len(lines))
+    line = lines[i]
+    pos = rng.randrange(len(line) + 1)
+    choice = rng.randrange(6)
+    if choice == 0:
+        del lines[i]
+    elif choice == 1:
+        lines.insert(i, line)
+    elif choice == 2:
+        lines[i] = line[:pos] + " " + line[pos:]
+    elif choice == 3:
+        lines[i] = line[:pos] + line[pos:][1:]
+    elif choice == 4:
+        lines[i] = line[:pos] + rng.choice("0/.,:[]*-aZ\t") + line[pos:]
+    else:
+        lines[i] = line[:pos]
+    return "\n".join(lines) + "\n"
+
+
+def check(variants, seed):
+    rng = random.Random(seed)
+    failures = 0
+    for name in sorted(os.listdir(CORPUS_DIR)):
+        command = name.split("__")[0].replace("_", " ")
+        with open(os.path.join(CORPUS_DIR, name), encoding="utf-8") as f:
+            original = f.read()
+        handled = 0
+        for n in range(variants + 1):
+            text = original if n == 0 else _mangle(original, rng)
+            # Mangle a few times over so differences can pile up.
+            for _ in range(n % 4):
+                text = _mangle(text, rng)
+            expected = _parse(command, text, fast=False)
+            if _parse(command, text, fast=True) != expected:
+                failures += 1
+                print(f"MISMATCH {name} variant {n}:\n{text}")
+                continue
+            handled += _handled(command, text)
+        fallback = "" if _handled(command, original) else " (falls back)"
+        print(f"{name}: ok{fallback}, fast path on {handled}/{variants + 1}")
+    return failures
+
+
+def route_table(routes, seed=0):
+    """A ``show ip route`` with roughly ``routes`` entries."""
+    rng = random.Random(seed)
+    lines = [
+        "Codes: L - local, C - connected, S - static, O - OSPF, B - BGP",
+        "",
+        "Gateway of last resort is 10.0.15.1 to network 0.0.0.0",
+        "",
+        "S*    0.0.0.0/0 [1/0] via 10.0.15.1",
+    ]
+    count = 1
+    second = 0
+    while count < routes:
+        lines.append(f"      10.{second}.0.0/16 is variably subnetted, 256 subnets")
+        for third in range(256):
+            network = f"10.{second}.{third}.0/24"
+            kind = rng.randrange(5)
+            if kind == 0:
+                lines.append(f"C        {network} is directly connected, Vlan{third}")
+            elif kind == 1:
+                lines.append(
+                    f"O IA     {network} [110/{third}] via 10.0.15.2, "
+                    f"1d02h, GigabitEthernet1"
+                )
+                lines.append(
+                    "                 [110/{}] via 10.0.15.3, 1d02h, "
+                    "GigabitEthernet2".format(third)
+                )
+                count += 1
+            elif kind == 2:
+                lines.append(f"B        {network} [20/0] via 203.0.113.{third}, 3w0d")
+            elif kind == 3:
+                lines.append(f"O E2     {network}")
+                lines.append(
+                    "           [110/20] via 10.0.15.2, 00:01:02, GigabitEthernet1"
+                )
+            else:
+                lines.append(f"S        {network} [1/0] via 10.0.15.{third}")
+            count += 1
+        second += 1
+    return "\n".join(lines) + "\n"
+
+
+def _best(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def bench(routes, repeat):
+    command = "show ip route"
+    text = route_table(routes)
+    # Compile the template outside the timed runs.
+    _parse(command, "", fast=False)
+    slow, expected = _best(lambda: _parse(command, text, False), repeat)
+    fast, result = _best(lambda: _parse(command, text, True), repeat)
+    if result != expected:
+        print("Fast parser output differs from TextFSM")
+        return 1
+    print(f"{len(result)} routes, best of {repeat}")
+    print(f"  TextFSM: {slow * 1000:8.1f} ms")
+    print(f"  fast:    {fast * 1000:8.1f} ms  ({slow / fast:.1f}x)")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="mode", required=True)
+    check_args = commands.add_parser("check")
+    check_args.add_argument("--variants", type=int, default=300)
+    check_args.add_argument("--seed", type=int, default=1)
+    bench_args = commands.add_parser("bench")
+    bench_args.add_argument("--routes", type=int, default=20000)
+    bench_args.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    if args.mode == "check":
+        failures = check(args.variants, args.seed)
+        print(f"{failures} mismatches")
+        return 1 if failures else 0
+    return bench(args.routes, args.repeat)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
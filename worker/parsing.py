@@ -0,0 +1,152 @@
+import io
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import ntc_templates
+import textfsm
+from textfsm import clitable
+
+from fast_parsers import PARSERS
+
+TEMPLATE_DIR = os.getenv("NET_TEXTFSM") or os.path.join(
+    os.path.dirname(ntc_templates.__file__), "templates"
+)
+PLATFORM = "cisco_ios"
+# 0 parses in the calling thread; N > 0 uses a pool of N processes.
+PARSE_PROCESSES = int(os.getenv("PARSE_PROCESSES", "0"))
+# Set to 0 to parse everything with TextFSM, e.g. to rule out a fast parser.
+FAST_PARSERS = os.getenv("FAST_PARSERS", "1") != "0"
+
+
+class TemplateCache:
+    """ntc-templates lookups and compiled TextFSM templates, kept per process.
+
+    The index is read once, each command is matched against it once, and
+    each template file is read once. Compiled FSMs carry parse state, so
+    every thread keeps its own compiled copy and resets it between parses.
+    """
+
+    def __init__(self, template_dir=TEMPLATE_DIR):
+        self.template_dir = template_dir
+        self._index = None
+        self._templates = {}
+        self._sources = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _lookup(self, platform, command):
+        key = (platform, command)
+        with self._lock:
+            if key not in self._templates:
+                if self._index is None:
+                    self._index = clitable.CliTable("index", self.template_dir).index
+                row = self._index.GetRowMatch(
+                    {"Platform": platform, "Command": command}
+                )
+                names = None
+                if row:
+                    names = self._index.index[row]["Template"].split(":")
+                self._templates[key] = names
+            return self._templates[key]
+
+    def _fsm(self, name):
+        fsms = getattr(self._local, "fsms", None)
+        if fsms is None:
+            fsms = self._local.fsms = {}
+        fsm = fsms.get(name)
+        if fsm is None:
+            with self._lock:
+                source = self._sources.get(name)
+                if source is None:
+                    path = os.path.join(self.template_dir, name)
+                    with open(path, encoding="utf-8") as f:
+                        source = self._sources[name] = f.read()
+            fsm = fsms[name] = textfsm.TextFSM(io.StringIO(source))
+        fsm.Reset()
+        return fsm
+
+    def parse(self, command, output, platform=PLATFORM, fast=FAST_PARSERS):
+        """Parse like netmiko's ``use_textfsm=True``.
+
+        Returns a list of dicts with lowercase keys, or ``output`` unchanged
+        when no template matches or the template yields no rows. Commands
+        with a hand-written parser in ``fast_parsers`` skip TextFSM unless
+        ``fast`` is false or that parser gives up on the output.
+        """
+        names = self._lookup(platform, command)
+        if not names:
+            return output
+        fast = fast and PARSERS.get(names[0])
+        if fast:
+            rows = fast(output)
+            if rows is not None:
+                return rows or output
+        if len(names) > 1:
+            # Multi-template entries need CliTable's row merging.
+            table = clitable.CliTable("index", self.template_dir)
+            table.ParseCmd(output, {"Platform": platform, "Command": command})
+            header = [column.lower() for column in table.header]
+            rows = [list(row) for row in table]
+        else:
+            fsm = self._fsm(names[0])
+            rows = fsm.ParseText(output)
+            header = [column.lower() for column in fsm.header]
+        if not rows:
+            return output
+        return [dict(zip(header, row)) for row in rows]
+
+
+templates = TemplateCache()
+
+
+def _parse_all(outputs):
+    return {command: templates.parse(command, raw) for command, raw in outputs.items()}
+
+
+def _preload(commands):
+    # Compile the templates up front instead of on the first job.
+    _parse_all({command: "" for command in commands})
+
+
+class Parser:
+    """Turns raw command output into structured data.
+
+    With ``processes`` > 0 parsing runs in a process pool, so large outputs
+    such as full routing tables do not hold this process's GIL while other
+    threads are doing SSH I/O. ``preload`` names the commands whose
+    templates every process compiles when it starts.
+    """
+
+    def __init__(self, processes=PARSE_PROCESSES, preload=()):
+        self.processes = processes
+        self.preload = tuple(preload)
+        self._pool = None
+        self._lock = threading.Lock()
+        if processes <= 0:
+            _preload(self.preload)
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    # Forking a process with live threads is not safe.
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_preload,
+                    initargs=(self.preload,),
+                )
+            return self._pool
+
+    def parse_all(self, outputs):
+        """Parse ``{command: raw output}``; returns ``{command: parsed}``."""
+        if self.processes <= 0:
+            return _parse_all(outputs)
+        return self._executor().submit(_parse_all, outputs).result()
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
@@ -0,0 +1,96 @@
+"""Queue stored raw polls for parsing again, e.g. after a template fix.
+
+    python reparse.py                    # latest stored poll of every device
+    python reparse.py --ip 10.0.15.133   # ... of one device
+    python reparse.py --failed           # every poll whose parse failed
+    python reparse.py --all --since 2026-10-01
+
+Needs COLLECT_MODE=staged on the polling workers, since only then is raw
+output kept, and a worker with WORKER_ROLE parse or all to do the parsing.
+A poll that failed before adds its history entry at its original time. A
+poll parsed before adds no second entry; it only refreshes the current state
+of its device, and only while no newer poll has been stored.
+"""
+
+import os
+import json
+import argparse
+from datetime import datetime, UTC
+
+import pika
+
+from callback import PARSE_QUEUE
+from database import db, RAW_COLLECTION
+
+
+def _utc(value):
+    moment = datetime.fromisoformat(value)
+    return moment if moment.tzinfo else moment.replace(tzinfo=UTC)
+
+
+def select(ip=None, since=None, failed=False, every=False):
+    """Return the ids of the raw polls to parse again."""
+    match = {}
+    if ip:
+        match["ip"] = ip
+    if since:
+        match["fetched_at"] = {"$gte": since}
+    if failed:
+        match["status"] = "error"
+    if failed or every:
+        return [doc["_id"] for doc in db[RAW_COLLECTION].find(match, {"_id": 1})]
+    latest = db[RAW_COLLECTION].aggregate(
+        [
+            {"$match": match},
+            {"$sort": {"fetched_at": -1}},
+            {
+                "$group": {
+                    "_id": {"ip": "$ip", "collection": "$collection"},
+                    "raw_id": {"$first": "$_id"},
+                }
+            },
+        ]
+    )
+    return [doc["raw_id"] for doc in latest]
+
+
+def publish(raw_ids, host):
+    creds = pika.PlainCredentials(
+        os.getenv("RABBITMQ_DEFAULT_USER"), os.getenv("RABBITMQ_DEFAULT_PASS")
+    )
+    conn = pika.BlockingConnection(pika.ConnectionParameters(host, credentials=creds))
+    try:
+        ch = conn.channel()
+        ch.queue_declare(queue=PARSE_QUEUE, durable=True)
+        ch.confirm_delivery()
+        for raw_id in raw_ids:
+            ch.basic_publish(
+                exchange="",
+                routing_key=PARSE_QUEUE,
+                body=json.dumps({"raw_id": str(raw_id)}),
+                properties=pika.BasicProperties(delivery_mode=2),
+            )
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ip", help="only this device")
+    parser.add_argument(
+        "--since",
+        type=_utc,
+        help="only polls at or after this UTC time, e.g. 2026-10-01T08:00",
+    )
+    parser.add_argument("--failed", action="store_true", help="failed parses only")
+    parser.add_argument("--all", action="store_true", help="every matching poll")
+    parser.add_argument("--host", default=os.getenv("RABBITMQ_HOST", "localhost"))
+    args = parser.parse_args()
+
+    raw_ids = select(args.ip, args.since, args.failed, args.all)
+    publish(raw_ids, args.host)
+    print(f"Queued {len(raw_ids)} stored polls on {PARSE_QUEUE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import os
+import socket
+import threading
+from datetime import datetime, timedelta, UTC
+
+from pymongo.errors import CollectionInvalid, DuplicateKeyError, PyMongoError
+
+from database import db
+
+HISTORY_TTL_DAYS = float(os.getenv("HISTORY_TTL_DAYS", "30"))
+ROLLUP_AFTER_DAYS = float(os.getenv("ROLLUP_AFTER_DAYS", "7"))
+ROLLUP_INTERVAL = float(os.getenv("ROLLUP_INTERVAL", "3600"))
+# Upper bound on how many hours one rollup run processes per collection.
+ROLLUP_MAX_HOURS = int(os.getenv("ROLLUP_MAX_HOURS", "48"))
+
+# collection -> (metaField, array field, item name field, "up" status value)
+HISTORY_COLLECTIONS = {
+    "interface_status": ("router_ip", "interfaces", "interface", "up"),
+    "route_table": ("router_ip", "route", None, None),
+    "switch_status": ("switch_ip", "ports", "port", "connected"),
+}
+
+
+def ensure_history_collections():
+    """Create the poll history collections as time-series collections.
+
+    Existing time-series collections get their TTL updated to
+    ``HISTORY_TTL_DAYS``. A plain collection left over from an older
+    deployment cannot be converted in place and is only reported. The
+    ``<name>_hourly`` rollups get their indexes and TTL from ``schema``.
+    """
+    expire = int(HISTORY_TTL_DAYS * 86400) if HISTORY_TTL_DAYS > 0 else None
+    existing = {
+        info["name"]: info
+        for info in db.list_collections(
+            filter={"name": {"$in": list(HISTORY_COLLECTIONS)}}
+        )
+    }
+    for name, (meta, _, _, _) in HISTORY_COLLECTIONS.items():
+        info = existing.get(name)
+        if info is None:
+            options = {
+                "timeseries": {
+                    "timeField": "timestamp",
+                    "metaField": meta,
+                    "granularity": "seconds",
+                }
+            }
+            if expire:
+                options["expireAfterSeconds"] = expire
+            try:
+                db.create_collection(name, **options)
+                print(f"Created time-series collection {name}")
+            except CollectionInvalid:
+                # Another worker replica created it first.
+                pass
+        elif info.get("type") == "timeseries":
+            db.command("collMod", name, expireAfterSeconds=expire if expire else "off")
+        else:
+            print(
+                f"{name} is a plain collection; drop or rename it to switch "
+                "to a time-series collection with retention"
+            )
+
+
+def _rollup_pipeline(name, start, end):
+    meta, field, key, up = HISTORY_COLLECTIONS[name]
+    hour = {"$dateTrunc": {"date": "$timestamp", "unit": "hour"}}
+    pipeline = [{"$match": {"timestamp": {"$gte": start, "$lt": end}}}]
+    if key is None:
+        # Routes: keep the size range and the last table seen in the hour.
+        pipeline += [
+            {"$sort": {"timestamp": 1}},
+            {
+                "$group": {
+                    "_id": {meta: f"${meta}", "hour": hour},
+                    "samples": {"$sum": 1},
+                    "count_min": {"$min": {"$size": {"$ifNull": [f"${field}", []]}}},
+                    "count_max": {"$max": {"$size": {"$ifNull": [f"${field}", []]}}},
+                    field: {"$last": f"${field}"},
+                }
+            },
+        ]
+    else:
+        # Interfaces/ports: how many samples each one was up in the hour.
+        pipeline += [
+            {"$unwind": f"${field}"},
+            {
+                "$group": {
+                    "_id": {meta: f"${meta}", "hour": hour, key: f"${field}.{key}"},
+                    "samples": {"$sum": 1},
+                    "up_samples": {
+                        "$sum": {"$cond": [{"$eq": [f"${field}.status", up]}, 1, 0]}
+                    },
+                }
+            },
+            {
+                "$group": {
+                    "_id": {meta: f"$_id.{meta}", "hour": "$_id.hour"},
+                    "samples": {"$max": "$samples"},
+                    field: {
+                        "$push": {
+                            key: f"$_id.{key}",
+                            "samples": "$samples",
+                            "up_samples": "$up_samples",
+                        }
+                    },
+                }
+            },
+        ]
+    pipeline += [
+        {"$set": {meta: f"$_id.{meta}", "hour": "$_id.hour"}},
+        {"$unset": "_id"},
+        {
+            "$merge": {
+                "into": f"{name}_hourly",
+                "on": [meta, "hour"],
+                "whenMatched": "replace",
+                "whenNotMatched": "insert",
+            }
+        },
+    ]
+    return pipeline
+
+
+def rollup(name, now=None):
+    """Summarise raw polls older than ``ROLLUP_AFTER_DAYS`` into hourly docs."""
+    now = now or datetime.now(UTC)
+    cutoff = (now - timedelta(days=ROLLUP_AFTER_DAYS)).replace(
+        minute=0, second=0, microsecond=0
+    )
+    state = db["rollup_state"].find_one({"_id": name}) or {}
+    start = state.get("rolled_until")
+    if start is None:
+        oldest = db[name].find_one(sort=[("timestamp", 1)], projection={"timestamp": 1})
+        if oldest is None:
+            return
+        start = oldest["timestamp"].replace(minute=0, second=0, microsecond=0)
+    start = start.replace(tzinfo=UTC) if start.tzinfo is None else start
+    end = min(cutoff, start + timedelta(hours=ROLLUP_MAX_HOURS))
+    if end <= start:
+        return
+    db[name].aggregate(_rollup_pipeline(name, start, end))
+    db["rollup_state"].update_one(
+        {"_id": name}, {"$set": {"rolled_until": end}}, upsert=True
+    )
+    print(f"Rolled up {name} from {start:%Y-%m-%d %H:%M} to {end:%Y-%m-%d %H:%M}")
+
+
+def _acquire_lease(now):
+    # Only one worker replica runs the rollup per interval.
+    try:
+        result = db["rollup_state"].update_one(
+            {"_id": "lease", "until": {"$lt": now}},
+            {
+                "$set": {
+                    "until": now + timedelta(seconds=ROLLUP_INTERVAL),
+                    "holder": socket.gethostname(),
+                }
+            },
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        return False
+    return result.modified_count == 1 or result.upserted_id is not None
+
+
+def _rollup_loop(stop):
+    while not stop.is_set():
+        try:
+            if _acquire_lease(datetime.now(UTC)):
+                for name in HISTORY_COLLECTIONS:
+                    rollup(name)
+        except PyMongoError as e:
+            print(f"History rollup failed: {e}")
+        stop.wait(ROLLUP_INTERVAL)
+
+
+def start_rollup():
+    stop = threading.Event()
+    threading.Thread(
+        target=_rollup_loop, args=(stop,), name="history-rollup", daemon=True
+    ).start()
+    return stop
@@ -18,6 +18,8 @@ def _build_device(creds, override_secret=None):
     }
     secret = override_secret or creds.get("secret") or creds["password"]
     device["secret"] = secret
+    if creds.get("port"):
+        device["port"] = int(creds["port"])
     return device
 
 
@@ -28,15 +30,27 @@ def normalize_loopback(loopback_id):
     return f"Loopback{match.group(1)}"
 
 
-def create_loopback(creds, loopback_id, ip_address, netmask, secret=None):
-    interface = normalize_loopback(loopback_id)
-    device = _build_device(creds, override_secret=secret)
-
-    commands = [
+def loopback_commands(interface, ip_address, netmask):
+    return [
         f"interface {interface}",
         f"ip address {ip_address} {netmask}",
         "no shutdown",
     ]
+
+
+def loopback_state_commands(interface, enabled):
+    return [f"interface {interface}", "no shutdown" if enabled else "shutdown"]
+
+
+def delete_loopback_commands(interface):
+    return [f"no interface {interface}"]
+
+
+def create_loopback(creds, loopback_id, ip_address, netmask, secret=None):
+    interface = normalize_loopback(loopback_id)
+    device = _build_device(creds, override_secret=secret)
+
+    commands = loopback_commands(interface, ip_address, netmask)
     try:
         with ConnectHandler(**device) as conn:
             try:
@@ -65,7 +79,6 @@ def create_loopback(creds, loopback_id, ip_address, netmask, secret=None):
 def set_loopback_state(creds, loopback_id, enabled=True, secret=None):
     interface = normalize_loopback(loopback_id)
     device = _build_device(creds, override_secret=secret)
-    command = "no shutdown" if enabled else "shutdown"
     try:
         with ConnectHandler(**device) as conn:
             try:
@@ -76,7 +89,7 @@ def set_loopback_state(creds, loopback_id, enabled=True, secret=None):
                     False,
                     f"เข้าสู่ privileged mode ไม่สำเร็จ จึง{state} {interface} ไม่ได้: {exc}",
                 )
-            conn.send_config_set([f"interface {interface}", command])
+            conn.send_config_set(loopback_state_commands(interface, enabled))
     except NetmikoTimeoutException as exc:
         return False, f"เชื่อมต่อ {device['host']} ไม่สำเร็จ: {exc}"
     except NetmikoAuthenticationException as exc:
@@ -96,13 +109,16 @@ def set_loopback_state(creds, loopback_id, enabled=True, secret=None):
 def delete_loopback(creds, loopback_id, secret=None):
     interface = normalize_loopback(loopback_id)
     device = _build_device(creds, override_secret=secret)
-    commands = [f"no interface {interface}"]
+    commands = delete_loopback_commands(interface)
     try:
         with ConnectHandler(**device) as conn:
             try:
                 conn.enable()
             except Exception as exc:
-                return False, f"เข้าสู่ privileged mode ไม่ได้ จึงลบ {interface} ไม่ได้: {exc}"
+                return (
+                    False,
+                    f"เข้าสู่ privileged mode ไม่ได้ จึงลบ {interface} ไม่ได้: {exc}",
+                )
             conn.send_config_set(commands)
     except NetmikoTimeoutException as exc:
         return False, f"เชื่อมต่อ {device['host']} ไม่สำเร็จ: {exc}"
@@ -136,11 +152,15 @@ def normalize_network(destination, netmask=None):
     )
 
 
+def static_route_command(network, netmask, next_hop):
+    return f"ip route {network} {netmask} {next_hop}"
+
+
 def create_static_route(creds, destination, netmask, next_hop, secret=None):
     network_addr, mask, prefix = normalize_network(destination, netmask)
     ipaddress.IPv4Address(next_hop)
     device = _build_device(creds, override_secret=secret)
-    command = f"ip route {network_addr} {mask} {next_hop}"
+    command = static_route_command(network_addr, mask, next_hop)
     try:
         with ConnectHandler(**device) as conn:
             try:
@@ -170,7 +190,7 @@ def create_static_route(creds, destination, netmask, next_hop, secret=None):
 def delete_static_route(creds, network, netmask, next_hop, secret=None):
     ipaddress.IPv4Address(next_hop)
     device = _build_device(creds, override_secret=secret)
-    command = f"no ip route {network} {netmask} {next_hop}"
+    command = "no " + static_route_command(network, netmask, next_hop)
     try:
         with ConnectHandler(**device) as conn:
             try:
@@ -1,10 +1,14 @@
 import os
 import json
+import time
+import threading
+from collections import OrderedDict
 
-import ntc_templates
 from netmiko import ConnectHandler
 from paramiko.transport import Transport
 
+from parsing import Parser
+
 LEGACY_KEX = (
     "diffie-hellman-group14-sha1",
     "diffie-hellman-group-exchange-sha1",
@@ -20,66 +24,201 @@ for attr in ("_preferred_keys", "_preferred_pubkeys"):
             tuple(dict.fromkeys(LEGACY_KEYS + current)),
         )
 
+# vty budget: the scheduler polls a device at most once per interval I,
+# on any worker replica, and sends I with the job. The replica keeps its
+# session for SSH_POOL_IDLE_FACTOR * I afterwards, so its next poll of the
+# device reuses the login. With the factor below 2, at most one other
+# replica still holds an idle session when a poll starts: polling uses at
+# most two vty lines per device however many replicas run, leaving three of
+# IOS's default five for config jobs, check.py and operators. A login is
+# reused whenever the next poll lands on the same replica: every poll with
+# one replica, about 1/N of them with N. Jobs that carry no interval keep
+# their session for SSH_POOL_IDLE_TIMEOUT.
+SSH_POOL_MAX_SIZE = int(os.getenv("SSH_POOL_MAX_SIZE", "64"))
+SSH_POOL_IDLE_TIMEOUT = float(os.getenv("SSH_POOL_IDLE_TIMEOUT", "15"))
+SSH_POOL_IDLE_FACTOR = min(float(os.getenv("SSH_POOL_IDLE_FACTOR", "1.5")), 1.9)
 
-def get_interfaces(ip, username, password):
 
-    os.environ["NET_TEXTFSM"] = os.path.join(
-        os.path.dirname(ntc_templates.__file__), "templates"
-    )
+class _Session:
+    def __init__(self, device, now, idle_timeout):
+        self.device = device
+        self.conn = None
+        self.lock = threading.Lock()
+        self.last_used = now
+        self.idle_timeout = idle_timeout
 
-    device = {
-        "device_type": "cisco_ios",
-        "host": ip,
-        "username": username,
-        "password": password,
-        "secret": password,
-    }
-
-    with ConnectHandler(**device) as conn:
+    def connect(self):
+        ip = self.device["host"]
+        self.conn = ConnectHandler(**self.device)
         try:
-            conn.enable()
+            self.conn.enable()
         except Exception as exc:
             print(
                 f"Failed to enter enable mode on {ip}: {exc}. Continuing without enable."
             )
-        result = conn.send_command("show ip int br", use_textfsm=True)
-        conn.disconnect()
 
-    print(json.dumps(result, indent=2))
-    return result
+    def is_alive(self):
+        if self.conn is None:
+            return False
+        try:
+            return self.conn.is_alive()
+        except Exception:
+            return False
 
+    def close(self):
+        conn, self.conn = self.conn, None
+        if conn is not None:
+            try:
+                conn.disconnect()
+            except Exception:
+                pass
 
-def get_route_table(ip, username, password):
-    os.environ["NET_TEXTFSM"] = os.path.join(
-        os.path.dirname(ntc_templates.__file__), "templates"
-    )
-    device = {
-        "device_type": "cisco_ios",
-        "host": ip,
-        "username": username,
-        "password": password,
-        "secret": password,
-    }
 
-    with ConnectHandler(**device) as conn:
-        try:
-            conn.enable()
-        except Exception as exc:
-            print(
-                f"Failed to enter enable mode on {ip}: {exc}. Continuing without enable."
+class SessionPool:
+    """Worker-local pool of logged-in SSH sessions, one per device.
+
+    A session is used by one caller at a time. Each session is closed once
+    it has been idle for ``idle_factor`` times the poll interval it was last
+    used with (``idle_timeout`` seconds without one), by a background sweep
+    as well as on checkout so a quiet worker does not keep holding vty
+    lines. Once ``max_size`` sessions are open the least recently used idle
+    one is closed to make room.
+    """
+
+    def __init__(
+        self,
+        max_size=SSH_POOL_MAX_SIZE,
+        idle_timeout=SSH_POOL_IDLE_TIMEOUT,
+        idle_factor=SSH_POOL_IDLE_FACTOR,
+        clock=time.monotonic,
+    ):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.idle_factor = idle_factor
+        self.clock = clock
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self._stop = threading.Event()
+
+    def _ensure_sweeper(self):
+        if self._sweeper is None or not self._sweeper.is_alive():
+            self._stop = threading.Event()
+            self._sweeper = threading.Thread(
+                target=self._sweep, name="ssh-pool-sweeper", daemon=True
             )
-        result = conn.send_command("show ip route", use_textfsm=True)
-        conn.disconnect()
+            self._sweeper.start()
 
-    print(json.dumps(result, indent=2))
-    return result
+    def _sweep(self):
+        stop = self._stop
+        while not stop.wait(1):
+            with self._lock:
+                self._evict_idle()
 
+    @staticmethod
+    def _key(device):
+        return (device["host"], device.get("port", 22), device["username"])
 
-def get_switch_ports(ip, username, password):
-    os.environ["NET_TEXTFSM"] = os.path.join(
-        os.path.dirname(ntc_templates.__file__), "templates"
-    )
+    def _checkout(self, device):
+        key = self._key(device)
+        with self._lock:
+            self._ensure_sweeper()
+            self._evict_idle()
+            session = self._sessions.get(key)
+            if session is None:
+                if len(self._sessions) >= self.max_size and not self._evict_lru():
+                    # Every pooled session is busy: use a one-off session.
+                    session = _Session(device, self.clock(), self.idle_timeout)
+                    session.lock.acquire()
+                    return key, session, False
+                session = _Session(device, self.clock(), self.idle_timeout)
+                self._sessions[key] = session
+            self._sessions.move_to_end(key)
+        session.lock.acquire()
+        if session.device != device:
+            # Credentials changed since the session was opened.
+            session.close()
+            session.device = device
+        return key, session, True
+
+    def _checkin(self, key, session, pooled, interval=None):
+        session.last_used = self.clock()
+        if interval:
+            session.idle_timeout = self.idle_factor * float(interval)
+        if pooled:
+            with self._lock:
+                # Another caller may have discarded it while we held it.
+                pooled = self._sessions.get(key) is session
+        if not pooled:
+            session.close()
+        session.lock.release()
+
+    def _discard(self, key, session):
+        session.close()
+        with self._lock:
+            if self._sessions.get(key) is session:
+                del self._sessions[key]
+
+    def _evict_idle(self):
+        now = self.clock()
+        for key, session in list(self._sessions.items()):
+            if now - session.last_used < session.idle_timeout:
+                continue
+            if session.lock.acquire(blocking=False):
+                del self._sessions[key]
+                session.close()
+                session.lock.release()
 
+    def _evict_lru(self):
+        for key, session in list(self._sessions.items()):
+            if session.lock.acquire(blocking=False):
+                del self._sessions[key]
+                session.close()
+                session.lock.release()
+                return True
+        return False
+
+    def run(self, device, func, interval=None):
+        """Call ``func(conn)`` on a live session for ``device``.
+
+        ``interval`` is the time until the device's next poll, which decides
+        how long the session is kept. A failure on a reused session is
+        retried once on a fresh login, since the device may have dropped the
+        idle connection in the meantime.
+        """
+        for attempt in range(2):
+            key, session, pooled = self._checkout(device)
+            reused = session.conn is not None
+            try:
+                if not session.is_alive():
+                    session.close()
+                    reused = False
+                    session.connect()
+                result = func(session.conn)
+            except Exception as exc:
+                self._discard(key, session)
+                self._checkin(key, session, pooled)
+                if reused and attempt == 0:
+                    print(f"Session to {device['host']} failed ({exc}), reconnecting")
+                    continue
+                raise
+            self._checkin(key, session, pooled, interval)
+            return result
+
+    def close_all(self):
+        with self._lock:
+            self._stop.set()
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            with session.lock:
+                session.close()
+
+
+pool = SessionPool()
+
+
+def _build_device(ip, username, password, port=None):
     device = {
         "device_type": "cisco_ios",
         "host": ip,
@@ -87,20 +226,62 @@ def get_switch_ports(ip, username, password):
         "password": password,
         "secret": password,
     }
+    if port:
+        device["port"] = int(port)
+    return device
 
-    with ConnectHandler(**device) as conn:
-        try:
-            conn.enable()
-        except Exception as exc:
-            print(
-                f"Failed to enter enable mode on {ip}: {exc}. Continuing without enable."
-            )
-        result = conn.send_command("show interfaces status", use_textfsm=True)
-        conn.disconnect()
 
-    print(json.dumps(result, indent=2))
-    return result
+SHOW_INTERFACES = "show ip int br"
+SHOW_ROUTES = "show ip route"
+SHOW_SWITCH_PORTS = "show interfaces status"
+
+parser = Parser(preload=(SHOW_INTERFACES, SHOW_ROUTES, SHOW_SWITCH_PORTS))
+
+
+def fetch(ip, username, password, commands, port=None, interval=None):
+    """Run several show commands in one session; returns their raw text.
+
+    ``interval`` is the seconds until the device is polled again, if known.
+    """
+    device = _build_device(ip, username, password, port)
+
+    def run_commands(conn):
+        return {command: conn.send_command(command) for command in commands}
+
+    return pool.run(device, run_commands, interval)
+
+
+def collect(ip, username, password, commands, port=None, interval=None):
+    """Run several show commands in one session.
+
+    Returns a dict mapping each command to its TextFSM-parsed output (or the
+    raw text when no template matches).
+    """
+    # Parse after the session is back in the pool, not while holding it.
+    results = parser.parse_all(fetch(ip, username, password, commands, port, interval))
+
+    print(json.dumps(results, indent=2))
+    return results
+
+
+def get_interfaces(ip, username, password):
+    return collect(ip, username, password, [SHOW_INTERFACES])[SHOW_INTERFACES]
+
+
+def get_route_table(ip, username, password):
+    return collect(ip, username, password, [SHOW_ROUTES])[SHOW_ROUTES]
+
+
+def get_switch_ports(ip, username, password):
+    return collect(ip, username, password, [SHOW_SWITCH_PORTS])[SHOW_SWITCH_PORTS]
 
 
 if __name__ == "__main__":
-    get_route_table("10.0.15.133", "admin", "cisco")
+    # Defaults to the first device of ``simulator/server.py``.
+    collect(
+        os.getenv("DEVICE_IP", "127.1.0.1"),
+        os.getenv("DEVICE_USERNAME", "admin"),
+        os.getenv("DEVICE_PASSWORD", "cisco"),
+        [SHOW_ROUTES],
+        port=os.getenv("DEVICE_PORT", "2222"),
+    )
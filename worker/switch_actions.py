@@ -17,21 +17,19 @@ def _build_device(creds, override_secret=None):
     }
     secret = override_secret or creds.get("secret") or creds["password"]
     device["secret"] = secret
+    if creds.get("port"):
+        device["port"] = int(creds["port"])
     return device
 
 
-def _normalize_vlan(vlan_id):
+def normalize_vlan(vlan_id):
     match = re.fullmatch(r"(?:Vlan)?(\d+)", vlan_id.strip(), re.IGNORECASE)
     if not match:
         raise ValueError("VLAN ID ต้องเป็นตัวเลข เช่น 10 หรือ Vlan10")
     return int(match.group(1))
 
 
-def create_vlan_interface(creds, vlan_id, ip_address, netmask, name=None, secret=None):
-    vlan = _normalize_vlan(vlan_id)
-    interface = f"Vlan{vlan}"
-    device = _build_device(creds, override_secret=secret)
-
+def vlan_interface_commands(vlan, ip_address, netmask, name=None):
     commands = [
         f"vlan {vlan}",
     ]
@@ -40,11 +38,28 @@ def create_vlan_interface(creds, vlan_id, ip_address, netmask, name=None, secret
     commands.extend(
         [
             "exit",
-            f"interface {interface}",
+            f"interface Vlan{vlan}",
             f"ip address {ip_address} {netmask}",
             "no shutdown",
         ]
     )
+    return commands
+
+
+def vlan_state_commands(vlan, enabled):
+    return [f"interface Vlan{vlan}", "no shutdown" if enabled else "shutdown"]
+
+
+def delete_vlan_commands(vlan):
+    return [f"no interface Vlan{vlan}", f"no vlan {vlan}"]
+
+
+def create_vlan_interface(creds, vlan_id, ip_address, netmask, name=None, secret=None):
+    vlan = normalize_vlan(vlan_id)
+    interface = f"Vlan{vlan}"
+    device = _build_device(creds, override_secret=secret)
+
+    commands = vlan_interface_commands(vlan, ip_address, netmask, name)
 
     try:
         with ConnectHandler(**device) as conn:
@@ -74,10 +89,9 @@ def create_vlan_interface(creds, vlan_id, ip_address, netmask, name=None, secret
 
 
 def set_vlan_state(creds, vlan_id, enabled=True, secret=None):
-    vlan = _normalize_vlan(vlan_id)
+    vlan = normalize_vlan(vlan_id)
     interface = f"Vlan{vlan}"
     device = _build_device(creds, override_secret=secret)
-    command = "no shutdown" if enabled else "shutdown"
     try:
         with ConnectHandler(**device) as conn:
             try:
@@ -88,7 +102,7 @@ def set_vlan_state(creds, vlan_id, enabled=True, secret=None):
                     False,
                     f"เข้าสู่ privileged mode ไม่สำเร็จ จึง{state} {interface} ไม่ได้: {exc}",
                 )
-            conn.send_config_set([f"interface {interface}", command])
+            conn.send_config_set(vlan_state_commands(vlan, enabled))
     except NetmikoTimeoutException as exc:
         return False, f"เชื่อมต่อ {device['host']} ไม่สำเร็จ: {exc}"
     except NetmikoAuthenticationException as exc:
@@ -107,10 +121,10 @@ def set_vlan_state(creds, vlan_id, enabled=True, secret=None):
 
 
 def delete_vlan(creds, vlan_id, secret=None):
-    vlan = _normalize_vlan(vlan_id)
+    vlan = normalize_vlan(vlan_id)
     interface = f"Vlan{vlan}"
     device = _build_device(creds, override_secret=secret)
-    commands = [f"no interface {interface}", f"no vlan {vlan}"]
+    commands = delete_vlan_commands(vlan)
     try:
         with ConnectHandler(**device) as conn:
             try:
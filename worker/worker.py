@@ -1,4 +1,13 @@
 from consumer import consume
+from retention import ensure_history_collections, start_rollup
+from database import db
+from schema import ensure_indexes
 import os
 
+try:
+    ensure_history_collections()
+    ensure_indexes(db)
+except Exception as e:
+    print(f"Could not prepare collections: {e}")
+start_rollup()
 consume(os.getenv("RABBITMQ_HOST"))